@@ -0,0 +1,328 @@
+"""Pipeline benchmarks: extraction, payload selection, response handling, rendering, end to end and tenders.
+
+Run from the repository root:
+
+    python benchmarks/bench_pipeline.py [--pages 10 100 1000] [--repeat 3] [--latency 0.2] [--output run.json]
+
+Builds (or reuses) the synthetic corpus from corpus.py and starts the local fake
+Messages API from fake_messages_api.py, so no API key or network access is needed.
+Prints one JSON document with best/mean wall-clock timings per benchmark; save
+runs with --output and diff them to spot regressions.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+# Isolated caches and a generous rate limit, set before the app reads its config
+WORK_DIR = tempfile.mkdtemp(prefix="contract_app_bench_")
+os.environ["EXTRACTION_CACHE_DIR"] = os.path.join(WORK_DIR, "extraction")
+os.environ["RESPONSE_CACHE_DIR"] = os.path.join(WORK_DIR, "responses")
+os.environ.setdefault("ANTHROPIC_API_KEY", "bench")
+os.environ.setdefault("ANTHROPIC_MODEL", "claude-sonnet-4-5")
+for limit_key in ("ANTHROPIC_RPM", "ANTHROPIC_INPUT_TPM", "ANTHROPIC_OUTPUT_TPM"):
+    os.environ[limit_key] = "100000000"
+
+from contract_app import (FOCUS_KEYWORDS, align_contracts, assess_tender, build_analysis_view, cached_extract_text,  # noqa: E402
+                          cached_optimize_contract, compare_contracts_with_claude, create_area_scorecards,
+                          create_executive_summary, extract_text_with_stats, get_extraction_jobs, match_bullets,
+                          optimize_contract, optimize_contract_for_claude, parse_comparison_response,
+                          start_extraction_job, template_diff)
+from corpus import DEFAULT_CORPUS_DIR, FORMATS, build_corpus, make_redline  # noqa: E402
+from fake_messages_api import canned_reply, start_server  # noqa: E402
+
+FOCUS_AREAS = ["Pricing Structure", "Service Level Agreements", "Data Security", "Exit Strategy"]
+CUSTOM_WEIGHTS = {"Pricing Structure": 40, "Data Security": 30}
+
+
+def time_runs(func, repeat, setup=None):
+    """Best and mean wall-clock time of `repeat` runs; `setup` runs untimed before each."""
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {"best_seconds": round(min(timings), 5), "mean_seconds": round(sum(timings) / len(timings), 5),
+            "runs": repeat}
+
+
+def check_api_requests(benchmark, counts, expected):
+    """Fail unless every run reached the fake API exactly `expected` times (failed calls are retried or skipped)."""
+    if any(count != expected for count in counts):
+        raise RuntimeError(f"{benchmark}: expected {expected} API requests per run, the fake API saw {counts}")
+
+
+def clear_extraction_caches(memory_only=False):
+    cached_extract_text.clear()
+    if not memory_only:
+        shutil.rmtree(os.environ["EXTRACTION_CACHE_DIR"], ignore_errors=True)
+
+
+def bench_extraction(corpus, repeat):
+    """cached_extract_text cold (parse), from the extraction store and from the in-memory cache."""
+    results = []
+    for (pages, file_format), path in sorted(corpus.items()):
+        params = {"pages": pages, "format": file_format, "bytes": os.path.getsize(path)}
+        extract = lambda: extract_text_with_stats(path)  # noqa: E731
+        results.append({"benchmark": "extract_cold", "params": params,
+                        **time_runs(extract, repeat, clear_extraction_caches)})
+        results.append({"benchmark": "extract_store_hit", "params": params,
+                        **time_runs(extract, repeat, lambda: clear_extraction_caches(memory_only=True))})
+        results.append({"benchmark": "extract_memory_hit", "params": params, **time_runs(extract, repeat)})
+    return results
+
+
+def bench_optimization(texts, repeat):
+    """optimize_contract_for_claude with the memo cleared, for a few and for all focus areas."""
+    results = []
+    for pages, text in sorted(texts.items()):
+        for focus_areas in (FOCUS_AREAS, list(FOCUS_KEYWORDS)):
+            params = {"pages": pages, "chars": len(text), "focus_areas": len(focus_areas)}
+            results.append({"benchmark": "optimize_contract_for_claude", "params": params,
+                            **time_runs(lambda: optimize_contract_for_claude(text, focus_areas), repeat,
+                                        cached_optimize_contract.clear)})
+    return results
+
+
+def bench_alignment(pair_texts, repeat):
+    """align_contracts on two distinct contracts, with the tokens it sends against two optimised contracts."""
+    results = []
+    for pages, (text1, text2) in sorted(pair_texts.items()):
+        for focus_areas in (FOCUS_AREAS[:1], FOCUS_AREAS):
+            aligned = align_contracts(text1, text2, focus_areas)
+            optimized_tokens = sum(optimize_contract(text, focus_areas)["estimated_tokens"] for text in (text1, text2))
+            results.append({"benchmark": "align_contracts",
+                            "params": {"pages": pages, "chars": len(text1) + len(text2), "focus_areas": len(focus_areas)},
+                            **time_runs(lambda: align_contracts(text1, text2, focus_areas), repeat),
+                            "estimated_tokens": aligned["estimated_tokens"], "optimized_tokens": optimized_tokens,
+                            "clauses": aligned["clauses"], "pairs": aligned["pairs"],
+                            "pairs_sent": aligned["pairs_sent"], "unmatched_sent": aligned["unmatched_sent"]})
+    return results
+
+
+def bench_template_diff(texts, repeat):
+    """template_diff on a contract and a redline of it, with the tokens it sends against two optimised contracts."""
+    results = []
+    for pages, text in sorted(texts.items()):
+        redline = make_redline(text)
+        diffed = template_diff(text, redline, FOCUS_AREAS)
+        optimized_tokens = sum(optimize_contract(contract, FOCUS_AREAS)["estimated_tokens"] for contract in (text, redline))
+        results.append({"benchmark": "template_diff",
+                        "params": {"pages": pages, "chars": len(text) + len(redline), "focus_areas": len(FOCUS_AREAS)},
+                        **time_runs(lambda: template_diff(text, redline, FOCUS_AREAS), repeat),
+                        "estimated_tokens": diffed["estimated_tokens"], "optimized_tokens": optimized_tokens,
+                        "shared_ratio": round(diffed["shared_ratio"], 4), "changes": diffed["changes"],
+                        "shared_sent": diffed["shared_sent"], "shared_paragraphs": diffed["shared_paragraphs"]})
+    return results
+
+
+def canned_analysis(focus_areas):
+    """A full comparison response as the fake API would return it."""
+    body = {"messages": [{"role": "user", "content": f"FOCUS AREAS: {', '.join(focus_areas)}"}]}
+    return canned_reply(body)
+
+
+def bench_post_processing(repeat):
+    """JSON extraction and weighting, then the view and HTML built for the results tab."""
+    results = []
+    for focus_areas in (FOCUS_AREAS, list(FOCUS_KEYWORDS)):
+        response = canned_analysis(focus_areas)
+        params = {"focus_areas": len(focus_areas), "response_chars": len(response)}
+        results.append({"benchmark": "parse_comparison_response", "params": params,
+                        **time_runs(lambda: parse_comparison_response(response, focus_areas, CUSTOM_WEIGHTS),
+                                    repeat * 10)})
+
+        analysis_text, risk_analysis, _ = parse_comparison_response(response, focus_areas, CUSTOM_WEIGHTS)
+        results.append({"benchmark": "create_executive_summary", "params": params,
+                        **time_runs(lambda: create_executive_summary(analysis_text, risk_analysis,
+                                                                     "Contract A", "Contract B"), repeat * 10)})
+        results.append({"benchmark": "build_analysis_view", "params": params,
+                        **time_runs(lambda: build_analysis_view(analysis_text, risk_analysis, "Contract A", "Contract B"),
+                                    repeat * 10)})
+        results.append({"benchmark": "create_area_scorecards", "params": params,
+                        **time_runs(lambda: create_area_scorecards(risk_analysis), repeat * 10)})
+    return results
+
+
+def bench_bullet_matching(repeat, counts=(10, 100, 500)):
+    """match_bullets on two lists of `count` bullets, half of them reworded copies of the other list."""
+    rng = random.Random(42)
+    vocabulary = [keyword for keywords in FOCUS_KEYWORDS.values() for keyword in keywords]
+    results = []
+    for count in counts:
+        bullets1 = [" ".join(rng.choice(vocabulary) for _ in range(8)) for _ in range(count)]
+        bullets2 = ([f"The contract {bullet} as agreed" for bullet in bullets1[:count // 2]] +
+                    [" ".join(rng.choice(vocabulary) for _ in range(8)) for _ in range(count - count // 2)])
+        results.append({"benchmark": "match_bullets", "params": {"bullets": count},
+                        **time_runs(lambda: match_bullets(bullets1, bullets2), repeat)})
+    return results
+
+
+def bench_end_to_end(corpus_dir, page_counts, repeat, server_stats):
+    """Extract two distinct contracts, optimise them and compare them against the fake API.
+
+    The response cache is bypassed so every run reaches the (fake) endpoint, and
+    errors are raised so a failed run is never timed. Fan-out makes one request per
+    focus area plus the synthesis.
+    """
+    results = []
+    for pages in page_counts:
+        pair = [build_corpus(corpus_dir, [pages], ["txt"], seed)[(pages, "txt")] for seed in (42, 43)]
+        for mode, options, expected_requests in (("single", {}, 1),
+                                                 ("single_streamed", {"on_text": lambda text: None}, 1),
+                                                 ("fan_out", {"fan_out": True}, len(FOCUS_AREAS) + 1),
+                                                 ("aligned", {}, 1)):
+            call_stats = {}
+            request_counts = []
+
+            def run():
+                requests_before = server_stats["requests"]
+                texts = [extract_text_with_stats(path)[0] for path in pair]
+                if mode == "aligned":
+                    options["combined"] = align_contracts(texts[0], texts[1], FOCUS_AREAS)
+                    optimized = None
+                else:
+                    optimized = tuple(optimize_contract(text, FOCUS_AREAS) for text in texts)
+                compare_contracts_with_claude(texts[0], texts[1], FOCUS_AREAS, "", CUSTOM_WEIGHTS,
+                                              optimized_contracts=optimized, call_stats=call_stats,
+                                              use_cache=False, raise_errors=True, **options)
+                request_counts.append(server_stats["requests"] - requests_before)
+                if call_stats.get("parse_warnings"):
+                    raise RuntimeError(f"end_to_end {pages} pages {mode}: {'; '.join(call_stats['parse_warnings'])}")
+
+            def setup():
+                clear_extraction_caches()
+                cached_optimize_contract.clear()
+
+            timing = time_runs(run, repeat, setup)
+            check_api_requests(f"end_to_end {pages} pages {mode}", request_counts, expected_requests)
+            results.append({
+                "benchmark": "end_to_end", "params": {"pages": pages, "mode": mode, "focus_areas": len(FOCUS_AREAS)},
+                **timing,
+                "api_requests_per_run": expected_requests,
+                "last_run": {key: round(call_stats[key], 5) for key in
+                             ("api_time", "time_to_first_token", "queue_time", "prompt_build_time", "parse_time")
+                             if isinstance(call_stats.get(key), (int, float))},
+            })
+    return results
+
+
+def bench_tender(corpus_dir, pages, contract_counts, repeat, server_stats):
+    """Rank N distinct contracts of `pages` pages with one API request each; errors are raised, never timed."""
+    results = []
+    for count in contract_counts:
+        paths = [build_corpus(corpus_dir, [pages], ["txt"], seed)[(pages, "txt")] for seed in range(100, 100 + count)]
+        names = [os.path.basename(path) for path in paths]
+        call_stats = {}
+        request_counts = []
+
+        def run():
+            requests_before = server_stats["requests"]
+            jobs = [start_extraction_job(path) for path in paths]
+            assess_tender(jobs, names, FOCUS_AREAS, "", CUSTOM_WEIGHTS, call_stats=call_stats, use_cache=False,
+                          raise_errors=True)
+            request_counts.append(server_stats["requests"] - requests_before)
+
+        def setup():
+            clear_extraction_caches()
+            cached_optimize_contract.clear()
+            get_extraction_jobs()["jobs"].clear()
+
+        timing = time_runs(run, repeat, setup)
+        check_api_requests(f"tender {count} contracts", request_counts, count)
+        results.append({
+            "benchmark": "tender", "params": {"pages": pages, "contracts": count, "focus_areas": len(FOCUS_AREAS)},
+            **timing,
+            "api_requests_per_run": count,
+            "last_run": {key: round(call_stats[key], 5) for key in
+                         ("api_time", "time_to_first_token", "queue_time", "prompt_build_time", "parse_time")
+                         if isinstance(call_stats.get(key), (int, float))},
+        })
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000], help="Corpus sizes in pages")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--e2e-pages", type=int, nargs="+", default=[10, 100],
+                        help="Contract sizes for the end-to-end runs")
+    parser.add_argument("--tender-contracts", type=int, nargs="+", default=[2, 5, 10],
+                        help="Numbers of 10-page responses for the tender runs")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark (best and mean are reported)")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake API seconds to first byte")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0, help="Fake API output speed")
+    parser.add_argument("--corpus-dir", default=DEFAULT_CORPUS_DIR)
+    parser.add_argument("--skip", nargs="+", default=[], choices=["extract", "optimize", "post", "e2e", "tender"])
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    args = parser.parse_args(argv)
+
+    server, base_url, server_stats = start_server(latency=args.latency, tokens_per_second=args.tokens_per_second)
+    os.environ["ANTHROPIC_BASE_URL"] = base_url
+
+    results = []
+    try:
+        corpus = build_corpus(args.corpus_dir, args.pages, args.formats)
+        if "extract" not in args.skip:
+            results += bench_extraction(corpus, args.repeat)
+        if "optimize" not in args.skip:
+            texts = {pages: extract_text_with_stats(build_corpus(args.corpus_dir, [pages], ["txt"])[(pages, "txt")])[0]
+                     for pages in args.pages}
+            results += bench_optimization(texts, args.repeat)
+            pair_texts = {pages: (texts[pages], extract_text_with_stats(
+                build_corpus(args.corpus_dir, [pages], ["txt"], 43)[(pages, "txt")])[0]) for pages in args.pages}
+            results += bench_alignment(pair_texts, args.repeat)
+            results += bench_template_diff(texts, args.repeat)
+        if "post" not in args.skip:
+            results += bench_post_processing(args.repeat)
+            results += bench_bullet_matching(args.repeat)
+        if "e2e" not in args.skip:
+            results += bench_end_to_end(args.corpus_dir, args.e2e_pages, args.repeat, server_stats)
+        if "tender" not in args.skip:
+            results += bench_tender(args.corpus_dir, 10, args.tender_contracts, args.repeat, server_stats)
+    finally:
+        server.shutdown()
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    report = json.dumps({
+        "benchmark": "pipeline",
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "fake_api": {"latency_seconds": args.latency, "tokens_per_second": args.tokens_per_second},
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
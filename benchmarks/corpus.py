@@ -0,0 +1,199 @@
+"""Synthetic contract corpus for the benchmarks.
+
+Generates deterministic contracts with ARTICLE/SECTION headers and focus-area
+vocabulary, written as TXT, DOCX and PDF. Run from the repository root to build
+the corpus ahead of a benchmark run:
+
+    python benchmarks/corpus.py [--pages 10 100 1000] [--out-dir DIR]
+
+Files are named `contract_<pages>p_<seed>.<ext>` and reused if they already exist.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from contract_app import FOCUS_KEYWORDS  # noqa: E402
+
+FORMATS = ("txt", "docx", "pdf")
+DEFAULT_PAGE_COUNTS = (10, 100, 1000)
+DEFAULT_CORPUS_DIR = os.path.join(tempfile.gettempdir(), "contract_app_bench_corpus")
+
+# Roughly what fits on a printed page of a contract
+LINES_PER_PAGE = 45
+LINE_WIDTH = 90
+
+# Neutral contract wording that contains none of the focus keywords
+FILLER_WORDS = ("the", "supplier", "customer", "shall", "within", "days", "of", "written", "notice", "agreement",
+                "reasonable", "efforts", "obligations", "under", "this", "including", "without", "limitation",
+                "all", "applicable", "hosting", "environment", "promptly", "accordance", "provided", "such",
+                "any", "other", "by", "or", "and", "to", "in", "as", "be", "is")
+
+ARTICLE_TITLES = ("Definitions", "Fees and Payment", "Service Levels", "Implementation", "Scope of Services",
+                  "Maintenance and Support", "Data Protection", "Termination", "Intellectual Property",
+                  "Change Control", "Performance Reporting", "Liability", "Governing Law")
+
+
+def wrap_words(words, width=LINE_WIDTH):
+    """Greedy word wrap into lines of at most `width` characters."""
+    lines = []
+    line = ""
+    for word in words:
+        if line and len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def make_contract_pages(pages, seed=42, keyword_density=0.5):
+    """Build a contract as a list of pages, each a list of text lines.
+
+    Every few paragraphs start a new `SECTION a.b` and every few sections a new
+    `ARTICLE n - TITLE`. `keyword_density` is the share of paragraphs that mention
+    focus-area vocabulary. Paragraphs are separated by blank lines.
+    """
+    rng = random.Random(seed)
+    vocabulary = [keyword for keywords in FOCUS_KEYWORDS.values() for keyword in keywords]
+    lines = [f"MASTER SERVICES AGREEMENT {seed}", ""]
+    article = 0
+    section = 0
+    while len(lines) < pages * LINES_PER_PAGE:
+        if section == 0 or rng.random() < 0.15:
+            article += 1
+            section = 1
+            lines += [f"ARTICLE {article} - {rng.choice(ARTICLE_TITLES).upper()}", ""]
+        elif rng.random() < 0.3:
+            section += 1
+            lines += [f"SECTION {article}.{section}: {rng.choice(list(FOCUS_KEYWORDS))}", ""]
+
+        words = [rng.choice(FILLER_WORDS) for _ in range(rng.randint(40, 120))]
+        if rng.random() < keyword_density:
+            for _ in range(rng.randint(1, 3)):
+                words.insert(rng.randrange(len(words)), rng.choice(vocabulary))
+        words[0] = words[0].capitalize()
+        lines += wrap_words(words) + [""]
+
+    lines = lines[:pages * LINES_PER_PAGE]
+    return [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)]
+
+
+def make_redline(contract_text, seed=42, changes=6):
+    """A copy of a contract with a few paragraphs reworded, inserted or deleted, as two redlines of one template differ."""
+    rng = random.Random(seed)
+    paragraphs = contract_text.split("\n\n")
+    for _ in range(changes):
+        i = rng.randrange(len(paragraphs))
+        change = rng.random()
+        if change < 0.5:
+            paragraphs[i] = paragraphs[i].replace("days", "business days", 1).replace("shall", "must", 1)
+        elif change < 0.75:
+            paragraphs.insert(i, "The supplier shall maintain insurance and indemnify the customer against any penalty.")
+        else:
+            del paragraphs[i]
+    return "\n\n".join(paragraphs)
+
+
+def write_txt(pages, path):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(line for page in pages for line in page))
+
+
+def write_docx(pages, path):
+    """One paragraph per contract paragraph, with a page break between pages."""
+    import docx
+    from docx.enum.text import WD_BREAK
+
+    document = docx.Document()
+    for page in pages:
+        paragraph_lines = []
+        for line in page + [""]:
+            if line:
+                paragraph_lines.append(line)
+            elif paragraph_lines:
+                document.add_paragraph(" ".join(paragraph_lines))
+                paragraph_lines = []
+        document.add_paragraph().add_run().add_break(WD_BREAK.PAGE)
+    document.save(path)
+
+
+def pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(pages, path):
+    """Minimal PDF 1.4 writer: one Helvetica text stream per page, no external dependencies."""
+    page_count = len(pages)
+    font_id = 3 + 2 * page_count
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{3 + 2 * i} 0 R' for i in range(page_count))}] /Count {page_count} >>".encode(),
+    ]
+    for i, page in enumerate(pages):
+        content = "BT /F1 10 Tf 50 780 Td 16 TL " + " ".join(f"({pdf_escape(line)}) '" for line in page) + " ET"
+        content = content.encode("latin-1", "replace")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+                       f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>".encode())
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+WRITERS = {"txt": write_txt, "docx": write_docx, "pdf": write_pdf}
+
+
+def build_corpus(out_dir=DEFAULT_CORPUS_DIR, page_counts=DEFAULT_PAGE_COUNTS, formats=FORMATS, seed=42):
+    """Write (or reuse) one contract per page count and format; returns {(pages, format): path}."""
+    os.makedirs(out_dir, exist_ok=True)
+    corpus = {}
+    for pages in page_counts:
+        contract_pages = None
+        for file_format in formats:
+            path = os.path.join(out_dir, f"contract_{pages}p_{seed}.{file_format}")
+            if not os.path.exists(path):
+                if contract_pages is None:
+                    contract_pages = make_contract_pages(pages, seed)
+                # Write to a temporary name first so an interrupted run never leaves a truncated file
+                temp_path = f"{path}.tmp"
+                WRITERS[file_format](contract_pages, temp_path)
+                os.replace(temp_path, path)
+            corpus[(pages, file_format)] = path
+    return corpus
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=list(DEFAULT_PAGE_COUNTS))
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--out-dir", default=DEFAULT_CORPUS_DIR)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus(args.out_dir, args.pages, args.formats, args.seed)
+    print(json.dumps([
+        {"pages": pages, "format": file_format, "path": path, "bytes": os.path.getsize(path)}
+        for (pages, file_format), path in sorted(corpus.items())
+    ], indent=2))
+
+
+if __name__ == "__main__":
+    main()
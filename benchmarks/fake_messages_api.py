@@ -0,0 +1,269 @@
+"""Local stand-in for the Anthropic Messages endpoint, for end-to-end benchmarks.
+
+Answers POST /v1/messages with canned comparison text and JSON shaped like the
+real responses (single-call analysis, per-dimension fan-out, synthesis and tender assessments), with
+configurable latency and output speed, streaming (SSE) and usage figures
+including prompt caching. Message Batches are accepted too and end immediately.
+Streams the client closes early (cancelled analyses) are counted in `disconnects`.
+Point the app at it with ANTHROPIC_BASE_URL:
+
+    python benchmarks/fake_messages_api.py --port 8765 --latency 0.5 --tokens-per-second 80
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 streamlit run contract_app.py
+
+`start_server()` runs it in a background thread for use from the benchmarks.
+"""
+import argparse
+import hashlib
+import http.server
+import json
+import re
+import threading
+import time
+
+
+def stable_score(text):
+    """Deterministic 30-70 score, so repeated runs produce identical responses."""
+    return 30 + int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16) % 41
+
+
+def request_text(body):
+    """All text in a request's user messages."""
+    parts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block.get("text", "") for block in content or [])
+    return "\n".join(parts)
+
+
+def cached_prefix_text(body):
+    """Text of the user content blocks marked with cache_control."""
+    return "".join(block.get("text", "")
+                   for message in body.get("messages", []) if not isinstance(message.get("content"), str)
+                   for block in message["content"] or [] if block.get("cache_control"))
+
+
+def section(area):
+    return (f"### {area}\n#### Contract 1\n- **Clause 4.2** sets clear terms for {area.lower()}\n"
+            f"- Remedies are capped at 12 months of fees\n\n"
+            f"#### Contract 2\n- {area} terms are less specific\n- **No remedy** is defined for breaches")
+
+
+def canned_reply(body):
+    """Response text matching the kind of request the app sent."""
+    text = request_text(body)
+    dimension = re.search(r"one focus area only: (.+)", text)
+    if dimension:
+        area = dimension.group(1).strip()
+        score = stable_score(area)
+        return section(area) + "\n\n```json\n" + json.dumps({
+            "contract1_score": score, "contract2_score": 100 - score,
+            "contract1_advantages": [f"Clearer {area.lower()} terms"],
+            "contract1_disadvantages": [f"Higher {area.lower()} commitments"],
+            "contract2_advantages": [f"More flexible {area.lower()}"],
+            "contract2_disadvantages": [f"Vague {area.lower()} remedies"],
+        }) + "\n```"
+
+    tender = re.search(r"FOCUS AREAS TO ASSESS: (.+)", text)
+    if tender:
+        areas = [area.strip() for area in tender.group(1).split(",")]
+        # Scores differ between responses, so the ranking is not a tie
+        contract = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return "```json\n" + json.dumps({
+            "dimension_scores": {area: stable_score(area + contract) for area in areas},
+            "dimension_notes": {area: f"Clause 4.2 sets the {area.lower()} terms" for area in areas},
+            "strengths": ["Clear remedies", "Specific service levels", "Defined exit support"],
+            "weaknesses": ["Higher fees", "Longer minimum term", "Strict change control"],
+            "summary": "A solid response with clear service levels. Fees are above the market rate.",
+        }, indent=2) + "\n```"
+
+    if "Summarise the comparison as JSON" in text:
+        return "```json\n" + json.dumps({
+            "contract1_advantages": ["Clear remedies", "Specific service levels", "Defined exit support"],
+            "contract1_disadvantages": ["Higher fees", "Longer minimum term", "Strict change control"],
+            "contract2_advantages": ["Lower fees", "Flexible term", "Simple change process"],
+            "contract2_disadvantages": ["Vague remedies", "Weak service levels", "No exit assistance"],
+            "recommendation": "Contract 1 offers stronger protection; negotiate its fees down.",
+        }) + "\n```"
+
+    focus = re.search(r"FOCUS AREAS: (.+)", text)
+    areas = [area.strip() for area in focus.group(1).split(",")] if focus else ["Pricing", "Risk Allocation"]
+    scores = {area: stable_score(area) for area in areas}
+    return "\n\n".join(section(area) for area in areas) + "\n\n```json\n" + json.dumps({
+        "contract1_overall_score": sum(scores.values()) // len(scores),
+        "contract2_overall_score": 100 - sum(scores.values()) // len(scores),
+        "contract1_dimension_scores": scores,
+        "contract2_dimension_scores": {area: 100 - score for area, score in scores.items()},
+        "contract1_advantages": ["Clear remedies", "Specific service levels", "Defined exit support"],
+        "contract1_disadvantages": ["Higher fees", "Longer minimum term", "Strict change control"],
+        "contract2_advantages": ["Lower fees", "Flexible term", "Simple change process"],
+        "contract2_disadvantages": ["Vague remedies", "Weak service levels", "No exit assistance"],
+        "recommendation": "Contract 1 offers stronger protection; negotiate its fees down.",
+    }, indent=2) + "\n```"
+
+
+def make_handler(latency, tokens_per_second, stats):
+    """Request handler class bound to the given timing settings and shared counters."""
+
+    class FakeMessagesHandler(http.server.BaseHTTPRequestHandler):
+        # Keep-alive, so the app's connection pooling behaves as against the real API
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def make_message(self, body):
+            """The canned message for a request, with usage as the real API would report it"""
+            system_text = json.dumps(body.get("system"), sort_keys=True)
+            with stats["lock"]:
+                stats["requests"] += 1
+                # The first request for a prefix writes the prompt cache, later ones read it
+                prefix = hashlib.sha256((system_text + cached_prefix_text(body)).encode("utf-8")).hexdigest()
+                cached = prefix in stats["prefixes"]
+                stats["prefixes"].add(prefix)
+
+            reply = canned_reply(body)
+            input_tokens = (len(request_text(body)) + len(system_text)) // 4
+            # Treat the last tenth of the input as the uncached instructions
+            prefix_tokens = input_tokens - input_tokens // 10
+            usage = {
+                "input_tokens": input_tokens // 10,
+                "cache_creation_input_tokens": 0 if cached else prefix_tokens,
+                "cache_read_input_tokens": prefix_tokens if cached else 0,
+                "output_tokens": max(len(reply) // 4, 1),
+            }
+            return {
+                "id": f"msg_fake_{stats['requests']}", "type": "message", "role": "assistant",
+                "model": body.get("model", "claude-fake"), "content": [{"type": "text", "text": reply}],
+                "stop_reason": "end_turn", "stop_sequence": None, "usage": usage,
+            }
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+            if self.path.startswith("/v1/messages/batches"):
+                self.create_batch(body)
+                return
+
+            message = self.make_message(body)
+            time.sleep(latency)
+            if body.get("stream"):
+                self.stream_message(message, message["content"][0]["text"])
+            else:
+                time.sleep(message["usage"]["output_tokens"] / tokens_per_second)
+                self.send_json(message)
+
+        def do_GET(self):
+            # Message Batches: GET /v1/messages/batches/<id> and /v1/messages/batches/<id>/results
+            match = re.match(r"/v1/messages/batches/([\w-]+)(/results)?$", self.path.split("?")[0])
+            batch = stats["batches"].get(match.group(1)) if match else None
+            if batch is None:
+                self.send_json({"type": "error", "error": {"type": "not_found_error", "message": "Not found"}}, 404)
+            elif match.group(2):
+                data = "".join(json.dumps(line) + "\n" for line in batch["results"]).encode("utf-8")
+                self.send_response(200)
+                self.send_common_headers("application/binary")
+                self.send_header("content-length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            else:
+                self.send_json(batch["batch"])
+
+        def create_batch(self, body):
+            """Answer every request of a message batch at once; the batch has ended by the first poll"""
+            results = [{"custom_id": request["custom_id"],
+                        "result": {"type": "succeeded", "message": self.make_message(request["params"])}}
+                       for request in body.get("requests", [])]
+            with stats["lock"]:
+                batch_id = f"msgbatch_fake_{len(stats['batches']) + 1}"
+                now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+                batch = {
+                    "id": batch_id, "type": "message_batch", "processing_status": "ended",
+                    "request_counts": {"processing": 0, "succeeded": len(results), "errored": 0, "canceled": 0,
+                                       "expired": 0},
+                    "created_at": now, "ended_at": now, "expires_at": now, "archived_at": None,
+                    "cancel_initiated_at": None,
+                    "results_url": f"http://{self.headers.get('host')}/v1/messages/batches/{batch_id}/results",
+                }
+                stats["batches"][batch_id] = {"batch": batch, "results": results}
+            self.send_json(dict(batch, processing_status="in_progress"))
+
+        def send_json(self, data, status=200):
+            data = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_common_headers("application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_common_headers(self, content_type):
+            self.send_header("content-type", content_type)
+            self.send_header("request-id", f"req_fake_{stats['requests']}")
+            self.send_header("anthropic-ratelimit-requests-remaining", "1000")
+            self.send_header("anthropic-ratelimit-input-tokens-remaining", "1000000")
+            self.send_header("anthropic-ratelimit-output-tokens-remaining", "1000000")
+
+        def stream_message(self, message, reply):
+            """Server-sent events in the Messages streaming format, roughly 4 characters per token."""
+            self.send_response(200)
+            self.send_common_headers("text/event-stream")
+            self.send_header("connection", "close")
+            self.end_headers()
+
+            def event(name, data):
+                self.wfile.write(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            start = dict(message, content=[], usage=dict(message["usage"], output_tokens=1))
+            event("message_start", {"type": "message_start", "message": start})
+            event("content_block_start", {"type": "content_block_start", "index": 0,
+                                          "content_block": {"type": "text", "text": ""}})
+            chunk_chars = 40
+            try:
+                for i in range(0, len(reply), chunk_chars):
+                    time.sleep(chunk_chars / 4 / tokens_per_second)
+                    event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                  "delta": {"type": "text_delta", "text": reply[i:i + chunk_chars]}})
+            except (BrokenPipeError, ConnectionResetError):
+                # The app closed the stream (a cancelled analysis)
+                with stats["lock"]:
+                    stats["disconnects"] += 1
+                self.close_connection = True
+                return
+            event("content_block_stop", {"type": "content_block_stop", "index": 0})
+            event("message_delta", {"type": "message_delta",
+                                    "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                    "usage": {"output_tokens": message["usage"]["output_tokens"]}})
+            event("message_stop", {"type": "message_stop"})
+            self.close_connection = True
+
+    return FakeMessagesHandler
+
+
+def start_server(port=0, latency=0.2, tokens_per_second=200.0):
+    """Serve in a background thread; returns (server, base_url, stats)."""
+    stats = {"lock": threading.Lock(), "requests": 0, "prefixes": set(), "batches": {}, "disconnects": 0}
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency, tokens_per_second, stats))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before the first byte of each response")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0, help="Output generation speed")
+    args = parser.parse_args(argv)
+
+    server, base_url, _ = start_server(args.port, args.latency, args.tokens_per_second)
+    print(f"Fake Messages API listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,45 @@
 import streamlit as st
+from streamlit import runtime
 import pandas as pd
+import numpy as np
 import os
-import base64
+import sys
+import argparse
+import csv
 import anthropic
+import httpx
 import re
+import io
+import mmap
 import tempfile
+import tracemalloc
+import hashlib
+import threading
+import uuid
+import zlib
+import difflib
+from contextlib import contextmanager, nullcontext
 from PyPDF2 import PdfReader
+from pdf_worker import extract_pdf_page_range
 import docx
 from datetime import datetime
 import hmac
 import json
+import sqlite3
 import time
-from concurrent.futures import ThreadPoolExecutor
+import random
+import functools
+import bisect
+import pickle
+import cProfile
+import pstats
+import marshal
+import multiprocessing
+from types import ModuleType, SimpleNamespace
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
 
 def check_password():
     """Returns `True` if the user had a correct password."""
@@ -28,6 +56,8 @@ def check_password():
                 st.secrets.passwords[st.session_state["username"]],
             )):
             st.session_state["password_correct"] = True
+            # Kept for per-user features (admin tools, history)
+            st.session_state["authenticated_user"] = st.session_state["username"]
             del st.session_state["password"]
             del st.session_state["username"]
         else:
@@ -41,7 +71,12 @@ def check_password():
         st.error("😕 User not known or password incorrect")
     return False
 
-if not check_password():
+def running_in_streamlit():
+    """Returns `True` when the app is served by `streamlit run` rather than imported."""
+    return runtime.exists()
+
+# Imports (benchmarks, tooling) have no UI to protect
+if running_in_streamlit() and not check_password():
     st.stop()
 
 # Set page configuration
@@ -113,572 +148,2554 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Extract text functions
-@st.cache_data(ttl=3600, show_spinner=False)
-def cached_extract_text(file_bytes, file_name):
-    """Cached version of text extraction to avoid reprocessing the same file"""
-    file_extension = os.path.splitext(file_name)[1].lower()
+def get_config(key, default=None):
+    """Read a setting from Streamlit secrets, falling back to environment variables."""
+    try:
+        if key in st.secrets:
+            return st.secrets[key]
+    except Exception:
+        # No secrets file available, e.g. when running outside `streamlit run`
+        pass
+    return os.environ.get(key, default)
+
+# Persistent cache functions
+@st.cache_resource
+def get_cache_stats():
+    """Process-wide cache counters shared by every session on this server."""
+    return {"lock": threading.Lock(), "counters": {}}
+
+def record_cache_event(cache_name, event, count=1):
+    """Increment a hit/miss/write/eviction counter for the named cache."""
+    stats = get_cache_stats()
+    with stats["lock"]:
+        counters = stats["counters"].setdefault(
+            cache_name, {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        )
+        counters[event] += count
+
+def disk_cache_get(cache_name, cache_dir, key, max_idle_seconds=None, max_age_seconds=None):
+    """Return the record stored under `key`, or None, counting a hit or miss for `cache_name`.
+
+    An absent, corrupt or expired entry is a miss: unused for `max_idle_seconds`,
+    or stored (its "stored_at") more than `max_age_seconds` ago. Expired entries are
+    removed and corrupt ones are overwritten by the next write. A hit touches the
+    entry's mtime, which is what LRU eviction and expiry order by.
+    """
+    path = os.path.join(cache_dir, key)
+    record = None
+    try:
+        if max_idle_seconds is None or time.time() - os.stat(path).st_mtime <= max_idle_seconds:
+            with open(path, "rb") as f:
+                record = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+            if max_age_seconds is not None and time.time() - record.get("stored_at", 0) > max_age_seconds:
+                record = None
+        if record is None:
+            os.remove(path)
+            record_cache_event(cache_name, "evictions")
+    except (OSError, zlib.error, UnicodeDecodeError, ValueError):
+        # Absent, or corrupt and overwritten by the next write
+        record = None
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp:
-        temp.write(file_bytes)
-        temp_path = temp.name
+    if record is None:
+        record_cache_event(cache_name, "misses")
+        return None
     
     try:
-        if file_extension == ".pdf":
-            pdf_reader = PdfReader(temp_path)
-            return "\n".join(page.extract_text() for page in pdf_reader.pages)
-        elif file_extension == ".docx":
-            doc = docx.Document(temp_path)
-            return "\n".join(para.text for para in doc.paragraphs)
-        elif file_extension == ".txt":
-            with open(temp_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        else:
-            return "Unsupported file format. Please upload PDF, DOCX, or TXT files."
-    finally:
+        os.utime(path, None)
+    except OSError:
+        # Evicted by another process between the read and the touch
+        pass
+    record_cache_event(cache_name, "hits")
+    return record
+
+def disk_cache_put(cache_name, cache_dir, key, record, max_bytes, max_idle_seconds=None):
+    """Compress and atomically store `record` under `key`, then evict expired entries and old entries beyond `max_bytes`.
+
+    Writers go through a temp file and `os.replace`, so concurrent processes sharing
+    the directory never observe a partially written entry.
+    """
+    data = zlib.compress(json.dumps(record).encode("utf-8"), 1)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix=".tmp-")
+    except OSError:
+        return
+    
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, os.path.join(cache_dir, key))
+    except OSError:
         if os.path.exists(temp_path):
             os.remove(temp_path)
+        return
+    
+    record_cache_event(cache_name, "writes")
+    evicted = disk_cache_evict(cache_dir, max_bytes, max_idle_seconds)
+    if evicted:
+        record_cache_event(cache_name, "evictions", evicted)
 
-def extract_text(file):
-    """Extract text from various file formats."""
-    return cached_extract_text(file.getvalue(), file.name)
-
-def process_contracts_concurrently(contract1_file, contract2_file):
-    """Process contracts in parallel using ThreadPoolExecutor"""
+def disk_cache_evict(cache_dir, max_bytes, max_idle_seconds=None):
+    """Remove entries unused for `max_idle_seconds`, then least recently used ones until the directory fits in `max_bytes`."""
+    entries = []
+    total_size = 0
+    evicted = 0
+    now = time.time()
+    
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                try:
+                    entry_stat = entry.stat()
+                except OSError:
+                    continue
+                
+                if entry.name.startswith(".tmp-"):
+                    # Clean up temp files left behind by crashed writers
+                    if now - entry_stat.st_mtime > 3600:
+                        try:
+                            os.remove(entry.path)
+                        except OSError:
+                            pass
+                    continue
+                
+                if max_idle_seconds is not None and now - entry_stat.st_mtime > max_idle_seconds:
+                    try:
+                        os.remove(entry.path)
+                        evicted += 1
+                    except OSError:
+                        pass
+                    continue
+                
+                entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+                total_size += entry_stat.st_size
+    except OSError:
+        return 0
     
-    def extract_single(file):
-        return extract_text(file)
+    if total_size <= max_bytes:
+        return evicted
     
-    # Use ThreadPoolExecutor for concurrent processing
-    with ThreadPoolExecutor(max_workers=2) as executor:
-        future1 = executor.submit(extract_single, contract1_file)
-        future2 = executor.submit(extract_single, contract2_file)
-        
-        contract1_text = future1.result()
-        contract2_text = future2.result()
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+            evicted += 1
+        except OSError:
+            # Another process already evicted this entry
+            pass
+        total_size -= size
+        if total_size <= max_bytes:
+            break
+    
+    return evicted
+
+def disk_cache_clear(cache_dir):
+    """Delete every entry of a cache directory and return how many were removed."""
+    removed = 0
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return removed
+
+def disk_cache_usage(cache_dir):
+    """Return (entry count, total bytes) for a cache directory."""
+    count = 0
+    total_size = 0
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    total_size += entry.stat().st_size
+                    count += 1
+                except OSError:
+                    continue
+    except OSError:
+        pass
+    return count, total_size
+
+# Bump when the parsing logic or the stored record format changes
+EXTRACTION_CACHE_VERSION = 3
+# Stored documents unused for this long are deleted; 0 turns the store off
+DEFAULT_EXTRACTION_CACHE_TTL_HOURS = 24
+
+def cache_ttl_seconds(setting, default_hours):
+    """Idle expiry of a disk store in seconds, from a setting in hours."""
+    return float(get_config(setting, default_hours)) * 3600
+
+def extraction_cache_dir():
+    """Directory of the persistent extraction store (point replicas at a shared volume)."""
+    default_dir = os.path.join(os.path.expanduser("~"), ".cache", "contract_app", "extraction")
+    return get_config("EXTRACTION_CACHE_DIR", default_dir)
+
+def extraction_cache_key(file_hash, file_extension):
+    """Content-addressed key for an extracted document."""
+    return f"{file_hash}-{file_extension.lstrip('.')}-v{EXTRACTION_CACHE_VERSION}"
+
+def load_extraction(cache_key):
+    """Look up a previously extracted document record in the persistent store."""
+    ttl_seconds = cache_ttl_seconds("EXTRACTION_CACHE_TTL_HOURS", DEFAULT_EXTRACTION_CACHE_TTL_HOURS)
+    if ttl_seconds <= 0:
+        return None
+    return disk_cache_get("extraction", extraction_cache_dir(), cache_key, ttl_seconds)
+
+def save_extraction(cache_key, record):
+    """Compress and persist an extraction record, evicting expired entries and LRU entries over the size limit."""
+    ttl_seconds = cache_ttl_seconds("EXTRACTION_CACHE_TTL_HOURS", DEFAULT_EXTRACTION_CACHE_TTL_HOURS)
+    if ttl_seconds <= 0:
+        return
+    max_bytes = int(float(get_config("EXTRACTION_CACHE_MAX_MB", 512)) * 1024 * 1024)
+    disk_cache_put("extraction", extraction_cache_dir(), cache_key, record, max_bytes, ttl_seconds)
+
+@st.cache_resource
+def get_memory_tracer():
+    """Lock serialising tracemalloc measurements, which are process-global."""
+    return threading.Lock()
+
+@contextmanager
+def measure_peak_memory(stats):
+    """Record the peak Python heap growth while the block runs into `stats`.
+    
+    tracemalloc is process-wide and slows every thread while it traces, so
+    measurement is opt-in; measured blocks run one at a time to keep the figure
+    attributable to a single document.
+    """
+    with get_memory_tracer():
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start()
+        else:
+            tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
         
-    return contract1_text, contract2_text
+        try:
+            yield
+        finally:
+            peak = tracemalloc.get_traced_memory()[1]
+            if started_here:
+                tracemalloc.stop()
+            stats["peak_memory_bytes"] = max(0, peak - baseline)
 
-def optimize_contract_for_claude(contract_text, focus_areas):
-    """Reduce token usage by focusing on relevant sections of the contract."""
-    # Define keywords for each focus area
-    focus_keywords = {
-        "Pricing Structure": ["price", "cost", "fee", "payment", "discount", "pricing", "rate", "subscription", "license", "amount", "charge", "invoice", "billing"],
-        "Service Level Agreements": ["SLA", "uptime", "response time", "availability", "service level", "maintenance", "support", "outage", "incident", "resolution", "performance", "metric"],
-        "Implementation Timeline": ["timeline", "schedule", "deadline", "milestone", "phase", "delivery", "implementation", "deploy", "rollout", "project plan", "date", "completion"],
-        "Scope of Work": ["scope", "deliverable", "requirement", "specification", "work", "service", "function", "feature", "capability", "responsibility", "exclude"],
-        "Maintenance & Support": ["maintenance", "support", "upgrade", "update", "patch", "fix", "bug", "repair", "service", "help desk", "ticket"],
-        "Data Security": ["security", "data", "privacy", "confidential", "protection", "encrypt", "breach", "compliance", "GDPR", "backup", "disaster", "recovery"],
-        "Exit Strategy": ["termination", "exit", "transition", "transfer", "handover", "wind down", "discontinue", "cease", "end", "expiration", "notice period"],
-        "Intellectual Property": ["intellectual property", "IP", "copyright", "patent", "trademark", "license", "ownership", "proprietary", "right", "title"],
-        "Change Management": ["change", "modification", "amendment", "alter", "adjust", "variation", "control", "request", "manage", "process", "procedure"],
-        "Performance Metrics": ["performance", "metric", "measure", "indicator", "KPI", "target", "benchmark", "assessment", "evaluation", "report", "monitor"]
+# Hot-path tracing
+@st.cache_resource
+def get_tracer():
+    """Span writer shared by every session; tracing is on when TRACE_FILE names a JSONL file."""
+    return {"lock": threading.Lock(), "path": get_config("TRACE_FILE"), "local": threading.local()}
+
+def trace_span(name, **attributes):
+    """Time the block as a span in the trace file.
+    
+    Yields the span's attribute dict so the block can add results (e.g. a cache hit).
+    When tracing is off this is a bare nullcontext, so hot paths pay almost nothing.
+    """
+    tracer = get_tracer()
+    if not tracer["path"]:
+        return nullcontext(attributes)
+    return record_span(tracer, name, attributes)
+
+@contextmanager
+def record_span(tracer, name, attributes):
+    """Write one span, nested under the span already open on this thread (if any)."""
+    stack = tracer["local"].__dict__.setdefault("stack", [])
+    parent = stack[-1] if stack else None
+    span = {
+        "trace_id": parent["trace_id"] if parent else os.urandom(8).hex(),
+        "span_id": os.urandom(8).hex(),
+        "parent_id": parent["span_id"] if parent else None,
     }
+    stack.append(span)
+    start_time = time.time()
+    start_counter = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except Exception as e:
+        # Streamlit's rerun/stop signals are BaseExceptions and are not errors
+        error = type(e).__name__
+        raise
+    finally:
+        stack.pop()
+        write_span(tracer, dict(span, name=name, start=start_time,
+                                duration_ms=(time.perf_counter() - start_counter) * 1000,
+                                attributes=attributes, error=error))
+
+def trace_context():
+    """The span open on this thread (None when there is none or tracing is off), to hand to other threads."""
+    tracer = get_tracer()
+    if not tracer["path"]:
+        return None
+    stack = tracer["local"].__dict__.get("stack")
+    return stack[-1] if stack else None
+
+def in_trace_context(func):
+    """Wrap `func` so the spans it opens on a worker thread nest under the span open here.
     
-    # Extract headers and structure for context preservation
-    header_pattern = r'(?i)^\s*(?:ARTICLE|SECTION|CLAUSE|APPENDIX|EXHIBIT|SCHEDULE|ANNEX)\s+[\dIVXLC\.\-]+[ \.\:]+(.+?)$'
-    headers = re.findall(header_pattern, contract_text, re.MULTILINE)
+    Thread-local span stacks do not follow work submitted to a pool, so without
+    this each worker would start a trace of its own.
+    """
+    parent = trace_context()
+    if parent is None:
+        return func
     
-    # Split the contract into paragraphs/sections
-    paragraphs = re.split(r'\n\s*\n', contract_text)
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        stack = get_tracer()["local"].__dict__.setdefault("stack", [])
+        stack.append(parent)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stack.pop()
+    return wrapper
+
+def trace_event(name, start_time, duration, **attributes):
+    """Write a span for a block that was timed separately (e.g. the results tab render)."""
+    tracer = get_tracer()
+    if not tracer["path"]:
+        return
+    stack = tracer["local"].__dict__.get("stack") or [None]
+    parent = stack[-1]
+    write_span(tracer, {"trace_id": parent["trace_id"] if parent else os.urandom(8).hex(),
+                        "span_id": os.urandom(8).hex(), "parent_id": parent["span_id"] if parent else None,
+                        "name": name, "start": start_time, "duration_ms": duration * 1000,
+                        "attributes": attributes, "error": None})
+
+def write_span(tracer, span):
+    """Append a span as one JSON line; appends are atomic so processes can share the file."""
+    span["pid"] = os.getpid()
+    span["thread"] = threading.current_thread().name
+    line = json.dumps(span, default=str) + "\n"
+    try:
+        with tracer["lock"], open(tracer["path"], "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        print(f"Error writing trace span: {str(e)}")
+
+def traced(name):
+    """Decorator form of trace_span for whole functions."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with trace_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# On-demand profiling
+def is_admin():
+    """True if the logged-in user is listed in ADMIN_USERS (a secrets list or comma-separated)."""
+    admins = get_config("ADMIN_USERS", [])
+    if isinstance(admins, str):
+        admins = [admin.strip() for admin in admins.split(",")]
+    user = st.session_state.get("authenticated_user")
+    return bool(user) and user in admins
+
+@contextmanager
+def profile_comparison(enabled, target):
+    """Run the block under cProfile when enabled, keeping the .pstats data in `target["profile_stats"]`.
     
-    # Identify relevant paragraphs based on focus areas
-    relevant_paragraphs = []
-    all_keywords = []
+    cProfile only sees the calling thread; background extraction and fan-out
+    workers show up as time spent waiting on them.
+    """
+    if not enabled:
+        yield
+        return
     
-    # Collect all keywords for the selected focus areas
-    for area in focus_areas:
-        all_keywords.extend(focus_keywords.get(area, []))
-    
-    # Preserve key contract sections regardless of keywords
-    important_sections = ["party", "parties", "definition", "term", "termination", "payment", "confidentiality", 
-                          "liability", "warranty", "indemnification", "governing law", "jurisdiction", "dispute"]
-    important_pattern = r'(?i)\b(' + '|'.join(important_sections) + r')\b'
-    
-    # Preserve the first few paragraphs for context (contract intro, parties, etc.)
-    intro_paragraphs = min(10, len(paragraphs) // 10)  # Include about 10% as intro or at least 10 paragraphs
-    
-    # Track which paragraphs to include
-    paragraphs_to_include = set(range(intro_paragraphs))
-    
-    # Identify paragraphs with relevant keywords
-    for i, paragraph in enumerate(paragraphs):
-        # Always include paragraphs that look like headers or section titles
-        if re.search(header_pattern, paragraph, re.MULTILINE):
-            paragraphs_to_include.add(i)
-            # Also include the next paragraph after a header
-            if i+1 < len(paragraphs):
-                paragraphs_to_include.add(i+1)
-            continue
-        
-        # Check for important contract sections
-        if re.search(important_pattern, paragraph.lower()):
-            paragraphs_to_include.add(i)
-            continue
-            
-        # Check for focus area keywords
-        for keyword in all_keywords:
-            if keyword.lower() in paragraph.lower():
-                paragraphs_to_include.add(i)
-                # Also include the next paragraph for context
-                if i+1 < len(paragraphs):
-                    paragraphs_to_include.add(i+1)
-                break
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(25)
+        # Same bytes as Profile.dump_stats, without a temporary file
+        profiler.create_stats()
+        target["profile_stats"] = {
+            "data": marshal.dumps(profiler.stats),
+            "summary": summary.getvalue(),
+            "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+        }
+
+@contextmanager
+def open_document(source):
+    """Yield (file name, buffer, path) for an upload or a filesystem path without copying it.
     
-    # Compile the optimized text
-    optimized_paragraphs = [paragraphs[i] for i in sorted(paragraphs_to_include)]
-    optimized_text = "\n\n".join(optimized_paragraphs)
+    Streamlit uploads are already held in memory and `getvalue()` returns that
+    bytes object itself rather than a copy. Paths are memory-mapped read-only, so
+    large documents are backed by the OS page cache instead of the Python heap.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        path = os.fspath(source)
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield os.path.basename(path), b"", path
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                yield os.path.basename(path), buffer, path
+    else:
+        yield source.name, source.getvalue(), None
+
+# PDF pages are extracted in a process pool at or above this many pages
+PDF_PARALLEL_PAGE_THRESHOLD = 100
+
+def pdf_pool_size():
+    """Most worker processes the shared PDF pool runs; they are started on demand."""
+    return max(1, int(get_config("PDF_POOL_SIZE", os.cpu_count() or 1)))
+
+def default_pdf_workers():
+    """Worker processes used for page-parallel PDF extraction."""
+    return min(max(1, int(get_config("PDF_WORKERS", min(4, os.cpu_count() or 1)))), pdf_pool_size())
+
+# Stand-in __main__ for starting pool workers, so they do not re-run this script
+PDF_POOL_MAIN = ModuleType("__main__")
+
+@st.cache_resource
+def get_pdf_process_pool():
+    """The one process pool for page-parallel PDF extraction, shared across sessions and documents.
     
-    # If optimized text is too short, return the original
-    if len(optimized_text) < len(contract_text) * 0.3:
-        return contract_text[:25000]  # Limit to 25K chars as in the original function
+    Workers are started by a fork server (spawn where unavailable): forking the
+    multi-threaded Streamlit server itself can deadlock a child on a lock held by
+    another thread. They only import pdf_worker.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context("forkserver")
+        mp_context.set_forkserver_preload(["pdf_worker"])
+    else:
+        mp_context = multiprocessing.get_context("spawn")
+    return {"lock": threading.Lock(), "executor": ProcessPoolExecutor(max_workers=pdf_pool_size(), mp_context=mp_context)}
+
+def submit_pdf_page_range(pool, pdf_source, start, end):
+    """Queue a page range on the PDF pool.
     
-    # Limit to 25K chars as in the original function
-    return optimized_text[:25000]
+    forkserver and spawn workers re-run the parent's __main__ file, which under
+    `streamlit run` is this script with its page-level `st.*` calls, so any worker
+    started by this submit sees a stand-in __main__ instead.
+    """
+    with pool["lock"]:
+        main_module = sys.modules["__main__"]
+        sys.modules["__main__"] = PDF_POOL_MAIN
+        try:
+            return pool["executor"].submit(extract_pdf_page_range, pdf_source, start, end)
+        finally:
+            # Streamlit installs each script run's module as __main__; keep a newer one
+            if sys.modules["__main__"] is PDF_POOL_MAIN:
+                sys.modules["__main__"] = main_module
 
-def create_executive_summary(analysis_result, risk_analysis, contract1_name, contract2_name):
-    """Generate an executive summary from the analysis results and risk assessment."""
+def iter_pdf_pages_parallel(pdf_source, page_count, workers):
+    """Shard a PDF into contiguous page ranges and yield (text, seconds) per page from a process pool.
     
-    if not risk_analysis:
-        return "<div style='background-color: #f5f7fa; border-radius: 8px; padding: 1.5rem; margin-bottom: 2rem; border-left: 5px solid #1890ff;'><h3 style='margin-top: 0; color: #1f3a60;'>Executive Summary</h3><p>Risk analysis data not available. Please rerun the comparison.</p></div>"
+    PyPDF2 is pure Python, so threads are serialised by the GIL; separate processes
+    are not. Ranges are small relative to the worker count so a few slow pages do
+    not leave the other workers idle, at most `workers` ranges of a document are in
+    the shared pool at once, and pages are yielded in order as their range completes.
+    """
+    chunk_size = max(1, -(-page_count // (workers * 4)))
     
-    # Get overall scores and ensure they are integers
-    try:
-        c1_score = int(risk_analysis.get('contract1_overall_score', 70))
-    except (ValueError, TypeError):
-        c1_score = 70
-        
+    # Uploads reach the workers through shared memory rather than pickled into every task
+    shared = None
+    if not isinstance(pdf_source, str):
+        shared = shared_memory.SharedMemory(create=True, size=len(pdf_source))
+        shared.buf[:len(pdf_source)] = pdf_source
+        pdf_source = (shared.name, len(pdf_source))
+    
+    pool = get_pdf_process_pool()
+    pending = deque()
     try:
-        c2_score = int(risk_analysis.get('contract2_overall_score', 70))
-    except (ValueError, TypeError):
-        c2_score = 70
+        for start in range(0, page_count, chunk_size):
+            pending.append(submit_pdf_page_range(pool, pdf_source, start, min(start + chunk_size, page_count)))
+            if len(pending) >= workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        # Also reached when the consumer stops early; the pool stays up for the next document
+        for future in pending:
+            future.cancel()
+        if shared:
+            shared.close()
+            shared.unlink()
+
+def iter_pdf_pages(stream, pdf_source, pdf_workers, stats):
+    """Yield (text, seconds) per page, from a process pool for large documents."""
+    pdf_reader = PdfReader(stream)
+    page_count = len(pdf_reader.pages)
+    stats["total_units"] = page_count
     
-    # Determine letter grades
-    def get_letter_grade(score):
+    pages_done = 0
+    workers = min(pdf_workers, page_count, pdf_pool_size())
+    if workers > 1 and page_count >= int(get_config("PDF_PARALLEL_PAGE_THRESHOLD", PDF_PARALLEL_PAGE_THRESHOLD)):
+        stats["pdf_workers"] = workers
         try:
-            score_num = int(score)
-            if score_num >= 90: return "A"
-            elif score_num >= 80: return "B"
-            elif score_num >= 70: return "C"
-            elif score_num >= 60: return "D"
-            else: return "F"
-        except (ValueError, TypeError):
-            # Default to C if score cannot be converted to int
-            return "C"
+            for page in iter_pdf_pages_parallel(pdf_source, page_count, workers):
+                pages_done += 1
+                yield page
+            return
+        except (BrokenProcessPool, pickle.PicklingError, OSError) as e:
+            # Carry on serially from where the pool stopped, e.g. where processes cannot be
+            # started; a broken pool is replaced on the next document
+            if isinstance(e, BrokenProcessPool):
+                get_pdf_process_pool.clear()
+            print(f"Parallel PDF extraction failed, extracting serially: {str(e)}")
     
-    c1_grade = get_letter_grade(c1_score)
-    c2_grade = get_letter_grade(c2_score)
+    stats["pdf_workers"] = 1
+    for page_number in range(pages_done, page_count):
+        page_start = time.perf_counter()
+        text = pdf_reader.pages[page_number].extract_text()
+        yield text, time.perf_counter() - page_start
+
+# DOCX paragraphs are yielded in batches of this size
+DOCX_PARAGRAPH_BATCH = 50
+
+def iter_document_text(buffer, file_extension, path=None, pdf_workers=1, stats=None):
+    """Yield the text of a document incrementally: per page for PDFs, in paragraph batches for DOCX.
     
-    # Get background color for grade pills
-    def get_grade_color(grade):
-        if grade == "A": return "#388e3c"
-        elif grade == "B": return "#689f38"
-        elif grade == "C": return "#afb42b"
-        elif grade == "D": return "#ffa000"
-        else: return "#e64a19"
+    Progress is kept in `stats` ("unit", "units_done", "total_units") as chunks are
+    produced, and per-page extraction times in `stats["page_times"]`. Joining the
+    chunks with newlines gives the full document text.
+    """
+    if stats is None:
+        stats = {}
+    stats["units_done"] = 0
     
-    c1_color = get_grade_color(c1_grade)
-    c2_color = get_grade_color(c2_grade)
+    if file_extension == ".txt":
+        # Decode straight from the buffer and normalise newlines like text-mode open()
+        stats["unit"] = "file"
+        stats["total_units"] = 1
+        text = str(buffer, "utf-8").replace("\r\n", "\n").replace("\r", "\n")
+        stats["units_done"] = 1
+        yield text
+        return
     
-    # Get key advantages and disadvantages
-    c1_advantages = risk_analysis.get('contract1_advantages', ['No specific advantages identified'])
-    c1_disadvantages = risk_analysis.get('contract1_disadvantages', ['No specific disadvantages identified'])
-    c2_advantages = risk_analysis.get('contract2_advantages', ['No specific advantages identified'])
-    c2_disadvantages = risk_analysis.get('contract2_disadvantages', ['No specific disadvantages identified'])
+    # BytesIO over a bytes object shares it rather than copying; memory maps are
+    # not seekable file objects, so mapped documents are re-opened by path instead
+    stream = open(path, "rb") if path else io.BytesIO(buffer)
+    with stream:
+        if file_extension == ".pdf":
+            stats["unit"] = "page"
+            stats["page_times"] = []
+            for text, seconds in iter_pdf_pages(stream, path or buffer, pdf_workers, stats):
+                stats["page_times"].append(round(seconds, 4))
+                stats["units_done"] += 1
+                yield text
+        else:
+            stats["unit"] = "paragraph"
+            paragraphs = docx.Document(stream).paragraphs
+            stats["total_units"] = len(paragraphs)
+            for start in range(0, len(paragraphs), DOCX_PARAGRAPH_BATCH):
+                batch = paragraphs[start:start + DOCX_PARAGRAPH_BATCH]
+                stats["units_done"] += len(batch)
+                yield "\n".join(para.text for para in batch)
+
+def parse_document(buffer, file_extension, path=None, pdf_workers=1, stats=None):
+    """Parse an in-memory document (or the file at `path`) into plain text without temp files."""
+    return "\n".join(iter_document_text(buffer, file_extension, path, pdf_workers, stats))
+
+# Extract text functions
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
+
+def extract_document_record(file_hash, file_name, buffer, path=None, measure_memory=False, pdf_workers=1,
+                            record=None, on_chunk=None):
+    """Return the extraction record for a document from the persistent store, parsing it on a miss.
     
-    # Ensure lists are not empty and are actual lists
-    if not c1_advantages or not isinstance(c1_advantages, list):
-        c1_advantages = ['No specific advantages identified']
-    if not c1_disadvantages or not isinstance(c1_disadvantages, list):
-        c1_disadvantages = ['No specific disadvantages identified']
-    if not c2_advantages or not isinstance(c2_advantages, list):
-        c2_advantages = ['No specific advantages identified']
-    if not c2_disadvantages or not isinstance(c2_disadvantages, list):
-        c2_disadvantages = ['No specific disadvantages identified']
+    The record holds the text plus the size, timing and memory figures measured when
+    the document was first parsed. Progress is written into `record` while parsing,
+    and `on_chunk` receives each page or paragraph batch as soon as it is extracted.
+    """
+    if record is None:
+        record = {}
     
-    # Get recommendations
-    recommendation = risk_analysis.get('recommendation', 'Further detailed analysis recommended.')
-    if not recommendation or not isinstance(recommendation, str):
-        recommendation = 'Further detailed analysis recommended.'
+    file_extension = os.path.splitext(file_name)[1].lower()
+    if file_extension not in SUPPORTED_EXTENSIONS:
+        record.update({"text": "Unsupported file format. Please upload PDF, DOCX, or TXT files.", "source": "unsupported"})
+        if on_chunk:
+            on_chunk(record["text"])
+        return record
     
-    # Create the summary HTML with inline styles instead of classes
-    html = f"""
-    <div style="background-color: #f5f7fa; border-radius: 8px; padding: 1.5rem; margin-bottom: 2rem; border-left: 5px solid #1890ff;">
-        <h3 style="margin-top: 0; color: #1f3a60;">Executive Summary: Contract Comparison</h3>
-        <div style="display: flex; flex-wrap: wrap;">
-            <div style="flex: 1; min-width: 300px; padding-right: 15px; margin-bottom: 15px;">
-                <h4>{contract1_name}</h4>
-                <p><span style="display: inline-block; padding: 0.35rem 0.65rem; border-radius: 1rem; font-weight: bold; color: white; background-color: {c1_color}; margin-right: 0.5rem; font-size: 0.9rem;">{c1_grade}</span> Overall Score: {c1_score}/100</p>
-                <h5>Key Advantages</h5>
-                <ul>
-    """
+    cache_key = extraction_cache_key(file_hash, file_extension)
+    stored = load_extraction(cache_key)
+    if stored is not None:
+        record.update(stored)
+        record["source"] = "extraction store"
+        if on_chunk:
+            on_chunk(record["text"])
+        return record
     
-    for adv in c1_advantages[:3]:  # Limit to top 3
-        html += f"<li>{adv}</li>"
+    record.update({"file_size": len(buffer), "peak_memory_bytes": None})
+    if measure_memory:
+        # Pool workers' memory is invisible to tracemalloc, so measured documents are parsed here
+        pdf_workers = 1
+    chunks = []
+    start_time = time.time()
+    with measure_peak_memory(record) if measure_memory else nullcontext():
+        for chunk in iter_document_text(buffer, file_extension, path, pdf_workers, record):
+            chunks.append(chunk)
+            if on_chunk:
+                on_chunk(chunk)
+    record["text"] = "\n".join(chunks)
+    record["parse_time"] = time.time() - start_time
     
-    html += """
-                </ul>
-                <h5>Key Concerns</h5>
-                <ul>
-    """
+    save_extraction(cache_key, record)
+    record["source"] = "parsed"
+    return record
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_extract_text(file_hash, file_name, _buffer, _path=None, _measure_memory=False, _pdf_workers=1,
+                        _record=None, _on_chunk=None):
+    """Cached version of text extraction to avoid reprocessing the same file.
     
-    for disadv in c1_disadvantages[:3]:  # Limit to top 3
-        html += f"<li>{disadv}</li>"
+    Keyed on the SHA-256 of the document (the raw bytes are not hashed by Streamlit)
+    and backed by the persistent extraction store shared across processes. `_record`
+    and `_on_chunk` work as in extract_document_record; neither is used on a memory hit.
+    """
+    return extract_document_record(file_hash, file_name, _buffer, _path, _measure_memory, _pdf_workers, _record,
+                                   _on_chunk)
+
+def extraction_cache_outcome(record, progress):
+    """How a document was served, for the extraction span: "memory", "store", "parsed" or "unsupported".
     
-    html += f"""
-                </ul>
-            </div>
-            <div style="flex: 1; min-width: 300px; padding-left: 15px; margin-bottom: 15px;">
-                <h4>{contract2_name}</h4>
-                <p><span style="display: inline-block; padding: 0.35rem 0.65rem; border-radius: 1rem; font-weight: bold; color: white; background-color: {c2_color}; margin-right: 0.5rem; font-size: 0.9rem;">{c2_grade}</span> Overall Score: {c2_score}/100</p>
-                <h5>Key Advantages</h5>
-                <ul>
+    `progress` is the record passed to the extraction, which stays empty when the
+    in-memory cache answered.
     """
+    if not progress:
+        return "memory"
+    return "store" if record.get("source") == "extraction store" else record.get("source")
+
+def split_extraction_record(record, file_name, file_hash):
+    """Split an extraction record into (text, stats) for reporting."""
+    stats = {key: value for key, value in record.items() if key != "text"}
+    stats["name"] = file_name
+    stats["sha256"] = file_hash
+    return record["text"], stats
+
+def extract_text_with_stats(source, measure_memory=False, pdf_workers=None):
+    """Extract text from an upload or a file path, returning (text, extraction stats)."""
+    if pdf_workers is None:
+        pdf_workers = default_pdf_workers()
     
-    for adv in c2_advantages[:3]:  # Limit to top 3
-        html += f"<li>{adv}</li>"
+    start_time = time.time()
+    with open_document(source) as (file_name, buffer, path):
+        file_hash = hashlib.sha256(buffer).hexdigest()
+        with trace_span("cached_extract_text", file_name=file_name, file_size=len(buffer)) as span:
+            progress = {}
+            record = cached_extract_text(file_hash, file_name, buffer, path, measure_memory, pdf_workers, progress)
+            span["cache"] = extraction_cache_outcome(record, progress)
+    if not progress:
+        record = dict(record, source="memory cache")
     
-    html += """
-                </ul>
-                <h5>Key Concerns</h5>
-                <ul>
+    text, stats = split_extraction_record(record, file_name, file_hash)
+    stats["extract_time"] = time.time() - start_time
+    return text, stats
+
+def extract_text(file):
+    """Extract text from various file formats."""
+    return extract_text_with_stats(file)[0]
+
+# Background extraction jobs
+# Finished jobs are kept this long (seconds) so later reruns can pick up their results
+EXTRACTION_JOB_RETENTION = 600
+
+@st.cache_resource
+def get_extraction_jobs():
+    """Background extraction jobs and their thread pool, shared by every session and rerun."""
+    return {
+        "lock": threading.Lock(),
+        "jobs": {},
+        "executor": ThreadPoolExecutor(max_workers=4, thread_name_prefix="extraction")
+    }
+
+def run_extraction_job(job, source, measure_memory, pdf_workers):
+    """Extract a document on the background pool, publishing chunks to the job as they arrive."""
+    try:
+        with open_document(source) as (file_name, buffer, path):
+            # Same span as extract_text_with_stats, so traces of app analyses include extraction
+            with trace_span("cached_extract_text", file_name=file_name, file_size=len(buffer)) as span:
+                job["trace"] = trace_context()
+                record = cached_extract_text(job["sha256"], file_name, buffer, path, measure_memory, pdf_workers,
+                                             job["record"], job["chunks"].append)
+                span["cache"] = extraction_cache_outcome(record, job["record"])
+            if not job["record"]:
+                # Served from memory: publish the whole text as the preview
+                job["record"].update(record, source="memory cache")
+                job["chunks"].append(record["text"])
+            return job["record"]
+    finally:
+        job["finished_at"] = time.time()
+
+def start_extraction_job(source, measure_memory=False, pdf_workers=None):
+    """Start extracting an upload in the background, or join the job already running for it.
+    
+    Jobs are keyed by content hash, so reruns and other sessions uploading the same
+    document share one extraction.
     """
+    if pdf_workers is None:
+        pdf_workers = default_pdf_workers()
     
-    for disadv in c2_disadvantages[:3]:  # Limit to top 3
-        html += f"<li>{disadv}</li>"
+    with open_document(source) as (file_name, buffer, _):
+        file_hash = hashlib.sha256(buffer).hexdigest()
+    job_key = f"{file_hash}{os.path.splitext(file_name)[1].lower()}"
     
-    html += f"""
-                </ul>
-            </div>
-        </div>
-        <h5>Recommendation</h5>
-        <div style="margin-top: 0.75rem;">
-            <p>{recommendation}</p>
-        </div>
-    </div>
-    """
+    registry = get_extraction_jobs()
+    with registry["lock"]:
+        now = time.time()
+        for key, job in list(registry["jobs"].items()):
+            if job["finished_at"] and now - job["finished_at"] > EXTRACTION_JOB_RETENTION:
+                del registry["jobs"][key]
+        
+        job = registry["jobs"].get(job_key)
+        if job is None:
+            job = {"key": job_key, "sha256": file_hash, "name": file_name, "record": {},
+                   "chunks": [], "trace": None, "finished_at": None}
+            job["future"] = registry["executor"].submit(in_trace_context(run_extraction_job), job, source,
+                                                        measure_memory, pdf_workers)
+            registry["jobs"][job_key] = job
     
-    return html
+    return job
 
-def normalize_dimension_name(name):
-    """Normalize dimension names to prevent duplicates with different casing/formatting."""
-    # Convert to lowercase, replace spaces and underscores with a single space, and capitalize words
-    normalized = name.lower().replace('_', ' ').strip()
-    return normalized
+def extraction_job_result(job, file_name=None):
+    """Wait for a background extraction and return (text, extraction stats).
+    
+    `extract_time` in the stats is how long this call waited, which is zero when the
+    document finished extracting in the background before it was needed.
+    """
+    start_time = time.time()
+    # A job started at upload has its own trace; the wait links to it
+    with trace_span("extraction_job_result", file_name=file_name or job["name"]) as span:
+        record = job["future"].result()
+        if job["trace"] and job["trace"]["trace_id"] != (trace_context() or {}).get("trace_id"):
+            span["linked_trace_id"] = job["trace"]["trace_id"]
+            span["linked_span_id"] = job["trace"]["span_id"]
+    text, stats = split_extraction_record(record, file_name or job["name"], job["sha256"])
+    stats["extract_time"] = time.time() - start_time
+    return text, stats
 
-def create_area_scorecards(risk_analysis):
-    """Generate scorecards for each comparison area."""
+def extraction_job_ready(job):
+    """True once a background extraction has finished successfully."""
+    return job["future"].done() and job["future"].exception() is None
+
+def process_contracts_concurrently(contract1_file, contract2_file, measure_memory=False, pdf_workers=None):
+    """Process contracts in parallel on the shared background extraction pool.
     
-    if not risk_analysis or not isinstance(risk_analysis, dict):
-        return "<p>Area scoring not available.</p>"
+    Extractions already started when the files were uploaded are joined rather
+    than repeated.
+    """
+    job1 = start_extraction_job(contract1_file, measure_memory, pdf_workers)
+    job2 = start_extraction_job(contract2_file, measure_memory, pdf_workers)
     
-    # Get dimension scores for both contracts
-    c1_dimensions = risk_analysis.get('contract1_dimension_scores', {})
-    c2_dimensions = risk_analysis.get('contract2_dimension_scores', {})
+    contract1_text, contract1_stats = extraction_job_result(job1, contract1_file.name)
+    contract2_text, contract2_stats = extraction_job_result(job2, contract2_file.name)
     
-    if not isinstance(c1_dimensions, dict) or not isinstance(c2_dimensions, dict):
-        return "<p>Area scoring data invalid.</p>"
+    return contract1_text, contract2_text, [contract1_stats, contract2_stats]
+
+def render_extraction_status(job, label):
+    """Show extraction progress and a preview built from the pages extracted so far."""
+    future = job["future"]
+    if future.done() and future.exception() is not None:
+        st.error(f"Error extracting text: {str(future.exception())}")
+        return
     
-    # Instead of building HTML, let's use Streamlit's native components
-    # Create a container div for better styling
-    content = ""
+    record = job["record"]
+    if not future.done():
+        total_units = record.get("total_units")
+        units_done = record.get("units_done", 0)
+        if total_units:
+            st.progress(min(units_done / total_units, 1.0),
+                        text=f"Extracting text... {units_done:,}/{total_units:,} {record.get('unit', 'page')}s")
+        else:
+            st.progress(0.0, text="Opening document...")
     
-    # Normalize dimension names to prevent duplicates
-    normalized_dimensions = {}
+    # Only join as many leading chunks as the preview needs
+    preview = ""
+    for chunk in list(job["chunks"]):
+        preview += chunk + "\n"
+        if len(preview) >= 1000:
+            break
     
-    # First, collect all dimensions with their normalized names
-    all_dimensions = set(list(c1_dimensions.keys()) + list(c2_dimensions.keys()))
-    for dimension in all_dimensions:
-        norm_name = normalize_dimension_name(dimension)
-        # If this normalized name already exists, use the one with the higher score as it's likely more accurate
-        if norm_name in normalized_dimensions:
-            existing_dim = normalized_dimensions[norm_name]
-            c1_existing_score = c1_dimensions.get(existing_dim, 0)
-            c2_existing_score = c2_dimensions.get(existing_dim, 0)
-            c1_new_score = c1_dimensions.get(dimension, 0)
-            c2_new_score = c2_dimensions.get(dimension, 0)
-            
-            # If the new dimension has non-zero scores and the existing one has zeros, replace it
-            if (c1_new_score > 0 or c2_new_score > 0) and (c1_existing_score == 0 and c2_existing_score == 0):
-                normalized_dimensions[norm_name] = dimension
-            # Otherwise keep the one with proper capitalization or the first one
-        else:
-            normalized_dimensions[norm_name] = dimension
+    st.markdown("#### Preview")
+    st.text_area(label, preview[:1000] + "...", height=200, disabled=True, label_visibility="collapsed")
+
+@st.fragment(run_every=1)
+def poll_extraction_status(job_key, label):
+    """Refresh extraction progress every second, rerunning the app once the document is ready."""
+    job = get_extraction_jobs()["jobs"].get(job_key)
+    if job is None or job["future"].done():
+        # Full rerun so the Compare button picks up the finished extraction
+        st.rerun()
+    render_extraction_status(job, label)
+
+def show_extraction_preview(job, label, first_chunk_timeout=2.0):
+    """Render the upload preview as soon as the first page is extracted, then poll until done."""
+    deadline = time.time() + first_chunk_timeout
+    while not job["chunks"] and not job["future"].done() and time.time() < deadline:
+        time.sleep(0.05)
     
-    # Now process the unique dimensions
-    for _, dimension in sorted(normalized_dimensions.items()):
-        c1_score = c1_dimensions.get(dimension, 0)
-        c2_score = c2_dimensions.get(dimension, 0)
-        
-        # Ensure scores are integers
-        try:
-            c1_score = int(c1_score)
-        except (ValueError, TypeError):
-            c1_score = 0
-            
-        try:
-            c2_score = int(c2_score)
-        except (ValueError, TypeError):
-            c2_score = 0
-        
-        # Determine which contract is better in this dimension
-        comparison_text = ""
-        difference = abs(c1_score - c2_score)
-        if c1_score > c2_score:
-            comparison_text = f"Contract 1 scores {difference} points higher"
-        elif c2_score > c1_score:
-            comparison_text = f"Contract 2 scores {difference} points higher"
+    if job["future"].done():
+        render_extraction_status(job, label)
+    else:
+        poll_extraction_status(job["key"], label)
+
+def render_tender_extraction_status(jobs):
+    """One row of extraction progress per tender response"""
+    rows = []
+    for job in jobs:
+        future = job["future"]
+        record = job["record"]
+        if future.done():
+            status = f"Error: {future.exception()}" if future.exception() is not None else "Ready"
+        elif record.get("total_units"):
+            status = f"Extracting... {record.get('units_done', 0):,}/{record['total_units']:,} {record.get('unit', 'page')}s"
         else:
-            comparison_text = "Both contracts score equally"
-        
-        # Display a nicely formatted dimension name (Title Case)
-        display_name = ' '.join(word.capitalize() for word in dimension.replace('_', ' ').split())
+            status = "Opening document..."
+        rows.append({"Document": job["name"], "Status": status})
+    st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+
+@st.fragment(run_every=1)
+def poll_tender_extraction(job_keys):
+    """Refresh tender extraction progress every second, rerunning the app once every response is ready."""
+    registry = get_extraction_jobs()["jobs"]
+    jobs = [registry.get(job_key) for job_key in job_keys]
+    if any(job is None for job in jobs) or all(job["future"].done() for job in jobs):
+        st.rerun()
+    render_tender_extraction_status(jobs)
+
+# Keywords for each focus area, used to select the contract text sent to Claude
+FOCUS_KEYWORDS = {
+    "Pricing Structure": ["price", "cost", "fee", "payment", "discount", "pricing", "rate", "subscription", "license", "amount", "charge", "invoice", "billing"],
+    "Service Level Agreements": ["SLA", "uptime", "response time", "availability", "service level", "maintenance", "support", "outage", "incident", "resolution", "performance", "metric"],
+    "Implementation Timeline": ["timeline", "schedule", "deadline", "milestone", "phase", "delivery", "implementation", "deploy", "rollout", "project plan", "date", "completion"],
+    "Scope of Work": ["scope", "deliverable", "requirement", "specification", "work", "service", "function", "feature", "capability", "responsibility", "exclude"],
+    "Maintenance & Support": ["maintenance", "support", "upgrade", "update", "patch", "fix", "bug", "repair", "service", "help desk", "ticket"],
+    "Data Security": ["security", "data", "privacy", "confidential", "protection", "encrypt", "breach", "compliance", "GDPR", "backup", "disaster", "recovery"],
+    "Exit Strategy": ["termination", "exit", "transition", "transfer", "handover", "wind down", "discontinue", "cease", "end", "expiration", "notice period"],
+    "Intellectual Property": ["intellectual property", "IP", "copyright", "patent", "trademark", "license", "ownership", "proprietary", "right", "title"],
+    "Change Management": ["change", "modification", "amendment", "alter", "adjust", "variation", "control", "request", "manage", "process", "procedure"],
+    "Performance Metrics": ["performance", "metric", "measure", "indicator", "KPI", "target", "benchmark", "assessment", "evaluation", "report", "monitor"]
+}
+
+# Headers and section titles (e.g. "SECTION 4.2: Fees"), kept for context preservation
+CONTRACT_HEADER_PATTERN = re.compile(
+    r'(?i)^\s*(?:ARTICLE|SECTION|CLAUSE|APPENDIX|EXHIBIT|SCHEDULE|ANNEX)\s+[\dIVXLC\.\-]+[ \.\:]+(.+?)$',
+    re.MULTILINE
+)
+
+# Key contract sections preserved regardless of focus area (matched against lowercased text)
+IMPORTANT_SECTIONS = ["party", "parties", "definition", "term", "termination", "payment", "confidentiality",
+                      "liability", "warranty", "indemnification", "governing law", "jurisdiction", "dispute"]
+IMPORTANT_SECTION_PATTERN = re.compile(r'\b(?:' + '|'.join(IMPORTANT_SECTIONS) + r')\b')
+
+def keyword_trie_pattern(keywords):
+    """Build a prefix-factored regex alternation (a trie) matching any of `keywords`.
+    
+    Python's regex engine tries alternatives one by one, so a flat alternation of
+    ~120 keywords is re-tested at every word start; sharing prefixes means each
+    position is decided after a character or two.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}  # End-of-keyword marker
+    
+    def to_pattern(node):
+        branches = [re.escape(char) + to_pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
         
-        # Add styled scorecard markup
-        content += f"""
-        <div style="background-color: #f0f8ff; border-radius: 5px; padding: 1rem; margin-bottom: 1rem; border-left: 4px solid #1976d2;">
-            <div style="font-weight: bold; margin-bottom: 0.5rem;">{display_name}</div>
-            <p>{comparison_text} in this area.</p>
-            <div style="display: flex; margin-bottom: 10px;">
-                <div style="flex: 1; margin-right: 10px;">
-                    <div style="font-weight: bold;">Contract 1: {c1_score}/100</div>
-                    <div style="height: 8px; background-color: #e0e0e0; border-radius: 4px; margin-bottom: 0.5rem; overflow: hidden;">
-                        <div style="height: 100%; width: {c1_score}%; background-color: #2196f3;"></div>
-                    </div>
-                </div>
-                <div style="flex: 1;">
-                    <div style="font-weight: bold;">Contract 2: {c2_score}/100</div>
-                    <div style="height: 8px; background-color: #e0e0e0; border-radius: 4px; margin-bottom: 0.5rem; overflow: hidden;">
-                        <div style="height: 100%; width: {c2_score}%; background-color: #2196f3;"></div>
-                    </div>
-                </div>
-            </div>
-        </div>
-        """
+        optional = "" in node
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")" + ("?" if optional else "")
     
-    return content
+    return to_pattern(trie)
 
-def robust_claude_api_call(client, prompt, system_prompt):
-    """Handle Claude API calls with robust error handling and retries"""
-    max_retries = 3
-    retry_count = 0
-    backoff_time = 2  # seconds
+@functools.lru_cache(maxsize=64)
+def build_focus_matcher(focus_areas):
+    """Compile a single matcher over the keywords of a tuple of focus areas.
+    
+    Returns (pattern, keyword -> focus areas), or (None, {}) when no keywords apply.
+    Keywords are matched against lowercased text at the start of a word, so
+    "payment" also matches "payments". The regex is greedy, so where one keyword
+    extends another the longest match wins ("service level" over "service").
+    """
+    keyword_areas = {}
+    for area in focus_areas:
+        for keyword in FOCUS_KEYWORDS.get(area, []):
+            areas = keyword_areas.setdefault(keyword.lower(), [])
+            if area not in areas:
+                areas.append(area)
+    
+    if not keyword_areas:
+        return None, {}
+    
+    return re.compile(r'\b(' + keyword_trie_pattern(keyword_areas) + r')'), keyword_areas
+
+def count_focus_hits(lowered_text, matcher):
+    """Count keyword hits per focus area in already-lowercased text, in a single pass.
+    
+    `matcher` is the (pattern, keyword -> focus areas) pair from build_focus_matcher.
+    """
+    pattern, keyword_areas = matcher
+    hits = {}
+    if pattern is None:
+        return hits
+    
+    for keyword in pattern.findall(lowered_text):
+        for area in keyword_areas[keyword]:
+            hits[area] = hits.get(area, 0) + 1
+    return hits
+
+def match_paragraphs(paragraphs, focus_areas):
+    """Classify each paragraph in one pass.
+    
+    Returns one dict per paragraph with "header" and "important" flags and "hits",
+    the keyword hit count per focus area. Each paragraph is lowercased once.
+    """
+    matcher = build_focus_matcher(tuple(focus_areas))
+    matches = []
+    for paragraph in paragraphs:
+        lowered = paragraph.lower()
+        matches.append({
+            "header": CONTRACT_HEADER_PATTERN.search(paragraph) is not None,
+            "important": IMPORTANT_SECTION_PATTERN.search(lowered) is not None,
+            "hits": count_focus_hits(lowered, matcher)
+        })
+    return matches
+
+# Token estimation
+# Word and punctuation pieces; the tokens-per-piece ratio is calibrated against API usage
+TOKEN_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+DEFAULT_TOKENS_PER_PIECE = 1.25
+# Contracts are packed with a ratio that only follows the calibration once it drifts this far,
+# so the same input keeps packing to the same text (and the same cache keys)
+PACKING_RATIO_TOLERANCE = 0.1
+
+@st.cache_resource
+def get_token_calibration():
+    """Process-wide tokens-per-piece ratio, refined from the API's reported input tokens."""
+    return {"lock": threading.Lock(), "tokens_per_piece": DEFAULT_TOKENS_PER_PIECE,
+            "packing_tokens_per_piece": DEFAULT_TOKENS_PER_PIECE, "samples": 0}
+
+def tokens_per_piece():
+    """Current calibrated tokens-per-piece ratio."""
+    return get_token_calibration()["tokens_per_piece"]
+
+def packing_tokens_per_piece():
+    """Tokens-per-piece ratio used to fit contracts into a token budget; see PACKING_RATIO_TOLERANCE."""
+    return get_token_calibration()["packing_tokens_per_piece"]
+
+def count_token_pieces(text):
+    """Count the word and punctuation pieces the token estimate is based on."""
+    return len(TOKEN_PIECE_PATTERN.findall(text))
+
+def estimate_tokens(text):
+    """Estimate the input tokens for `text` with the calibrated local estimator."""
+    return int(count_token_pieces(text) * tokens_per_piece())
+
+def estimate_packing_tokens(text):
+    """Estimate the tokens for `text` when packing it into a budget, with the stable packing ratio."""
+    return int(count_token_pieces(text) * packing_tokens_per_piece())
+
+def calibrate_token_estimator(request_text, actual_input_tokens):
+    """Fold an observed (request text, API input_tokens) pair into the calibration.
+    
+    Uses an exponential moving average so one unusual request cannot swing the
+    estimate, and clamps the ratio to a plausible range.
+    """
+    pieces = count_token_pieces(request_text)
+    if not pieces or not actual_input_tokens:
+        return
     
-    while retry_count < max_retries:
+    observed = min(max(actual_input_tokens / pieces, 0.5), 3.0)
+    calibration = get_token_calibration()
+    with calibration["lock"]:
+        alpha = 1.0 if calibration["samples"] == 0 else 0.3
+        calibration["tokens_per_piece"] += alpha * (observed - calibration["tokens_per_piece"])
+        calibration["samples"] += 1
+        packing = calibration["packing_tokens_per_piece"]
+        if abs(calibration["tokens_per_piece"] - packing) > PACKING_RATIO_TOLERANCE * packing:
+            calibration["packing_tokens_per_piece"] = round(calibration["tokens_per_piece"], 2)
+
+def total_input_tokens(usage):
+    """All input tokens of a response, including those written to or read from the prompt cache."""
+    return sum(getattr(usage, name, 0) or 0
+               for name in ("input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"))
+
+# API pricing in USD per million tokens; the longest matching model name prefix wins
+DEFAULT_MODEL_PRICES = {
+    "claude-opus-4-5": {"input": 5.0, "output": 25.0},
+    "claude-opus-4": {"input": 15.0, "output": 75.0},
+    "claude-3-opus": {"input": 15.0, "output": 75.0},
+    "claude-sonnet-4": {"input": 3.0, "output": 15.0},
+    "claude-3-7-sonnet": {"input": 3.0, "output": 15.0},
+    "claude-3-5-sonnet": {"input": 3.0, "output": 15.0},
+    "claude-haiku-4-5": {"input": 1.0, "output": 5.0},
+    "claude-3-5-haiku": {"input": 0.8, "output": 4.0},
+    "claude-3-haiku": {"input": 0.25, "output": 1.25},
+}
+# Unknown models are costed at the highest list price rather than shown as free
+FALLBACK_MODEL_PRICE = {"input": 15.0, "output": 75.0}
+# Prompt cache writes and reads relative to the base input price, unless a model sets its own
+CACHE_WRITE_PRICE_MULTIPLIER = 1.25
+CACHE_READ_PRICE_MULTIPLIER = 0.1
+# Requests sent through the Message Batches API are billed at half price
+BATCH_PRICE_MULTIPLIER = 0.5
+
+def get_model_prices():
+    """Price table, with the MODEL_PRICES setting (a secrets table or JSON) adding or overriding models."""
+    prices = dict(DEFAULT_MODEL_PRICES)
+    overrides = get_config("MODEL_PRICES")
+    if isinstance(overrides, str):
         try:
-            response = client.messages.create(
-                model=st.secrets["ANTHROPIC_MODEL"],
-                max_tokens=6000,
-                temperature=0.2,
-                system=system_prompt,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            return response
-        
-        except anthropic.APITimeoutError:
-            retry_count += 1
-            if retry_count >= max_retries:
-                raise Exception("API timeout after multiple retries. Please try again later.")
-            
-            time.sleep(backoff_time)
-            backoff_time *= 2  # Exponential backoff
-            
-        except anthropic.APIError as e:
-            if "rate limit" in str(e).lower():
-                retry_count += 1
-                if retry_count >= max_retries:
-                    raise Exception("Rate limit reached after multiple retries. Please try again later.")
-                
-                time.sleep(backoff_time)
-                backoff_time *= 2
-            else:
-                raise e
-        
-        except Exception as e:
-            # For other exceptions, don't retry
-            raise e
+            overrides = json.loads(overrides)
+        except ValueError:
+            print("Ignoring MODEL_PRICES: not valid JSON")
+            overrides = None
+    if overrides:
+        prices.update({model: dict(price) for model, price in overrides.items()})
+    return prices
+
+def model_price(model):
+    """Per-million-token prices for a model name such as claude-sonnet-4-5-20250929."""
+    prices = get_model_prices()
+    matches = [name for name in prices if (model or "").startswith(name)]
+    return prices[max(matches, key=len)] if matches else FALLBACK_MODEL_PRICE
+
+def price_usage(model, usage, batch=False):
+    """Cost in USD of a call's usage (PROMPT_USAGE_FIELDS counts), by token type and in total.
 
-def compare_contracts_with_claude(contract1_text, contract2_text, analysis_focus, custom_prompt, custom_weights=None):
-    """Use Claude AI to compare contracts and generate insights with risk assessment."""
+    `batch` applies the Message Batches discount.
+    """
+    price = model_price(model)
+    if batch:
+        price = {name: rate * BATCH_PRICE_MULTIPLIER for name, rate in price.items()}
+    rates = {
+        "input_tokens": price["input"],
+        "cache_creation_input_tokens": price.get("cache_write", price["input"] * CACHE_WRITE_PRICE_MULTIPLIER),
+        "cache_read_input_tokens": price.get("cache_read", price["input"] * CACHE_READ_PRICE_MULTIPLIER),
+        "output_tokens": price["output"],
+    }
+    costs = {name: (usage.get(name) or 0) * rate / 1000000 for name, rate in rates.items()}
+    costs["total"] = sum(costs.values())
+    return costs
+
+# Text similarity: TF-IDF vectors and a best one-to-one assignment, in NumPy
+def tfidf_vectors(term_lists):
+    """L2-normalised TF-IDF rows for documents given as lists of terms, as a dense float32 matrix.
     
-    client = anthropic.Anthropic(api_key=st.secrets["ANTHROPIC_API_KEY"])
+    Cosine similarities between documents are then a single matrix product.
+    """
+    vocabulary = {}
+    rows, columns = [], []
+    for row, terms in enumerate(term_lists):
+        for term in terms:
+            rows.append(row)
+            columns.append(vocabulary.setdefault(term, len(vocabulary)))
     
-    # Optimize contracts to focus on relevant sections (API call optimization)
-    if analysis_focus:
-        optimized_contract1 = optimize_contract_for_claude(contract1_text, analysis_focus)
-        optimized_contract2 = optimize_contract_for_claude(contract2_text, analysis_focus)
-    else:
-        # If no focus areas, use the original behavior
-        optimized_contract1 = contract1_text[:25000]
-        optimized_contract2 = contract2_text[:25000]
-    
-    # Create dimension mapping directly from focus areas
-    scoring_dimensions = []
-    if analysis_focus:
-        scoring_dimensions = analysis_focus
-    else:
-        # Default dimensions if no focus areas selected
-        scoring_dimensions = ["Pricing", "Risk Allocation", "Service Levels", "Flexibility", "Legal Protection"]
+    width = max(len(vocabulary), 1)
+    flat_index = np.array(rows, dtype=np.intp) * width + np.array(columns, dtype=np.intp)
+    counts = np.bincount(flat_index, minlength=len(term_lists) * width).reshape(len(term_lists), width).astype(np.float32)
+    # Sublinear term frequency and smoothed inverse document frequency
+    document_frequency = np.count_nonzero(counts, axis=0)
+    vectors = np.log1p(counts) * (np.log((1 + len(term_lists)) / (1 + document_frequency)) + 1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def linear_sum_assignment(cost):
+    """Minimum-cost one-to-one assignment of rows to columns (Hungarian algorithm).
     
-    # Add custom weights for scoring if provided
-    weights_instruction = ""
-    if custom_weights and isinstance(custom_weights, dict):
-        weights_instruction = "\n\nIMPORTANT - Use these specific importance weights when evaluating contracts: "
-        for area, weight in custom_weights.items():
-            weights_instruction += f"{area}: {weight}%; "
+    Returns (rows, columns) index arrays like scipy.optimize.linear_sum_assignment,
+    with min(n, m) pairs for an n x m matrix. Each shortest augmenting path is
+    searched with vectorised column updates, so a few hundred rows take well under
+    a second.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    # Potentials and the matching, with column 0 a virtual start column
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    row_of = np.zeros(m + 1, dtype=np.intp)  # 1-based row matched to each column, 0 if free
+    way = np.zeros(m + 1, dtype=np.intp)
+    for row in range(1, n + 1):
+        row_of[0] = row
+        column = 0
+        min_reduced = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[column] = True
+            current_row = row_of[column]
+            free = ~used
+            reduced = cost[current_row - 1] - u[current_row] - v[1:]
+            better = free[1:] & (reduced < min_reduced[1:])
+            min_reduced[1:][better] = reduced[better]
+            way[1:][better] = column
+            candidates = np.where(free[1:], min_reduced[1:], np.inf)
+            next_column = int(np.argmin(candidates)) + 1
+            delta = candidates[next_column - 1]
+            u[row_of[used]] += delta
+            v[used] -= delta
+            min_reduced[free] -= delta
+            column = next_column
+            if row_of[column] == 0:
+                break
+        # Flip the augmenting path
+        while column:
+            previous = way[column]
+            row_of[column] = row_of[previous]
+            column = previous
     
-    # Smarter Claude prompting - Updated system prompt
-    system_prompt = """You are an expert procurement analyst specializing in IT and ERP service contracts with 20+ years of experience. 
-Your task is to create a detailed, actionable comparison of contract terms with these key qualities:
-1. Precision - Use exact clause references and specific language
-2. Clarity - Highlight key differences for easy comparison
-3. Practical relevance - Focus on business impact, not just legal wording
-4. Balanced assessment - Objectively identify strengths and weaknesses in both contracts
-5. Clear scoring - Use concrete evidence to justify different scores for each dimension
+    columns = np.nonzero(row_of[1:])[0]
+    rows = row_of[1:][columns] - 1
+    if transposed:
+        rows, columns = columns, rows
+    order = np.argsort(rows)
+    return rows[order], columns[order]
 
-Format your analysis as a structured side-by-side comparison with clear sections. Use bullet points for readability and bold formatting to emphasize key differences. Write in clear, concise British English focused on practical implications."""
+# Contract payload selection
+# Default input-token budget per contract (roughly the old 25,000 character cut)
+DEFAULT_CONTRACT_TOKEN_BUDGET = 6000
 
-    # Smarter Claude prompting - Enhanced dimension-specific guidance
-    dimension_guidance = {
-        "Pricing Structure": """
-- Compare base fees, variable costs, and total cost of ownership
-- Analyze payment schedules, terms, and conditions
-- Evaluate price adjustment mechanisms and inflators
-- Identify any hidden or contingent costs
-- Assess value for money and cost efficiency
-        """,
-        "Service Level Agreements": """
-- Compare specific performance metrics and their definitions
-- Analyze consequences of SLA breaches (credits, remedies)
-- Evaluate measurement and reporting mechanisms
-- Identify exclusions, force majeure, and planned downtime provisions
-- Assess enforceability and practical application of SLAs
-        """,
-        "Implementation Timeline": """
-- Compare key milestones, deadlines and dependencies
-- Evaluate specificity of project phases and deliverables
-- Analyze consequences of delays and remedies
-- Identify responsibility for delays and risk allocation
-- Assess realism and feasibility of proposed timelines
-        """,
-        "Scope of Work": """
-- Compare specific deliverables and their specifications
-- Analyze inclusivity vs. exclusivity of services
-- Evaluate clarity and thoroughness of requirements
-- Identify any gaps or ambiguities in scope definition
-- Assess alignment with business objectives
-        """,
-        "Maintenance & Support": """
-- Compare support levels, hours, and response times
-- Analyze upgrade and patch management provisions
-- Evaluate escalation procedures and priority levels
-- Identify long-term support commitments and constraints
-- Assess practical sufficiency for business operations
-        """,
-        "Data Security": """
-- Compare security standards and compliance frameworks
-- Analyze breach notification and response procedures
-- Evaluate data protection, backup and recovery provisions
-- Identify liability and indemnification for security issues
-- Assess adequacy for regulatory compliance
-        """,
-        "Exit Strategy": """
-- Compare termination rights, notice periods, and fees
-- Analyze transition services and knowledge transfer
-- Evaluate data return, migration, and deletion provisions
-- Identify potential lock-in issues or exit barriers
-- Assess practical feasibility of transition
-        """,
-        "Intellectual Property": """
-- Compare ownership rights to deliverables and data
-- Analyze license terms, restrictions, and usage rights
-- Evaluate protection of pre-existing IP and new developments
-- Identify potential conflicts or ambiguities in IP provisions
-- Assess alignment with business IP strategy
-        """,
-        "Change Management": """
-- Compare change request procedures and approvals
-- Analyze pricing mechanisms for changes and additions
-- Evaluate flexibility vs. rigidity in changing requirements
-- Identify constraints or limitations on changes
-- Assess practical workability of change processes
-        """,
-        "Performance Metrics": """
-- Compare specific KPIs, measurements, and monitoring
-- Analyze reporting requirements and cadence
-- Evaluate consequences of performance failures
-- Identify incentives for exceeding performance targets
-- Assess alignment with business success factors
-        """
+# Segments longer than this are split further, since PDF text often has no blank lines
+MAX_SEGMENT_CHARS = 2000
+
+# Marker placed where non-adjacent selected segments are joined
+OMISSION_MARKER = "[...]"
+
+def default_token_budget():
+    """Input-token budget per contract, from configuration."""
+    return int(get_config("CONTRACT_TOKEN_BUDGET", DEFAULT_CONTRACT_TOKEN_BUDGET))
+
+def split_contract_segments(contract_text):
+    """Split a contract into paragraphs, breaking over-long ones at line and sentence boundaries."""
+    segments = []
+    for paragraph in re.split(r'\n\s*\n', contract_text):
+        if len(paragraph) <= MAX_SEGMENT_CHARS:
+            segments.append(paragraph)
+            continue
+        
+        current = ""
+        for piece in re.split(r'(?<=\n)|(?<=[.;:])\s+', paragraph):
+            if not piece:
+                continue
+            if current and len(current) + len(piece) > MAX_SEGMENT_CHARS:
+                segments.append(current.strip())
+                current = ""
+            current += piece if current.endswith("\n") or not current else " " + piece
+        if current.strip():
+            segments.append(current.strip())
+    return segments
+
+def score_segments(matches, focus_areas, intro_segments):
+    """Relevance score per segment from its focus keyword hits, headers and key sections.
+    
+    Hit counts are capped per area so one keyword-stuffed paragraph cannot crowd out
+    the rest, and hitting several selected areas is rewarded.
+    """
+    scores = []
+    for i, match in enumerate(matches):
+        score = sum(min(match["hits"].get(area, 0), 5) for area in focus_areas)
+        score += len(match["hits"]) * 0.5
+        if match["header"]:
+            score += 1.0
+        if match["important"]:
+            score += 1.5
+        if i < intro_segments:
+            score += 2.0
+        scores.append(score)
+    return scores
+
+def pack_segments(segment_tokens, scores, token_budget, headers):
+    """Greedily pick the highest-scoring segments that fit the budget, returned in document order.
+    
+    Segments that do not fit are skipped in favour of smaller ones further down.
+    A selected segment also brings in the nearest preceding header when that still
+    fits, so clause references stay meaningful. `headers` lists the indices of
+    header segments in ascending order.
+    """
+    marker_tokens = estimate_packing_tokens(OMISSION_MARKER)
+    
+    # Relevant segments by score, then any budget left over goes to the remaining
+    # segments in document order, as the old head-of-contract cut did
+    relevant = sorted((i for i in range(len(scores)) if scores[i] > 0), key=lambda i: (-scores[i], segment_tokens[i]))
+    order = relevant + [i for i in range(len(scores)) if scores[i] <= 0]
+    
+    selected = set()
+    used = 0
+    for i in order:
+        cost = segment_tokens[i] + marker_tokens
+        if i in selected or used + cost > token_budget:
+            continue
+        selected.add(i)
+        used += cost
+        
+        # Attach the section header this segment belongs to
+        header_index = bisect.bisect_right(headers, i) - 1
+        if header_index >= 0:
+            header = headers[header_index]
+            header_cost = segment_tokens[header] + marker_tokens
+            if header not in selected and used + header_cost <= token_budget:
+                selected.add(header)
+                used += header_cost
+    
+    return sorted(selected), used
+
+def build_optimized_contract(contract_text, focus_areas, token_budget=None):
+    """Select the sections of a contract most relevant to the focus areas within a token budget.
+    
+    Segments are scored for relevance and packed highest-value first up to
+    `token_budget` estimated input tokens, then emitted in document order with an
+    omission marker wherever text was skipped. Returns a structured result: the
+    optimized text, the indices of the kept segments, original/optimized sizes,
+    token estimates and per-area keyword coverage (hits in the kept text vs. the
+    whole contract).
+    """
+    if token_budget is None:
+        token_budget = default_token_budget()
+    
+    segments = split_contract_segments(contract_text)
+    matches = match_paragraphs(segments, focus_areas or [])
+    segment_tokens = [estimate_packing_tokens(segment) for segment in segments]
+    total_tokens = sum(segment_tokens)
+    
+    result = {
+        "original_size": len(contract_text),
+        "paragraph_count": len(segments),
+        "token_budget": token_budget,
+        "original_tokens": total_tokens
     }
     
-    # Build dimension-specific instructions
-    dimension_instructions = ""
-    for area in scoring_dimensions:
-        dimension_instructions += f"\n\n{area}:\n{dimension_guidance.get(area, '- Analyze all relevant provisions thoroughly')}"
+    if total_tokens <= token_budget:
+        # Everything fits, so send the whole contract
+        kept_segments = list(range(len(segments)))
+        result["strategy"] = "full"
+        result["text"] = contract_text
+        result["estimated_tokens"] = total_tokens
+    else:
+        # Preserve the first few paragraphs for context (contract intro, parties, etc.)
+        intro_segments = min(10, len(segments) // 10)
+        scores = score_segments(matches, focus_areas or [], intro_segments)
+        headers = [i for i, match in enumerate(matches) if match["header"]]
+        kept_segments, used_tokens = pack_segments(segment_tokens, scores, token_budget, headers)
+        
+        parts = []
+        previous = None
+        for i in kept_segments:
+            if previous is not None and i != previous + 1:
+                parts.append(OMISSION_MARKER)
+            parts.append(segments[i])
+            previous = i
+        if kept_segments and kept_segments[-1] != len(segments) - 1:
+            parts.append(OMISSION_MARKER)
+        
+        result["strategy"] = "focus" if focus_areas else "structure"
+        result["text"] = "\n\n".join(parts)
+        result["estimated_tokens"] = used_tokens
     
-    # Smarter Claude prompting - Enhanced user prompt structure
-    prompt = f"""
-As an expert ERP contract analyst, create a detailed, actionable comparison of these two contracts.
+    result["kept_paragraphs"] = kept_segments
+    result["optimized_size"] = len(result["text"])
+    
+    kept = set(kept_segments)
+    result["coverage"] = {}
+    for area in focus_areas or []:
+        result["coverage"][area] = {
+            "kept_hits": sum(match["hits"].get(area, 0) for i, match in enumerate(matches) if i in kept),
+            "total_hits": sum(match["hits"].get(area, 0) for match in matches)
+        }
+    
+    return result
 
-FOCUS AREAS: {', '.join(scoring_dimensions)}
+@st.cache_data(max_entries=256, show_spinner=False)
+def cached_optimize_contract(text_hash, focus_key, token_budget, calibration_key, _contract_text):
+    """Memoized optimisation, shared across sessions and keyed on (text hash, focus-area set, budget).
+    
+    The calibration key re-packs contracts only when the packing ratio moves, which it
+    does once the token estimator has drifted past PACKING_RATIO_TOLERANCE.
+    """
+    return build_optimized_contract(_contract_text, list(focus_key), token_budget)
 
-{custom_prompt if custom_prompt else ''}
+def optimize_contract(contract_text, focus_areas, token_budget=None):
+    """Optimise a contract once per (content, focus-area set, budget); see build_optimized_contract."""
+    if token_budget is None:
+        token_budget = default_token_budget()
+    with trace_span("optimize_contract", text_size=len(contract_text), token_budget=token_budget) as span:
+        text_hash = hashlib.sha256(contract_text.encode("utf-8")).hexdigest()
+        optimized = cached_optimize_contract(text_hash, tuple(sorted(focus_areas or [])), token_budget,
+                                             packing_tokens_per_piece(), contract_text)
+        span["strategy"] = optimized["strategy"]
+        return optimized
 
-CONTRACT 1:
-{optimized_contract1}
+def optimize_contract_for_claude(contract_text, focus_areas, token_budget=None):
+    """Reduce token usage by focusing on relevant sections of the contract."""
+    return optimize_contract(contract_text, focus_areas, token_budget)["text"]
 
-CONTRACT 2:
-{optimized_contract2}
+# Clause alignment: pair up each contract's clauses locally so the prompt carries
+# "Clause 1.x <-> Clause 2.y" pairs per focus area instead of two independent blobs
+DEFAULT_CLAUSE_MATCH_THRESHOLD = 0.2
+# Only the most relevant clauses can fit a budget, so only they are aligned
+MAX_ALIGNED_CLAUSES = 200
+# Estimated tokens of the label line above each clause, and of the explanation and area headings
+ALIGNMENT_LABEL_TOKENS = 25
+ALIGNMENT_OVERHEAD_TOKENS = 100
+# Header-only paragraphs shorter than this become the heading of the clauses that follow
+MAX_HEADING_CHARS = 200
 
-ANALYSIS INSTRUCTIONS:
-For each focus area, provide:
-1. A direct side-by-side comparison of equivalent provisions
-2. Specific clause references where possible (e.g., "Section 3.2")
-3. Clear identification of strengths and weaknesses
-4. Explicit mention of provisions present in one contract but missing in the other
-5. Bold formatting for significant differences or important terms
+def clause_terms(text):
+    """Word unigrams and bigrams of a clause; numbers are left out so clause numbering does not drive matches."""
+    words = re.findall(r"[a-z]+", text.lower())
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
 
-FORMAT REQUIREMENTS:
-- Use this structure for each area:
-  ### [Topic Name]
-  #### Contract 1
-  - Key point 1
-  - Key point 2
-  
-  #### Contract 2
-  - Key point 1
-  - Key point 2
+def contract_clauses(contract_text, focus_areas):
+    """Numbered clauses of a contract with their section heading, focus keyword hits and relevance score."""
+    segments = split_contract_segments(contract_text)
+    matches = match_paragraphs(segments, focus_areas)
+    scores = score_segments(matches, focus_areas, min(10, len(segments) // 10))
+    clauses = []
+    heading = ""
+    for segment, match, score in zip(segments, matches, scores):
+        segment = segment.strip()
+        if not segment:
+            continue
+        if match["header"] and len(segment) < MAX_HEADING_CHARS:
+            heading = segment.splitlines()[0]
+            continue
+        clauses.append({"number": len(clauses) + 1, "text": segment, "heading": heading, "hits": match["hits"],
+                        "score": score, "tokens": estimate_packing_tokens(segment) + ALIGNMENT_LABEL_TOKENS})
+    return clauses
 
-DIMENSION-SPECIFIC GUIDANCE:{dimension_instructions}
+def clause_area(clauses, focus_areas):
+    """The focus area a clause (or aligned pair) has most keyword hits for, or None."""
+    hits = {area: sum(clause["hits"].get(area, 0) for clause in clauses if clause) for area in focus_areas}
+    best = max(hits, key=hits.get, default=None)
+    return best if best and hits[best] else None
 
-SCORING REQUIREMENTS:
-When scoring each dimension, follow this approach:
-1. First directly compare Contract 1 against Contract 2 for this dimension
-2. Assign scores on a 0-100 scale where:
-   - 50 means both contracts are equal
-   - >50 means Contract 1 is better (with 100 being Contract 1 is vastly superior)
-   - <50 means Contract 2 is better (with 0 being Contract 2 is vastly superior)
-3. The difference between the scores should reflect the magnitude of advantage
-4. Example: If Contract 1 has slightly better pricing, score it 60/100, meaning it's 10 points better than Contract 2
-5. Ensure scores are differentiated based on actual content - avoid giving similar scores to all dimensions
+def render_aligned_clauses(units, focus_areas):
+    """The prompt text for the selected pairs and unmatched clauses, grouped by focus area."""
+    def label(contract, clause):
+        heading = f", under {clause['heading']}" if clause["heading"] else ""
+        return f"Clause {contract}.{clause['number']}{heading}"
+    
+    groups = {}
+    for unit in units:
+        groups.setdefault(clause_area(unit["clauses"], focus_areas), []).append(unit)
+    
+    parts = ["CONTRACTS 1 AND 2, ALIGNED CLAUSE BY CLAUSE:\n"
+             "Clause 1.N is the N-th clause of Contract 1 and Clause 2.N the N-th clause of Contract 2. "
+             "Pairs were matched locally by wording, so treat them as likely counterparts. "
+             "Clauses listed alone have no counterpart in the other contract. Less relevant clauses are omitted."]
+    for area in [area for area in focus_areas if area in groups] + ([None] if None in groups else []):
+        parts.append(f"== {area or 'Other clauses'} ==")
+        # Pairs first, then each contract's unmatched clauses, in document order
+        for unit in sorted(groups[area], key=lambda unit: (unit["clauses"][0] is None, unit["clauses"][1] is None,
+                                                           (unit["clauses"][0] or unit["clauses"][1])["number"])):
+            clause1, clause2 = unit["clauses"]
+            if clause1 and clause2:
+                parts.append(f"[{label(1, clause1)} <-> {label(2, clause2)}]\n"
+                             f"Contract 1: {clause1['text']}\nContract 2: {clause2['text']}")
+            elif clause1:
+                parts.append(f"[{label(1, clause1)}; only in Contract 1]\n{clause1['text']}")
+            else:
+                parts.append(f"[{label(2, clause2)}; only in Contract 2]\n{clause2['text']}")
+    return "\n\n".join(parts)
 
-{weights_instruction}
+def align_contracts(contract1_text, contract2_text, focus_areas, token_budget=None):
+    """Align the clauses of two contracts and select the pairs to send within both contracts' budget.
+    
+    Clauses are compared by word TF-IDF cosine similarity and paired by a best
+    one-to-one assignment (linear_sum_assignment); pairs below the threshold
+    (CLAUSE_MATCH_THRESHOLD) count as unmatched. The relevant pairs and unmatched
+    clauses are packed, most relevant first, into twice `token_budget`. Returns the
+    prompt text with statistics in the shape of optimize_contract's results.
+    """
+    if token_budget is None:
+        token_budget = default_token_budget()
+    threshold = float(get_config("CLAUSE_MATCH_THRESHOLD", DEFAULT_CLAUSE_MATCH_THRESHOLD))
+    focus_areas = focus_areas or []
+    start = time.time()
+    
+    clauses = [contract_clauses(text, focus_areas) for text in (contract1_text, contract2_text)]
+    candidates = [sorted(contract, key=lambda clause: -clause["score"])[:MAX_ALIGNED_CLAUSES] for contract in clauses]
+    
+    units = []
+    paired = set()
+    if candidates[0] and candidates[1]:
+        vectors = tfidf_vectors([clause_terms(clause["text"]) for clause in candidates[0] + candidates[1]])
+        similarity = vectors[:len(candidates[0])] @ vectors[len(candidates[0]):].T
+        rows, columns = linear_sum_assignment(-similarity)
+        for i, j in zip(rows.tolist(), columns.tolist()):
+            if similarity[i, j] >= threshold:
+                units.append({"clauses": (candidates[0][i], candidates[1][j])})
+                paired.update(((1, candidates[0][i]["number"]), (2, candidates[1][j]["number"])))
+    pair_count = len(units)
+    for contract, contract_candidates in enumerate(candidates, 1):
+        for clause in contract_candidates:
+            if (contract, clause["number"]) not in paired:
+                units.append({"clauses": (clause, None) if contract == 1 else (None, clause)})
+    
+    # Most relevant first (pairs before unmatched clauses on a tie), skipping whatever does not fit.
+    # Unlike optimize_contract, left-over budget is not filled with irrelevant clauses.
+    for unit in units:
+        unit["score"] = sum(clause["score"] for clause in unit["clauses"] if clause)
+    if any(unit["score"] > 0 for unit in units):
+        units = [unit for unit in units if unit["score"] > 0]
+    selected = []
+    used = ALIGNMENT_OVERHEAD_TOKENS
+    for unit in sorted(units, key=lambda unit: -unit["score"]):
+        tokens = sum(clause["tokens"] for clause in unit["clauses"] if clause)
+        if used + tokens <= 2 * token_budget:
+            selected.append(unit)
+            used += tokens
+    
+    text = render_aligned_clauses(selected, focus_areas)
+    coverage = []
+    for contract, contract_all in enumerate(clauses):
+        kept = {unit["clauses"][contract]["number"] for unit in selected if unit["clauses"][contract]}
+        coverage.append({area: {"kept_hits": sum(clause["hits"].get(area, 0) for clause in contract_all
+                                                 if clause["number"] in kept),
+                                "total_hits": sum(clause["hits"].get(area, 0) for clause in contract_all)}
+                         for area in focus_areas})
+    return {
+        "text": text,
+        "original_size": len(contract1_text) + len(contract2_text),
+        "optimized_size": len(text),
+        "estimated_tokens": estimate_packing_tokens(text),
+        "token_budget": 2 * token_budget,
+        "clauses": [len(contract) for contract in clauses],
+        "pairs": pair_count,
+        "pairs_sent": sum(1 for unit in selected if all(unit["clauses"])),
+        "unmatched_sent": sum(1 for unit in selected if not all(unit["clauses"])),
+        "align_time": time.time() - start,
+        "coverage": coverage,
+    }
 
-JSON OUTPUT:
-After your analysis, include a detailed risk assessment in JSON format enclosed in triple backticks with "json" language specifier:
-```json
-{{
-  "contract1_overall_score": 75,
-  "contract2_overall_score": 65,
-  "contract1_dimension_scores": {{
-    "Dimension Name 1": 80,
-    "Dimension Name 2": 70
-  }},
-  "contract2_dimension_scores": {{
-    "Dimension Name 1": 60,
+# Template diff: redlines of the same base agreement share most of their paragraphs,
+# so the shared text is sent once and only the changed regions side by side
+DEFAULT_TEMPLATE_MIN_SHARED_RATIO = 0.6
+# Unchanged lines kept either side of a change within a changed region
+TEMPLATE_CONTEXT_LINES = 1
+# Estimated tokens of the explanation, section headings and omission notes
+TEMPLATE_OVERHEAD_TOKENS = 200
+
+def paragraph_key(paragraph):
+    """Hash of a paragraph with its whitespace normalised, so re-wrapped copies still match."""
+    return hashlib.blake2b(" ".join(paragraph.split()).encode("utf-8"), digest_size=16).digest()
+
+def diff_changed_lines(text1, text2):
+    """Both sides of a changed region, with runs of unchanged lines collapsed to a count."""
+    lines = [[" ".join(line.split()) for line in text.splitlines() if line.strip()] for text in (text1, text2)]
+    sides = ([], [])
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, lines[0], lines[1], autojunk=False).get_opcodes():
+        if tag != "equal":
+            sides[0].extend(lines[0][i1:i2])
+            sides[1].extend(lines[1][j1:j2])
+            continue
+        run = lines[0][i1:i2]
+        head = run[:TEMPLATE_CONTEXT_LINES] if i1 > 0 else []
+        tail = run[-TEMPLATE_CONTEXT_LINES:] if i2 < len(lines[0]) else []
+        if len(run) > len(head) + len(tail):
+            run = head + [f"[{len(run) - len(head) - len(tail)} unchanged lines]"] + tail
+        for side in sides:
+            side.extend(run)
+    return "\n".join(sides[0]), "\n".join(sides[1])
+
+def template_diff(contract1_text, contract2_text, focus_areas, token_budget=None):
+    """Diff two contracts derived from the same template and select what to send within both contracts' budget.
+    
+    Paragraphs are hashed and the two hash sequences diffed, then each changed
+    region is diffed line by line. Below TEMPLATE_MIN_SHARED_RATIO of shared text
+    the result has "applied" False and no text. Otherwise the changed regions
+    (most relevant first) and then the shared paragraphs (see pack_segments) are
+    packed into twice `token_budget`, so the shared text is sent at most once.
+    Returns statistics in the shape of optimize_contract's results.
+    """
+    if token_budget is None:
+        token_budget = default_token_budget()
+    min_shared_ratio = float(get_config("TEMPLATE_MIN_SHARED_RATIO", DEFAULT_TEMPLATE_MIN_SHARED_RATIO))
+    focus_areas = focus_areas or []
+    start = time.time()
+    
+    segments = [[segment.strip() for segment in split_contract_segments(text) if segment.strip()]
+                for text in (contract1_text, contract2_text)]
+    keys = [[paragraph_key(segment) for segment in contract] for contract in segments]
+    opcodes = difflib.SequenceMatcher(None, keys[0], keys[1], autojunk=False).get_opcodes()
+    # (index in contract 1, index in contract 2) of each shared paragraph
+    shared = [(i1 + offset, j1 + offset) for tag, i1, i2, j1, j2 in opcodes if tag == "equal"
+              for offset in range(i2 - i1)]
+    total_chars = sum(len(segment) for contract in segments for segment in contract)
+    shared_ratio = 2 * sum(len(segments[0][i]) for i, _ in shared) / total_chars if total_chars else 0.0
+    if shared_ratio < min_shared_ratio:
+        return {"applied": False, "shared_ratio": shared_ratio, "diff_time": time.time() - start}
+    
+    matches = [match_paragraphs(contract, focus_areas) for contract in segments]
+    scores = [score_segments(contract_matches, focus_areas, min(10, len(contract_matches) // 10))
+              for contract_matches in matches]
+    # The section heading each paragraph falls under
+    headings = []
+    for contract, contract_matches in zip(segments, matches):
+        heading = ""
+        contract_headings = []
+        for segment, match in zip(contract, contract_matches):
+            if match["header"] and len(segment) < MAX_HEADING_CHARS:
+                heading = segment.splitlines()[0]
+            contract_headings.append(heading)
+        headings.append(contract_headings)
+    
+    changes = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            continue
+        side1, side2 = diff_changed_lines("\n".join(segments[0][i1:i2]), "\n".join(segments[1][j1:j2]))
+        if side1 == side2:
+            # Only the paragraph breaks moved
+            continue
+        text = f"Contract 1: {side1 or '(not present)'}\nContract 2: {side2 or '(not present)'}"
+        changes.append({"ranges": ((i1, i2), (j1, j2)), "heading": headings[0][i1] if i2 > i1 else headings[1][j1],
+                        "text": text, "score": sum(scores[0][i1:i2]) + sum(scores[1][j1:j2]),
+                        "tokens": estimate_packing_tokens(text) + ALIGNMENT_LABEL_TOKENS})
+    
+    # Every difference that fits goes first, most relevant first; the shared text gets the rest of the budget
+    budget = 2 * token_budget
+    used = TEMPLATE_OVERHEAD_TOKENS
+    sent = set()
+    for index in sorted(range(len(changes)), key=lambda index: (-changes[index]["score"], changes[index]["tokens"])):
+        if used + changes[index]["tokens"] <= budget:
+            sent.add(index)
+            used += changes[index]["tokens"]
+    kept, _ = pack_segments([estimate_packing_tokens(segments[0][i]) for i, _ in shared], [scores[0][i] for i, _ in shared],
+                            budget - used, [index for index, (i, _) in enumerate(shared) if matches[0][i]["header"]])
+    
+    shared_parts = []
+    for position, index in enumerate(kept):
+        if position and shared[index][0] != shared[kept[position - 1]][0] + 1:
+            shared_parts.append(OMISSION_MARKER)
+        shared_parts.append(segments[0][shared[index][0]])
+    omitted_shared = len(shared) - len(kept)
+    parts = ["CONTRACTS 1 AND 2, DIFFED AGAINST THEIR SHARED TEMPLATE:\n"
+             f"Both contracts derive from the same base agreement and {shared_ratio:.0%} of their text is identical. "
+             "The identical text is given once under SHARED TEXT and applies to both contracts"
+             + (f"; {omitted_shared} less relevant shared paragraphs are omitted" if omitted_shared else "") +
+             ". Each difference follows under DIFFERENCES with both contracts' wording, where "
+             "[N unchanged lines] stands for lines that are the same in both.",
+             "== SHARED TEXT (identical in both contracts) ==",
+             "\n\n".join(shared_parts) or "(omitted)",
+             "== DIFFERENCES =="]
+    for number, index in enumerate(sorted(sent), 1):
+        heading = f", under {changes[index]['heading']}" if changes[index]["heading"] else ""
+        parts.append(f"[Change {number}{heading}]\n{changes[index]['text']}")
+    if len(sent) < len(changes):
+        parts.append(f"[{len(changes) - len(sent)} further differences omitted to fit the token budget]")
+    text = "\n\n".join(parts)
+    
+    # Shared paragraphs sent count for both contracts
+    kept_indices = ({shared[index][0] for index in kept}, {shared[index][1] for index in kept})
+    for index in sent:
+        for contract, (first, last) in enumerate(changes[index]["ranges"]):
+            kept_indices[contract].update(range(first, last))
+    coverage = [{area: {"kept_hits": sum(match["hits"].get(area, 0) for i, match in enumerate(contract_matches)
+                                         if i in kept_indices[contract]),
+                        "total_hits": sum(match["hits"].get(area, 0) for match in contract_matches)}
+                 for area in focus_areas}
+                for contract, contract_matches in enumerate(matches)]
+    return {
+        "applied": True,
+        "text": text,
+        "original_size": len(contract1_text) + len(contract2_text),
+        "optimized_size": len(text),
+        "estimated_tokens": estimate_packing_tokens(text),
+        "token_budget": budget,
+        "shared_ratio": shared_ratio,
+        "shared_paragraphs": len(shared),
+        "shared_sent": len(kept),
+        "changes": len(changes),
+        "changes_sent": len(sent),
+        "diff_time": time.time() - start,
+        "coverage": coverage,
+    }
+
+def create_executive_summary(analysis_result, risk_analysis, contract1_name, contract2_name):
+    """Generate an executive summary from the analysis results and risk assessment."""
+    
+    if not risk_analysis:
+        return "<div style='background-color: #f5f7fa; border-radius: 8px; padding: 1.5rem; margin-bottom: 2rem; border-left: 5px solid #1890ff;'><h3 style='margin-top: 0; color: #1f3a60;'>Executive Summary</h3><p>Risk analysis data not available. Please rerun the comparison.</p></div>"
+    
+    # Get overall scores and ensure they are integers
+    try:
+        c1_score = int(risk_analysis.get('contract1_overall_score', 70))
+    except (ValueError, TypeError):
+        c1_score = 70
+        
+    try:
+        c2_score = int(risk_analysis.get('contract2_overall_score', 70))
+    except (ValueError, TypeError):
+        c2_score = 70
+    
+    # Determine letter grades
+    def get_letter_grade(score):
+        try:
+            score_num = int(score)
+            if score_num >= 90: return "A"
+            elif score_num >= 80: return "B"
+            elif score_num >= 70: return "C"
+            elif score_num >= 60: return "D"
+            else: return "F"
+        except (ValueError, TypeError):
+            # Default to C if score cannot be converted to int
+            return "C"
+    
+    c1_grade = get_letter_grade(c1_score)
+    c2_grade = get_letter_grade(c2_score)
+    
+    # Get background color for grade pills
+    def get_grade_color(grade):
+        if grade == "A": return "#388e3c"
+        elif grade == "B": return "#689f38"
+        elif grade == "C": return "#afb42b"
+        elif grade == "D": return "#ffa000"
+        else: return "#e64a19"
+    
+    c1_color = get_grade_color(c1_grade)
+    c2_color = get_grade_color(c2_grade)
+    
+    # Get key advantages and disadvantages
+    c1_advantages = risk_analysis.get('contract1_advantages', ['No specific advantages identified'])
+    c1_disadvantages = risk_analysis.get('contract1_disadvantages', ['No specific disadvantages identified'])
+    c2_advantages = risk_analysis.get('contract2_advantages', ['No specific advantages identified'])
+    c2_disadvantages = risk_analysis.get('contract2_disadvantages', ['No specific disadvantages identified'])
+    
+    # Ensure lists are not empty and are actual lists
+    if not c1_advantages or not isinstance(c1_advantages, list):
+        c1_advantages = ['No specific advantages identified']
+    if not c1_disadvantages or not isinstance(c1_disadvantages, list):
+        c1_disadvantages = ['No specific disadvantages identified']
+    if not c2_advantages or not isinstance(c2_advantages, list):
+        c2_advantages = ['No specific advantages identified']
+    if not c2_disadvantages or not isinstance(c2_disadvantages, list):
+        c2_disadvantages = ['No specific disadvantages identified']
+    
+    # Get recommendations
+    recommendation = risk_analysis.get('recommendation', 'Further detailed analysis recommended.')
+    if not recommendation or not isinstance(recommendation, str):
+        recommendation = 'Further detailed analysis recommended.'
+    
+    # Top 3 points per list, joined once rather than concatenated item by item
+    def list_items(points):
+        return "".join(f"<li>{point}</li>" for point in points[:3])
+    
+    # Create the summary HTML with inline styles instead of classes
+    return f"""
+    <div style="background-color: #f5f7fa; border-radius: 8px; padding: 1.5rem; margin-bottom: 2rem; border-left: 5px solid #1890ff;">
+        <h3 style="margin-top: 0; color: #1f3a60;">Executive Summary: Contract Comparison</h3>
+        <div style="display: flex; flex-wrap: wrap;">
+            <div style="flex: 1; min-width: 300px; padding-right: 15px; margin-bottom: 15px;">
+                <h4>{contract1_name}</h4>
+                <p><span style="display: inline-block; padding: 0.35rem 0.65rem; border-radius: 1rem; font-weight: bold; color: white; background-color: {c1_color}; margin-right: 0.5rem; font-size: 0.9rem;">{c1_grade}</span> Overall Score: {c1_score}/100</p>
+                <h5>Key Advantages</h5>
+                <ul>{list_items(c1_advantages)}</ul>
+                <h5>Key Concerns</h5>
+                <ul>{list_items(c1_disadvantages)}</ul>
+            </div>
+            <div style="flex: 1; min-width: 300px; padding-left: 15px; margin-bottom: 15px;">
+                <h4>{contract2_name}</h4>
+                <p><span style="display: inline-block; padding: 0.35rem 0.65rem; border-radius: 1rem; font-weight: bold; color: white; background-color: {c2_color}; margin-right: 0.5rem; font-size: 0.9rem;">{c2_grade}</span> Overall Score: {c2_score}/100</p>
+                <h5>Key Advantages</h5>
+                <ul>{list_items(c2_advantages)}</ul>
+                <h5>Key Concerns</h5>
+                <ul>{list_items(c2_disadvantages)}</ul>
+            </div>
+        </div>
+        <h5>Recommendation</h5>
+        <div style="margin-top: 0.75rem;">
+            <p>{recommendation}</p>
+        </div>
+    </div>
+    """
+
+def normalize_dimension_name(name):
+    """Normalize dimension names to prevent duplicates with different casing/formatting."""
+    # Convert to lowercase, replace spaces and underscores with a single space, and capitalize words
+    normalized = name.lower().replace('_', ' ').strip()
+    return normalized
+
+def create_area_scorecards(risk_analysis):
+    """Generate scorecards for each comparison area."""
+    
+    if not risk_analysis or not isinstance(risk_analysis, dict):
+        return "<p>Area scoring not available.</p>"
+    
+    # Get dimension scores for both contracts
+    c1_dimensions = risk_analysis.get('contract1_dimension_scores', {})
+    c2_dimensions = risk_analysis.get('contract2_dimension_scores', {})
+    
+    if not isinstance(c1_dimensions, dict) or not isinstance(c2_dimensions, dict):
+        return "<p>Area scoring data invalid.</p>"
+    
+    # One card per dimension, joined at the end
+    cards = []
+    
+    # Normalize dimension names to prevent duplicates
+    normalized_dimensions = {}
+    
+    # First, collect all dimensions with their normalized names
+    all_dimensions = set(list(c1_dimensions.keys()) + list(c2_dimensions.keys()))
+    for dimension in all_dimensions:
+        norm_name = normalize_dimension_name(dimension)
+        # If this normalized name already exists, use the one with the higher score as it's likely more accurate
+        if norm_name in normalized_dimensions:
+            existing_dim = normalized_dimensions[norm_name]
+            c1_existing_score = c1_dimensions.get(existing_dim, 0)
+            c2_existing_score = c2_dimensions.get(existing_dim, 0)
+            c1_new_score = c1_dimensions.get(dimension, 0)
+            c2_new_score = c2_dimensions.get(dimension, 0)
+            
+            # If the new dimension has non-zero scores and the existing one has zeros, replace it
+            if (c1_new_score > 0 or c2_new_score > 0) and (c1_existing_score == 0 and c2_existing_score == 0):
+                normalized_dimensions[norm_name] = dimension
+            # Otherwise keep the one with proper capitalization or the first one
+        else:
+            normalized_dimensions[norm_name] = dimension
+    
+    # Now process the unique dimensions
+    for _, dimension in sorted(normalized_dimensions.items()):
+        c1_score = c1_dimensions.get(dimension, 0)
+        c2_score = c2_dimensions.get(dimension, 0)
+        
+        # Ensure scores are integers
+        try:
+            c1_score = int(c1_score)
+        except (ValueError, TypeError):
+            c1_score = 0
+            
+        try:
+            c2_score = int(c2_score)
+        except (ValueError, TypeError):
+            c2_score = 0
+        
+        # Determine which contract is better in this dimension
+        comparison_text = ""
+        difference = abs(c1_score - c2_score)
+        if c1_score > c2_score:
+            comparison_text = f"Contract 1 scores {difference} points higher"
+        elif c2_score > c1_score:
+            comparison_text = f"Contract 2 scores {difference} points higher"
+        else:
+            comparison_text = "Both contracts score equally"
+        
+        # Display a nicely formatted dimension name (Title Case)
+        display_name = ' '.join(word.capitalize() for word in dimension.replace('_', ' ').split())
+        
+        # Add styled scorecard markup
+        cards.append(f"""
+        <div style="background-color: #f0f8ff; border-radius: 5px; padding: 1rem; margin-bottom: 1rem; border-left: 4px solid #1976d2;">
+            <div style="font-weight: bold; margin-bottom: 0.5rem;">{display_name}</div>
+            <p>{comparison_text} in this area.</p>
+            <div style="display: flex; margin-bottom: 10px;">
+                <div style="flex: 1; margin-right: 10px;">
+                    <div style="font-weight: bold;">Contract 1: {c1_score}/100</div>
+                    <div style="height: 8px; background-color: #e0e0e0; border-radius: 4px; margin-bottom: 0.5rem; overflow: hidden;">
+                        <div style="height: 100%; width: {c1_score}%; background-color: #2196f3;"></div>
+                    </div>
+                </div>
+                <div style="flex: 1;">
+                    <div style="font-weight: bold;">Contract 2: {c2_score}/100</div>
+                    <div style="height: 8px; background-color: #e0e0e0; border-radius: 4px; margin-bottom: 0.5rem; overflow: hidden;">
+                        <div style="height: 100%; width: {c2_score}%; background-color: #2196f3;"></div>
+                    </div>
+                </div>
+            </div>
+        </div>
+        """)
+    
+    return "".join(cards)
+
+# Bump when the structure built by build_analysis_view changes; older views are rebuilt when shown
+ANALYSIS_VIEW_VERSION = 2
+
+# Near-duplicate bullet matching for Key Differences: character n-gram TF-IDF vectors
+# (see tfidf_vectors) compared in one matrix product, so rewordings of the same point still pair up
+BULLET_NGRAM_SIZE = 3
+DEFAULT_BULLET_MATCH_THRESHOLD = 0.35
+
+def normalize_bullet(text):
+    """Lowercased bullet text without markdown emphasis, padded so words have edge n-grams."""
+    text = re.sub(r'[*_`]+', '', text).lower()
+    return f" {' '.join(text.split())} "
+
+def bullet_ngrams(text, n=BULLET_NGRAM_SIZE):
+    """Overlapping character n-grams of a normalised bullet."""
+    text = normalize_bullet(text)
+    return [text[start:start + n] for start in range(max(len(text) - n + 1, 1))]
+
+def match_bullets(bullets1, bullets2, threshold=None):
+    """Pair each contract's bullets with their closest counterpart in the other contract.
+    
+    Returns (matched, unique_to_1, unique_to_2), where `matched` lists
+    [bullet1, bullet2, similarity] pairs at or above `threshold` cosine
+    similarity, best first, each bullet used at most once.
+    """
+    if threshold is None:
+        threshold = float(get_config("BULLET_MATCH_THRESHOLD", DEFAULT_BULLET_MATCH_THRESHOLD))
+    if not bullets1 or not bullets2:
+        return [], list(bullets1), list(bullets2)
+    
+    vectors = tfidf_vectors([bullet_ngrams(bullet) for bullet in list(bullets1) + list(bullets2)])
+    similarity = vectors[:len(bullets1)] @ vectors[len(bullets1):].T
+    
+    # Candidate pairs above the threshold, most similar first; greedy one-to-one assignment
+    candidates_1, candidates_2 = np.nonzero(similarity >= threshold)
+    order = np.argsort(-similarity[candidates_1, candidates_2], kind="stable")
+    used_1, used_2 = set(), set()
+    matched = []
+    for i, j in zip(candidates_1[order].tolist(), candidates_2[order].tolist()):
+        if i in used_1 or j in used_2:
+            continue
+        used_1.add(i)
+        used_2.add(j)
+        matched.append([bullets1[i], bullets2[j], round(float(similarity[i, j]), 3)])
+    
+    unique_to_1 = [bullet for i, bullet in enumerate(bullets1) if i not in used_1]
+    unique_to_2 = [bullet for j, bullet in enumerate(bullets2) if j not in used_2]
+    return matched, unique_to_1, unique_to_2
+
+def split_contract_sections(content):
+    """Split a comparison section into its `#### Contract 1` / `#### Contract 2` parts; None if it has neither."""
+    parts = re.split(r'^#### (Contract 1|Contract 2)[ \t]*$', content, flags=re.MULTILINE)
+    if len(parts) <= 2:
+        return None
+    contracts = {"Contract 1": "", "Contract 2": ""}
+    for j in range(1, len(parts), 2):
+        contracts[parts[j].strip()] = parts[j + 1] if j + 1 < len(parts) else ""
+    return contracts["Contract 1"], contracts["Contract 2"]
+
+def build_analysis_view(analysis_result, risk_analysis, contract1_name, contract2_name):
+    """Parse a comparison into what the results tabs display, once per analysis.
+    
+    Returns a JSON-serialisable dict with the `### Topic` sections (each split
+    into the two contracts' markdown, their bullets paired up by match_bullets
+    and those unique to each) and the executive summary HTML, so reruns only
+    look the parts up.
+    """
+    sections = []
+    # Headings only at the start of a line, so `#### Contract 1` is not taken for a `### ` section
+    split_text = re.split(r'^### (.*)$', analysis_result, flags=re.MULTILINE)
+    # Per line, so consecutive bullets are not skipped
+    bullet_pattern = re.compile(r'^- (.*)$', re.MULTILINE)
+    for i in range(1, len(split_text), 2):
+        content = split_text[i + 1] if i + 1 < len(split_text) else ""
+        section = {"title": split_text[i].strip()}
+        contracts = split_contract_sections(content)
+        if contracts is None:
+            # No clear split between contracts; shown as is
+            section["content"] = content
+        else:
+            bullets1 = bullet_pattern.findall(contracts[0])
+            bullets2 = bullet_pattern.findall(contracts[1])
+            matched, unique_to_1, unique_to_2 = match_bullets(bullets1, bullets2)
+            section.update(
+                contract1=contracts[0],
+                contract2=contracts[1],
+                matched=matched,
+                unique_to_1=unique_to_1,
+                unique_to_2=unique_to_2,
+            )
+        sections.append(section)
+    
+    return {
+        "version": ANALYSIS_VIEW_VERSION,
+        "sections": sections,
+        "summary_html": (create_executive_summary(analysis_result, risk_analysis, contract1_name, contract2_name)
+                         if risk_analysis else None),
+    }
+
+def matched_bullets_table(matched, contract1_name, contract2_name):
+    """Markdown table of bullet pairs from match_bullets, side by side."""
+    def cell(text):
+        return str(text).replace("|", "\\|").replace("\n", " ")
+    rows = [f"| {cell(contract1_name)} | {cell(contract2_name)} | Similarity |", "| --- | --- | ---: |"]
+    rows += [f"| {cell(bullet1)} | {cell(bullet2)} | {similarity:.0%} |" for bullet1, bullet2, similarity in matched]
+    return "\n".join(rows)
+
+def analysis_view(analysis):
+    """The view of a comparison entry, building it for entries saved before views existed."""
+    view = analysis.get('view')
+    if not view or view.get('version') != ANALYSIS_VIEW_VERSION:
+        view = build_analysis_view(analysis['result'], analysis.get('risk_analysis'),
+                                   analysis['contract1_name'], analysis['contract2_name'])
+        analysis['view'] = view
+    return view
+
+# Bump when the stored response record format changes
+RESPONSE_CACHE_VERSION = 1
+# Responses older than this are not served, and unused ones are deleted; 0 turns the cache off
+DEFAULT_RESPONSE_CACHE_TTL_HOURS = 168
+
+# Token counts reported in a response's usage, including prompt caching
+PROMPT_USAGE_FIELDS = ("input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens", "output_tokens")
+
+def response_cache_dir():
+    """Directory of the persistent API response cache."""
+    default_dir = os.path.join(os.path.expanduser("~"), ".cache", "contract_app", "responses")
+    return get_config("RESPONSE_CACHE_DIR", default_dir)
+
+def response_cache_key(request):
+    """Hash of the fully rendered request (model, parameters, system prompt and messages)."""
+    rendered = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return f"{hashlib.sha256(rendered.encode('utf-8')).hexdigest()}-v{RESPONSE_CACHE_VERSION}"
+
+def load_response(cache_key):
+    """Return a cached response rebuilt from the store, or None if absent or older than the TTL."""
+    ttl_seconds = cache_ttl_seconds("RESPONSE_CACHE_TTL_HOURS", DEFAULT_RESPONSE_CACHE_TTL_HOURS)
+    if ttl_seconds <= 0:
+        return None
+    record = disk_cache_get("responses", response_cache_dir(), cache_key, ttl_seconds, ttl_seconds)
+    if record is None:
+        return None
+    return SimpleNamespace(
+        content=[SimpleNamespace(type="text", text=record["text"])],
+        usage=SimpleNamespace(**record["usage"]),
+        stop_reason=record.get("stop_reason"),
+    )
+
+def save_response(cache_key, response):
+    """Persist the text and usage of a response, evicting expired entries and LRU entries over the size limit."""
+    ttl_seconds = cache_ttl_seconds("RESPONSE_CACHE_TTL_HOURS", DEFAULT_RESPONSE_CACHE_TTL_HOURS)
+    if ttl_seconds <= 0:
+        return
+    usage = {name: getattr(response.usage, name, None) or 0 for name in PROMPT_USAGE_FIELDS}
+    record = {
+        "text": "".join(block.text for block in response.content if getattr(block, "type", "text") == "text"),
+        "usage": usage,
+        "stop_reason": getattr(response, "stop_reason", None),
+        "stored_at": time.time(),
+    }
+    max_bytes = int(float(get_config("RESPONSE_CACHE_MAX_MB", 64)) * 1024 * 1024)
+    disk_cache_put("responses", response_cache_dir(), cache_key, record, max_bytes, ttl_seconds)
+
+# Expiry of the disk stores holding contract content
+# Expired entries are also swept on this interval, so a store that is no longer written still empties
+CACHE_SWEEP_INTERVAL_SECONDS = 3600
+
+def content_stores():
+    """(cache name, directory, idle expiry in seconds) of the disk stores that hold contract content."""
+    return [
+        ("extraction", extraction_cache_dir(), cache_ttl_seconds("EXTRACTION_CACHE_TTL_HOURS", DEFAULT_EXTRACTION_CACHE_TTL_HOURS)),
+        ("responses", response_cache_dir(), cache_ttl_seconds("RESPONSE_CACHE_TTL_HOURS", DEFAULT_RESPONSE_CACHE_TTL_HOURS)),
+    ]
+
+@st.cache_resource
+def get_cache_sweeper():
+    """Time of this process's last expiry sweep of the content stores."""
+    return {"lock": threading.Lock(), "last_sweep": 0.0}
+
+def sweep_content_stores():
+    """Delete stored entries unused past their store's expiry, at most once per sweep interval.
+    
+    A store turned off with a zero expiry is emptied.
+    """
+    sweeper = get_cache_sweeper()
+    with sweeper["lock"]:
+        if time.time() - sweeper["last_sweep"] < CACHE_SWEEP_INTERVAL_SECONDS:
+            return
+        sweeper["last_sweep"] = time.time()
+    
+    for cache_name, cache_dir, ttl_seconds in content_stores():
+        evicted = disk_cache_evict(cache_dir, float("inf"), max(ttl_seconds, 0))
+        if evicted:
+            record_cache_event(cache_name, "evictions", evicted)
+
+def delete_stored_content():
+    """Delete every stored document and response, on disk and in this process's memory caches."""
+    removed = sum(disk_cache_clear(cache_dir) for _, cache_dir, _ in content_stores())
+    cached_extract_text.clear()
+    cached_optimize_contract.clear()
+    return removed
+
+# Shared API client
+@st.cache_resource
+def get_anthropic_client():
+    """Process-wide Anthropic client shared by every session, with a pooled keep-alive HTTP client.
+
+    Pool size, keep-alive and the connect/read timeouts are configurable. Returns a dict
+    with the client and connection reuse counters (see record_connection_event).
+    """
+    resource = {"lock": threading.Lock(), "stats": {"requests": 0, "connections_opened": 0}}
+    
+    def trace(event_name, info):
+        # httpcore only reports a TCP connect when it opens a new connection
+        if event_name == "connection.connect_tcp.complete":
+            record_connection_event(resource, "connections_opened")
+    
+    def on_request(request):
+        record_connection_event(resource, "requests")
+        request.extensions["trace"] = trace
+    
+    def on_response(response):
+        update_rate_limits_from_headers(response.headers)
+    
+    timeout = httpx.Timeout(float(get_config("ANTHROPIC_READ_TIMEOUT", 600)),
+                            connect=float(get_config("ANTHROPIC_CONNECT_TIMEOUT", 10)))
+    limits = httpx.Limits(max_connections=int(get_config("ANTHROPIC_MAX_CONNECTIONS", 20)),
+                          max_keepalive_connections=int(get_config("ANTHROPIC_KEEPALIVE_CONNECTIONS", 10)),
+                          keepalive_expiry=float(get_config("ANTHROPIC_KEEPALIVE_SECONDS", 60)))
+    http_client = anthropic.DefaultHttpxClient(limits=limits, timeout=timeout,
+                                               event_hooks={"request": [on_request], "response": [on_response]})
+    # ANTHROPIC_BASE_URL points the client at a local mock of the Messages API for testing.
+    # Retries are left to robust_claude_api_call, which coordinates them with the rate limiter.
+    resource["client"] = anthropic.Anthropic(api_key=get_config("ANTHROPIC_API_KEY"),
+                                             base_url=get_config("ANTHROPIC_BASE_URL"),
+                                             timeout=timeout, http_client=http_client, max_retries=0)
+    return resource
+
+def record_connection_event(resource, event):
+    """Increment a connection counter of the shared client."""
+    with resource["lock"]:
+        resource["stats"][event] += 1
+
+# Client-side rate limiting: (config key, default per-minute limit, response header prefix)
+RATE_LIMIT_BUCKETS = {
+    "requests": ("ANTHROPIC_RPM", 50, "anthropic-ratelimit-requests"),
+    "input_tokens": ("ANTHROPIC_INPUT_TPM", 30000, "anthropic-ratelimit-input-tokens"),
+    "output_tokens": ("ANTHROPIC_OUTPUT_TPM", 8000, "anthropic-ratelimit-output-tokens"),
+}
+# Share of max_tokens reserved for a response until real responses have been seen,
+# and how quickly the observed share follows new responses
+DEFAULT_OUTPUT_TOKEN_RATIO = 0.5
+OUTPUT_TOKEN_RATIO_SMOOTHING = 0.2
+# Longest a waiting request sleeps before checking the buckets (and its cancel token) again
+RATE_LIMIT_POLL_SECONDS = 0.5
+
+@st.cache_resource
+def get_rate_limiter():
+    """Token buckets for requests, input tokens and output tokens per minute, shared by every session."""
+    now = time.time()
+    buckets = {}
+    for name, (config_key, default_limit, _) in RATE_LIMIT_BUCKETS.items():
+        limit = float(get_config(config_key, default_limit))
+        buckets[name] = {"limit": limit, "available": limit, "updated": now}
+    # Waiting requests are woken whenever tokens are given back or the limits change
+    return {"lock": threading.Condition(), "buckets": buckets, "blocked_until": 0.0,
+            "output_token_ratio": DEFAULT_OUTPUT_TOKEN_RATIO,
+            "stats": {"waits": 0, "wait_time": 0.0, "throttled": 0}}
+
+def refill_bucket(bucket, now):
+    """Top a bucket up for the time since it was last updated (limits are per minute)."""
+    elapsed = max(now - bucket["updated"], 0)
+    bucket["available"] = min(bucket["limit"], bucket["available"] + elapsed * bucket["limit"] / 60)
+    bucket["updated"] = now
+
+def acquire_rate_limit(input_tokens, output_tokens, cancel=None):
+    """Block until the shared buckets can take one request of this size; returns the seconds waited.
+
+    A request larger than a whole bucket only waits for the bucket to be full, so it
+    can never wait forever. Waiters are woken as soon as settle_rate_limit gives
+    tokens back or the API's headers change the limits. Raises if `cancel` (see
+    new_cancel_token) is cancelled while waiting.
+    """
+    limiter = get_rate_limiter()
+    needed = {"requests": 1, "input_tokens": input_tokens, "output_tokens": output_tokens}
+    start = time.time()
+    with limiter["lock"]:
+        while True:
+            check_cancelled(cancel)
+            now = time.time()
+            wait = limiter["blocked_until"] - now
+            for name, bucket in limiter["buckets"].items():
+                refill_bucket(bucket, now)
+                amount = min(needed[name], bucket["limit"])
+                if bucket["available"] < amount:
+                    wait = max(wait, (amount - bucket["available"]) * 60 / bucket["limit"])
+            
+            if wait <= 0:
+                for name, bucket in limiter["buckets"].items():
+                    bucket["available"] -= min(needed[name], bucket["limit"])
+                waited = now - start
+                if waited > 0.001:
+                    limiter["stats"]["waits"] += 1
+                    limiter["stats"]["wait_time"] += waited
+                return waited
+            
+            limiter["lock"].wait(min(wait, RATE_LIMIT_POLL_SECONDS))
+
+def settle_rate_limit(reserved, actual):
+    """Return the unused part of a reservation (or charge the overrun) once the usage is known."""
+    limiter = get_rate_limiter()
+    with limiter["lock"]:
+        for name, reserved_amount in reserved.items():
+            bucket = limiter["buckets"][name]
+            bucket["available"] = min(bucket["limit"], bucket["available"] + reserved_amount - actual.get(name, 0))
+        limiter["lock"].notify_all()
+
+def estimate_output_tokens(max_tokens):
+    """Output tokens to reserve for a request: max_tokens scaled by the share recent responses used."""
+    return max(1, min(max_tokens, round(max_tokens * get_rate_limiter()["output_token_ratio"])))
+
+def record_output_tokens(max_tokens, output_tokens):
+    """Fold a response's share of its max_tokens into the estimate used for reservations."""
+    limiter = get_rate_limiter()
+    with limiter["lock"]:
+        limiter["output_token_ratio"] += OUTPUT_TOKEN_RATIO_SMOOTHING * (
+            min(output_tokens / max_tokens, 1.0) - limiter["output_token_ratio"])
+
+def pause_rate_limiter(seconds):
+    """Hold back every session's requests for `seconds`, e.g. after a 429."""
+    limiter = get_rate_limiter()
+    with limiter["lock"]:
+        limiter["blocked_until"] = max(limiter["blocked_until"], time.time() + seconds)
+        limiter["stats"]["throttled"] += 1
+        limiter["lock"].notify_all()
+
+def parse_reset_time(value):
+    """Epoch seconds of an RFC 3339 rate-limit reset header, or None."""
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+def update_rate_limits_from_headers(headers):
+    """Align the local buckets with the limits the API reports on every response."""
+    limiter = get_rate_limiter()
+    with limiter["lock"]:
+        now = time.time()
+        for name, (_, _, prefix) in RATE_LIMIT_BUCKETS.items():
+            remaining = headers.get(f"{prefix}-remaining")
+            if remaining is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+            bucket = limiter["buckets"][name]
+            refill_bucket(bucket, now)
+            bucket["available"] = min(bucket["available"], remaining)
+            if remaining <= 0:
+                reset_time = parse_reset_time(headers.get(f"{prefix}-reset"))
+                if reset_time:
+                    limiter["blocked_until"] = max(limiter["blocked_until"], reset_time)
+        limiter["lock"].notify_all()
+
+def retry_after_seconds(error):
+    """Seconds from an error response's retry-after header, or None."""
+    response = getattr(error, "response", None)
+    try:
+        return max(float(response.headers["retry-after"]), 0.0)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+def classify_api_error(error, attempt):
+    """Decide whether an API error is worth retrying.
+
+    Returns (delay in seconds, message to raise if retries run out), or (None, None)
+    for errors that will not succeed on retry (e.g. 400, 401, 404).
+    """
+    # Exponential backoff with jitter, capped at 30 seconds
+    ceiling = min(30.0, 2.0 * 2 ** attempt)
+    backoff = ceiling / 2 + random.uniform(0, ceiling / 2)
+    
+    if isinstance(error, anthropic.APITimeoutError):
+        return backoff, "API timeout after multiple retries. Please try again later."
+    if isinstance(error, anthropic.APIConnectionError):
+        return backoff, "Could not connect to the Claude API after multiple retries. Please try again later."
+    if isinstance(error, anthropic.APIStatusError):
+        retry_after = retry_after_seconds(error)
+        if error.status_code == 429:
+            delay = retry_after + random.uniform(0, 1) if retry_after is not None else backoff
+            # Every session shares the organisation's limit, so they all back off
+            pause_rate_limiter(delay)
+            return delay, "Rate limit reached after multiple retries. Please try again later."
+        if error.status_code == 529:
+            return max(backoff, retry_after or 0), "Claude is overloaded. Please try again later."
+        if error.status_code >= 500:
+            return max(backoff, retry_after or 0), f"Claude API error ({error.status_code}) after multiple retries. Please try again later."
+    return None, None
+
+# Cancellation of in-flight requests
+def new_cancel_token():
+    """Cancellation shared by every request of one analysis (see cancel_requests)."""
+    return {"event": threading.Event(), "lock": threading.Lock(), "streams": set()}
+
+def cancel_requests(cancel):
+    """Stop an analysis: requests not yet sent are skipped and open response streams are closed."""
+    with cancel["lock"]:
+        cancel["event"].set()
+        streams = list(cancel["streams"])
+    for stream in streams:
+        try:
+            stream.close()
+        except Exception as e:
+            print(f"Error closing a cancelled response stream: {str(e)}")
+    # Wake requests waiting for the rate limiter so they notice the cancellation
+    limiter = get_rate_limiter()
+    with limiter["lock"]:
+        limiter["lock"].notify_all()
+
+def check_cancelled(cancel):
+    """Raise if `cancel` (which may be None) has been cancelled."""
+    if cancel is not None and cancel["event"].is_set():
+        raise Exception("Analysis cancelled")
+
+def cancellable_sleep(seconds, cancel=None):
+    """time.sleep that wakes up and raises as soon as `cancel` is cancelled."""
+    if cancel is None:
+        time.sleep(seconds)
+    elif cancel["event"].wait(seconds):
+        raise Exception("Analysis cancelled")
+
+def stream_claude_response(client, request, on_text, call_stats, cancel=None):
+    """Stream a Messages API response, passing the accumulated text to `on_text` as it arrives.
+    
+    Records time to first token in `call_stats` and returns the final message. While
+    streaming, the response is registered with `cancel` so cancelling closes the
+    connection instead of waiting for the rest of the output.
+    """
+    start_time = time.time()
+    text = ""
+    with client.messages.stream(**request) as stream:
+        if cancel is not None:
+            with cancel["lock"]:
+                check_cancelled(cancel)
+                cancel["streams"].add(stream)
+        try:
+            for chunk in stream.text_stream:
+                if not text:
+                    call_stats["time_to_first_token"] = time.time() - start_time
+                text += chunk
+                on_text(text)
+            return stream.get_final_message()
+        finally:
+            if cancel is not None:
+                with cancel["lock"]:
+                    cancel["streams"].discard(stream)
+
+def build_message_request(prompt, system_prompt, max_tokens=6000):
+    """Messages API parameters for a prompt; also the params of a Message Batches request"""
+    return {
+        "model": get_config("ANTHROPIC_MODEL"),
+        "max_tokens": max_tokens,
+        "temperature": 0.2,
+        "system": system_prompt,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ]
+    }
+
+@traced("robust_claude_api_call")
+def robust_claude_api_call(client, prompt, system_prompt, on_text=None, call_stats=None, max_tokens=6000,
+                           use_cache=True, cancel=None):
+    """Handle Claude API calls with robust error handling and retries
+    
+    `prompt` and `system_prompt` may be strings or lists of content blocks (see
+    cached_text_block). When `on_text` is given the response is streamed and
+    `on_text` receives the accumulated text after every chunk. Timing figures (API
+    time, time to first token, output tokens/second) and the usage token counts
+    are written into `call_stats` if provided.
+    
+    Identical requests are answered from the persistent response cache unless
+    `use_cache` is False; fresh responses are always stored. Every API request first
+    waits for the shared rate limiter, and 429, 529, 5xx, timeout and connection
+    errors are retried with jittered backoff (honouring retry-after).
+    
+    With a `cancel` token (see new_cancel_token) the response is always streamed, so
+    cancelling aborts the request mid-response; waits and retries stop too.
+    """
+    max_retries = int(get_config("ANTHROPIC_MAX_RETRIES", 3))
+    retry_count = 0
+    if call_stats is None:
+        call_stats = {}
+    
+    request = build_message_request(prompt, system_prompt, max_tokens)
+    cache_key = response_cache_key(request)
+    call_stats["model"] = request["model"]
+    call_stats["api_requests"] = 1
+    call_stats["response_cache_hits"] = 0
+    if use_cache:
+        start_time = time.time()
+        response = load_response(cache_key)
+        if response is not None:
+            call_stats["response_cache_hits"] = 1
+            call_stats["api_time"] = time.time() - start_time
+            call_stats["streamed"] = on_text is not None
+            if on_text is not None:
+                call_stats["time_to_first_token"] = call_stats["api_time"]
+                on_text(response.content[0].text)
+            return response
+    
+    # Reserve the estimated input and output; settled once the usage is known
+    reserved = {"input_tokens": estimate_tokens(blocks_text(system_prompt) + blocks_text(prompt)),
+                "output_tokens": estimate_output_tokens(max_tokens)}
+    call_stats["queue_time"] = 0.0
+    call_stats["api_retries"] = 0
+    
+    while True:
+        call_stats["queue_time"] += acquire_rate_limit(reserved["input_tokens"], reserved["output_tokens"], cancel)
+        try:
+            start_time = time.time()
+            if on_text is not None or cancel is not None:
+                response = stream_claude_response(client, request, on_text or (lambda text: None), call_stats, cancel)
+            else:
+                response = client.messages.create(**request)
+            
+            call_stats["api_time"] = time.time() - start_time
+            call_stats["streamed"] = on_text is not None
+            for name in PROMPT_USAGE_FIELDS:
+                call_stats[name] = getattr(response.usage, name, 0) or 0
+            settle_rate_limit(reserved, {
+                "input_tokens": call_stats["input_tokens"] + call_stats["cache_creation_input_tokens"],
+                "output_tokens": call_stats["output_tokens"],
+            })
+            record_output_tokens(max_tokens, call_stats["output_tokens"])
+            output_tokens = call_stats["output_tokens"]
+            generation_time = call_stats["api_time"] - call_stats.get("time_to_first_token", 0)
+            if output_tokens and generation_time > 0:
+                call_stats["output_tokens_per_second"] = output_tokens / generation_time
+            if getattr(response, "stop_reason", None) != "max_tokens":
+                save_response(cache_key, response)
+            return response
+        
+        except anthropic.APIError as e:
+            # Nothing was generated, so give the output allowance back
+            settle_rate_limit(reserved, {"input_tokens": reserved["input_tokens"]})
+            # A stream closed by cancel_requests surfaces as a connection error; never retry it
+            check_cancelled(cancel)
+            delay, message = classify_api_error(e, retry_count)
+            if delay is None:
+                raise e
+            
+            retry_count += 1
+            if retry_count >= max_retries:
+                raise Exception(message)
+            
+            call_stats["api_retries"] = retry_count
+            cancellable_sleep(delay, cancel)
+        
+        except Exception as e:
+            # For other exceptions, don't retry
+            settle_rate_limit(reserved, {"input_tokens": reserved["input_tokens"]})
+            check_cancelled(cancel)
+            raise e
+
+# Smarter Claude prompting - Updated system prompt
+COMPARISON_SYSTEM_PROMPT = """You are an expert procurement analyst specializing in IT and ERP service contracts with 20+ years of experience. 
+Your task is to create a detailed, actionable comparison of contract terms with these key qualities:
+1. Precision - Use exact clause references and specific language
+2. Clarity - Highlight key differences for easy comparison
+3. Practical relevance - Focus on business impact, not just legal wording
+4. Balanced assessment - Objectively identify strengths and weaknesses in both contracts
+5. Clear scoring - Use concrete evidence to justify different scores for each dimension
+
+Format your analysis as a structured side-by-side comparison with clear sections. Use bullet points for readability and bold formatting to emphasize key differences. Write in clear, concise British English focused on practical implications."""
+
+# Smarter Claude prompting - Enhanced dimension-specific guidance
+DIMENSION_GUIDANCE = {
+    "Pricing Structure": """
+- Compare base fees, variable costs, and total cost of ownership
+- Analyze payment schedules, terms, and conditions
+- Evaluate price adjustment mechanisms and inflators
+- Identify any hidden or contingent costs
+- Assess value for money and cost efficiency
+    """,
+    "Service Level Agreements": """
+- Compare specific performance metrics and their definitions
+- Analyze consequences of SLA breaches (credits, remedies)
+- Evaluate measurement and reporting mechanisms
+- Identify exclusions, force majeure, and planned downtime provisions
+- Assess enforceability and practical application of SLAs
+    """,
+    "Implementation Timeline": """
+- Compare key milestones, deadlines and dependencies
+- Evaluate specificity of project phases and deliverables
+- Analyze consequences of delays and remedies
+- Identify responsibility for delays and risk allocation
+- Assess realism and feasibility of proposed timelines
+    """,
+    "Scope of Work": """
+- Compare specific deliverables and their specifications
+- Analyze inclusivity vs. exclusivity of services
+- Evaluate clarity and thoroughness of requirements
+- Identify any gaps or ambiguities in scope definition
+- Assess alignment with business objectives
+    """,
+    "Maintenance & Support": """
+- Compare support levels, hours, and response times
+- Analyze upgrade and patch management provisions
+- Evaluate escalation procedures and priority levels
+- Identify long-term support commitments and constraints
+- Assess practical sufficiency for business operations
+    """,
+    "Data Security": """
+- Compare security standards and compliance frameworks
+- Analyze breach notification and response procedures
+- Evaluate data protection, backup and recovery provisions
+- Identify liability and indemnification for security issues
+- Assess adequacy for regulatory compliance
+    """,
+    "Exit Strategy": """
+- Compare termination rights, notice periods, and fees
+- Analyze transition services and knowledge transfer
+- Evaluate data return, migration, and deletion provisions
+- Identify potential lock-in issues or exit barriers
+- Assess practical feasibility of transition
+    """,
+    "Intellectual Property": """
+- Compare ownership rights to deliverables and data
+- Analyze license terms, restrictions, and usage rights
+- Evaluate protection of pre-existing IP and new developments
+- Identify potential conflicts or ambiguities in IP provisions
+- Assess alignment with business IP strategy
+    """,
+    "Change Management": """
+- Compare change request procedures and approvals
+- Analyze pricing mechanisms for changes and additions
+- Evaluate flexibility vs. rigidity in changing requirements
+- Identify constraints or limitations on changes
+- Assess practical workability of change processes
+    """,
+    "Performance Metrics": """
+- Compare specific KPIs, measurements, and monitoring
+- Analyze reporting requirements and cadence
+- Evaluate consequences of performance failures
+- Identify incentives for exceeding performance targets
+- Assess alignment with business success factors
+    """
+}
+
+# Default dimensions if no focus areas selected
+DEFAULT_SCORING_DIMENSIONS = ["Pricing", "Risk Allocation", "Service Levels", "Flexibility", "Legal Protection"]
+
+# Fallback dimension scores - centered around 50 (equal) but intentionally varied to avoid all 70s
+DEFAULT_DIMENSION_SCORES = [55, 45, 60, 40, 52, 48, 65, 35, 58, 42]
+
+# Per-dimension fan-out: each call only writes one section and a small JSON block
+DIMENSION_MAX_TOKENS = 1500
+SYNTHESIS_MAX_TOKENS = 800
+DEFAULT_FAN_OUT_CONCURRENCY = 4
+FAN_OUT_RETRIES = 1
+
+def get_scoring_dimensions(analysis_focus):
+    """Create dimension mapping directly from focus areas"""
+    return analysis_focus if analysis_focus else DEFAULT_SCORING_DIMENSIONS
+
+def build_weights_instruction(custom_weights):
+    """Add custom weights for scoring if provided"""
+    weights_instruction = ""
+    if custom_weights and isinstance(custom_weights, dict):
+        weights_instruction = "\n\nIMPORTANT - Use these specific importance weights when evaluating contracts: "
+        for area, weight in custom_weights.items():
+            weights_instruction += f"{area}: {weight}%; "
+    return weights_instruction
+
+def cached_text_block(text, cache=True):
+    """Text content block, marked as a prompt caching breakpoint unless `cache` is False"""
+    block = {"type": "text", "text": text}
+    if cache:
+        block["cache_control"] = {"type": "ephemeral"}
+    return block
+
+def blocks_text(blocks):
+    """Concatenated text of a list of content blocks (or a plain string prompt)"""
+    if isinstance(blocks, str):
+        return blocks
+    return "".join(block.get("text", "") for block in blocks)
+
+def build_comparison_system_blocks():
+    """System prompt plus the guidance for every known dimension, as one cacheable block.
+
+    Including all the guidance (not just the selected areas) keeps this prefix identical
+    across analyses, so it is read from the prompt cache however the focus changes.
+    """
+    guidance = "".join(f"\n\n{area}:\n{text}" for area, text in DIMENSION_GUIDANCE.items())
+    return [cached_text_block(f"{COMPARISON_SYSTEM_PROMPT}\n\nDIMENSION-SPECIFIC GUIDANCE:{guidance}")]
+
+COMPARISON_SYSTEM_BLOCKS = build_comparison_system_blocks()
+
+def build_contract_blocks(optimized_contract1, optimized_contract2):
+    """One cacheable block per contract, so a re-run against the same pair only pays for the instructions"""
+    return [
+        cached_text_block(f"CONTRACT 1:\n{optimized_contract1}"),
+        cached_text_block(f"CONTRACT 2:\n{optimized_contract2}"),
+    ]
+
+def build_combined_contract_blocks(combined):
+    """Both contracts as one cacheable block (align_contracts or template_diff text), in place of the two contract blocks"""
+    return [cached_text_block(combined["text"])]
+
+def dimension_guidance_instructions(scoring_dimensions):
+    """Guidance for focus areas that are not already covered in the system prompt"""
+    dimension_instructions = ""
+    for area in scoring_dimensions:
+        if area not in DIMENSION_GUIDANCE:
+            dimension_instructions += f"\n\n{area}:\n- Analyze all relevant provisions thoroughly"
+    return dimension_instructions
+
+def build_comparison_prompt(contract_blocks, scoring_dimensions, custom_prompt, weights_instruction):
+    """Build the single-call comparison prompt covering every scoring dimension.
+
+    Returns content blocks: the cacheable contract blocks (build_contract_blocks or
+    build_combined_contract_blocks), then the instructions that vary with the focus
+    areas, custom prompt and weights.
+    """
+
+    # Smarter Claude prompting - Enhanced user prompt structure
+    return contract_blocks + [cached_text_block(f"""
+As an expert ERP contract analyst, create a detailed, actionable comparison of the two contracts above.
+
+FOCUS AREAS: {', '.join(scoring_dimensions)}
+
+{custom_prompt if custom_prompt else ''}
+
+ANALYSIS INSTRUCTIONS:
+For each focus area, provide:
+1. A direct side-by-side comparison of equivalent provisions
+2. Specific clause references where possible (e.g., "Section 3.2")
+3. Clear identification of strengths and weaknesses
+4. Explicit mention of provisions present in one contract but missing in the other
+5. Bold formatting for significant differences or important terms
+
+FORMAT REQUIREMENTS:
+- Use this structure for each area:
+  ### [Topic Name]
+  #### Contract 1
+  - Key point 1
+  - Key point 2
+  
+  #### Contract 2
+  - Key point 1
+  - Key point 2
+
+DIMENSION-SPECIFIC GUIDANCE:
+Apply the dimension-specific guidance from your instructions to each focus area.{dimension_guidance_instructions(scoring_dimensions)}
+
+SCORING REQUIREMENTS:
+When scoring each dimension, follow this approach:
+1. First directly compare Contract 1 against Contract 2 for this dimension
+2. Assign scores on a 0-100 scale where:
+   - 50 means both contracts are equal
+   - >50 means Contract 1 is better (with 100 being Contract 1 is vastly superior)
+   - <50 means Contract 2 is better (with 0 being Contract 2 is vastly superior)
+3. The difference between the scores should reflect the magnitude of advantage
+4. Example: If Contract 1 has slightly better pricing, score it 60/100, meaning it's 10 points better than Contract 2
+5. Ensure scores are differentiated based on actual content - avoid giving similar scores to all dimensions
+
+{weights_instruction}
+
+JSON OUTPUT:
+After your analysis, include a detailed risk assessment in JSON format enclosed in triple backticks with "json" language specifier:
+```json
+{{
+  "contract1_overall_score": 75,
+  "contract2_overall_score": 65,
+  "contract1_dimension_scores": {{
+    "Dimension Name 1": 80,
+    "Dimension Name 2": 70
+  }},
+  "contract2_dimension_scores": {{
+    "Dimension Name 1": 60,
     "Dimension Name 2": 75
   }},
   "contract1_advantages": [
@@ -705,187 +2722,1840 @@ After your analysis, include a detailed risk assessment in JSON format enclosed
 }}
 ```
 
-CRITICAL: For the JSON output:
-1. Use EXACTLY these dimension names: {', '.join(scoring_dimensions)}
-2. Ensure each focus area has corresponding scores in both contracts
-3. Make sure overall scores reflect the weighted importance of each dimension
-4. Provide at least 3 specific advantages and disadvantages for each contract
-5. Ensure your recommendation is clear and actionable
-"""
+CRITICAL: For the JSON output:
+1. Use EXACTLY these dimension names: {', '.join(scoring_dimensions)}
+2. Ensure each focus area has corresponding scores in both contracts
+3. Make sure overall scores reflect the weighted importance of each dimension
+4. Provide at least 3 specific advantages and disadvantages for each contract
+5. Ensure your recommendation is clear and actionable
+""", cache=False)]
+
+def build_default_risk_analysis(scoring_dimensions):
+    """Create default risk analysis with basic structure but varied scores"""
+    default_risk_analysis = {
+        "contract1_overall_score": 55,
+        "contract2_overall_score": 45,
+        "contract1_dimension_scores": {},
+        "contract2_dimension_scores": {},
+        "categories": [],
+        "contract1_advantages": ["Good overall terms"],
+        "contract1_disadvantages": ["Could be improved in some areas"],
+        "contract2_advantages": ["Good overall terms"],
+        "contract2_disadvantages": ["Could be improved in some areas"],
+        "recommendation": "Both contracts have strengths and weaknesses. Further analysis recommended."
+    }
+
+    for i, dimension in enumerate(scoring_dimensions):
+        score_idx = i % len(DEFAULT_DIMENSION_SCORES)
+        default_risk_analysis["contract1_dimension_scores"][dimension] = DEFAULT_DIMENSION_SCORES[score_idx]
+        # Contract 2 score is implied (100 - contract1_score)
+        default_risk_analysis["contract2_dimension_scores"][dimension] = 100 - DEFAULT_DIMENSION_SCORES[score_idx]
+
+    return default_risk_analysis
+
+def complete_weights(scoring_dimensions, custom_weights):
+    """Copy of `custom_weights` where dimensions without a weight share whatever is left of 100% equally"""
+    custom_weights = dict(custom_weights or {})
+    remaining_weight = 100 - sum(custom_weights.values())
+    remaining_areas = [area for area in scoring_dimensions if area not in custom_weights]
+
+    if remaining_areas and remaining_weight > 0:
+        weight_per_area = remaining_weight / len(remaining_areas)
+        for area in remaining_areas:
+            custom_weights[area] = weight_per_area
+    return custom_weights
+
+def apply_custom_weights(risk_analysis, scoring_dimensions, custom_weights):
+    """Recalculate the overall scores in `risk_analysis` as a weighted mean of the dimension scores.
+
+    Dimensions without a weight share whatever is left of 100% equally, so an empty
+    `custom_weights` gives a plain average.
+    """
+    try:
+        # Convert any selected focus areas not in weights to equal distribution
+        custom_weights = complete_weights(scoring_dimensions, custom_weights)
+
+        # Calculate weighted scores
+        c1_score = 0
+        c2_score = 0
+        total_weight = 0
+
+        # Use exact dimension names from scoring_dimensions
+        for dimension in scoring_dimensions:
+            # Try to find this dimension with normalization
+            dim_to_use = None
+            for existing_dim in risk_analysis["contract1_dimension_scores"].keys():
+                if normalize_dimension_name(dimension) == normalize_dimension_name(existing_dim):
+                    dim_to_use = existing_dim
+                    break
+
+            if dim_to_use and dimension in custom_weights:
+                weight = custom_weights[dimension]
+                c1_score += risk_analysis["contract1_dimension_scores"][dim_to_use] * (weight / 100)
+                c2_score += risk_analysis["contract2_dimension_scores"].get(dim_to_use, 100 - risk_analysis["contract1_dimension_scores"][dim_to_use]) * (weight / 100)
+                total_weight += weight
+
+        # Apply the weighted scores
+        if total_weight > 0:
+            risk_analysis["contract1_overall_score"] = int(c1_score * (100 / total_weight))
+            risk_analysis["contract2_overall_score"] = int(c2_score * (100 / total_weight))
+    except Exception as e:
+        # If there's an error applying weights, log it but continue
+        print(f"Error applying custom weights: {str(e)}")
+
+def parse_comparison_response(full_response, scoring_dimensions, custom_weights):
+    """Split a full comparison response into the analysis text and the risk assessment dict.
+    
+    Returns (analysis text, risk assessment, parse info), where parse info holds the
+    raw "debug_json" and the "warnings" to show when default scores had to be used.
+    Nothing is shown here, since analyses are parsed on background threads.
+    """
+
+    # Find and extract the JSON part (assuming it's at the end)
+    json_match = re.search(r'```json\s*(.*?)\s*```', full_response, re.DOTALL)
+    default_risk_analysis = build_default_risk_analysis(scoring_dimensions)
+    parse_info = {"warnings": [], "debug_json": None}
+
+    if json_match:
+        json_text = json_match.group(1)
+        # Remove the JSON part from the main response
+        comparison_text = full_response[:json_match.start()].strip()
+
+        # Parse the JSON
+        try:
+            risk_analysis = json.loads(json_text)
+
+            # Debug the parsed JSON
+            parse_info["debug_json"] = json_text
+
+            # Ensure all required fields exist with defaults if not present
+            risk_analysis.setdefault("contract1_overall_score", 55)
+            risk_analysis.setdefault("contract2_overall_score", 45)
+
+            # Ensure dimension scores exist for all focus areas
+            if "contract1_dimension_scores" not in risk_analysis:
+                risk_analysis["contract1_dimension_scores"] = {}
+            if "contract2_dimension_scores" not in risk_analysis:
+                risk_analysis["contract2_dimension_scores"] = {}
+
+            # Fill in any missing dimension scores
+            for dimension in scoring_dimensions:
+                dim_found = False
+                # Check for variations of the dimension name (case insensitive, with underscores/spaces)
+                for existing_dim in risk_analysis["contract1_dimension_scores"].keys():
+                    if normalize_dimension_name(dimension) == normalize_dimension_name(existing_dim):
+                        dim_found = True
+                        break
+
+                if not dim_found:
+                    risk_analysis["contract1_dimension_scores"][dimension] = default_risk_analysis["contract1_dimension_scores"][dimension]
+                    risk_analysis["contract2_dimension_scores"][dimension] = default_risk_analysis["contract2_dimension_scores"][dimension]
+
+            # Apply any custom weights to adjust overall scores if provided
+            if custom_weights and isinstance(custom_weights, dict):
+                apply_custom_weights(risk_analysis, scoring_dimensions, custom_weights)
+
+            # Ensure other required fields exist
+            for key, value in default_risk_analysis.items():
+                if key not in ("contract1_dimension_scores", "contract2_dimension_scores"):
+                    risk_analysis.setdefault(key, value)
+
+        except json.JSONDecodeError as e:
+            # If JSON parsing fails, use default structure
+            parse_info["warnings"].append(f"Error parsing risk assessment JSON. Using default values. Error: {str(e)}")
+            risk_analysis = default_risk_analysis
+            comparison_text = full_response
+    else:
+        # If no JSON found, use default structure
+        parse_info["warnings"].append("No risk assessment JSON found in the response. Using default values.")
+        comparison_text = full_response
+        risk_analysis = default_risk_analysis
+
+    return comparison_text, risk_analysis, parse_info
+
+def build_dimension_prompt(contract_blocks, dimension, custom_prompt):
+    """Build the prompt for analysing a single focus area of the two contracts.
+
+    The contract blocks are the same as in build_comparison_prompt, so every focus
+    area (and the single-call analysis) shares the cached prefix.
+    """
+    return contract_blocks + [cached_text_block(f"""
+As an expert ERP contract analyst, compare the two contracts above on one focus area only: {dimension}
+
+{custom_prompt if custom_prompt else ''}
+
+ANALYSIS INSTRUCTIONS:
+1. A direct side-by-side comparison of equivalent provisions
+2. Specific clause references where possible (e.g., "Section 3.2")
+3. Clear identification of strengths and weaknesses
+4. Explicit mention of provisions present in one contract but missing in the other
+5. Bold formatting for significant differences or important terms
+
+GUIDANCE FOR {dimension}:
+{'Apply the dimension-specific guidance from your instructions.' if dimension in DIMENSION_GUIDANCE else '- Analyze all relevant provisions thoroughly'}
+
+FORMAT REQUIREMENTS:
+Write exactly one section with this structure:
+### {dimension}
+#### Contract 1
+- Key point 1
+- Key point 2
+
+#### Contract 2
+- Key point 1
+- Key point 2
+
+SCORING REQUIREMENTS:
+Score Contract 1 against Contract 2 on a 0-100 scale where 50 means both contracts are equal,
+>50 means Contract 1 is better and <50 means Contract 2 is better. contract2_score is 100 minus contract1_score.
+
+JSON OUTPUT:
+After the section, include this JSON enclosed in triple backticks with "json" language specifier:
+```json
+{{
+  "contract1_score": 60,
+  "contract2_score": 40,
+  "contract1_advantages": ["Specific advantage"],
+  "contract1_disadvantages": ["Specific disadvantage"],
+  "contract2_advantages": ["Specific advantage"],
+  "contract2_disadvantages": ["Specific disadvantage"]
+}}
+```
+""", cache=False)]
+
+def parse_dimension_response(full_response, dimension):
+    """Split a single-dimension response into its section text and scores.
+
+    Raises ValueError if the JSON block is missing or unusable so the dimension is retried.
+    """
+    json_match = re.search(r'```json\s*(.*?)\s*```', full_response, re.DOTALL)
+    if not json_match:
+        raise ValueError(f"No JSON found in the {dimension} analysis")
+
+    result = json.loads(json_match.group(1))
+    contract1_score = int(result["contract1_score"])
+    result["contract1_score"] = contract1_score
+    result["contract2_score"] = int(result.get("contract2_score", 100 - contract1_score))
+    for key in ("contract1_advantages", "contract1_disadvantages", "contract2_advantages", "contract2_disadvantages"):
+        if not isinstance(result.get(key), list):
+            result[key] = []
+
+    section = full_response[:json_match.start()].strip()
+    # Make sure every section is headed consistently for the merge and the results view
+    if not section.startswith("### "):
+        section = f"### {dimension}\n{section}"
+    return section, result
+
+def compare_dimension_with_claude(client, contract_blocks, dimension, custom_prompt, call_stats, use_cache=True,
+                                  cancel=None):
+    """Analyse a single focus area; returns (section_text, dimension_result)"""
+    build_start = time.time()
+    prompt = build_dimension_prompt(contract_blocks, dimension, custom_prompt)
+    call_stats["prompt_build_time"] = time.time() - build_start
+    response = robust_claude_api_call(client, prompt, COMPARISON_SYSTEM_BLOCKS, call_stats=call_stats,
+                                      max_tokens=DIMENSION_MAX_TOKENS, use_cache=use_cache, cancel=cancel)
+    calibrate_token_estimator(blocks_text(COMPARISON_SYSTEM_BLOCKS) + blocks_text(prompt), total_input_tokens(response.usage))
+    parse_start = time.time()
+    try:
+        return parse_dimension_response(response.content[0].text, dimension)
+    finally:
+        call_stats["parse_time"] = time.time() - parse_start
+
+def fan_out_concurrency():
+    """Number of focus areas analysed at the same time (FAN_OUT_CONCURRENCY)"""
+    try:
+        return max(1, int(get_config("FAN_OUT_CONCURRENCY", DEFAULT_FAN_OUT_CONCURRENCY)))
+    except (TypeError, ValueError):
+        return DEFAULT_FAN_OUT_CONCURRENCY
+
+
+def run_retry_rounds(keys, task, on_success, on_error, use_cache=True, cancel=None):
+    """Run `task(key, attempt, use_cache)` for each key with at most FAN_OUT_CONCURRENCY in flight.
+
+    Keys whose task raises are retried in up to FAN_OUT_RETRIES further rounds.
+    `on_success(key, result)` and `on_error(key, exception)` run on the calling
+    thread as each task finishes. Returns (keys that still failed, in `keys`
+    order; number of retried tasks).
+    """
+    pending = list(keys)
+    retries = 0
+    task = in_trace_context(task)
+    for attempt in range(FAN_OUT_RETRIES + 1):
+        if not pending:
+            break
+        if attempt:
+            retries += len(pending)
+        failed = []
+        with ThreadPoolExecutor(max_workers=min(fan_out_concurrency(), len(pending))) as executor:
+            # A cached response may be the unusable one being retried
+            futures = {executor.submit(task, key, attempt, use_cache and not attempt): key for key in pending}
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Cancelled tasks are not failures to retry; the other workers stop on their own
+                    check_cancelled(cancel)
+                    on_error(key, e)
+                    failed.append(key)
+                    continue
+                on_success(key, result)
+        pending = [key for key in keys if key in failed]
+    return pending, retries
+
+def synthesize_recommendation(client, comparison_text, risk_analysis, call_stats, use_cache=True, cancel=None):
+    """Ask Claude for the overall advantages and recommendation from the merged per-area analysis.
+
+    Only the merged analysis and scores are sent, not the contracts, so this call is short.
+    Returns a dict of the fields to update, or {} if the synthesis fails.
+    """
+    scores = "\n".join(
+        f"- {dimension}: Contract 1 {score}/100, Contract 2 {risk_analysis['contract2_dimension_scores'].get(dimension, 100 - score)}/100"
+        for dimension, score in risk_analysis["contract1_dimension_scores"].items()
+    )
+    prompt = f"""
+Below is a per-focus-area comparison of two contracts and the score for each area.
+
+{comparison_text}
+
+SCORES:
+{scores}
+
+Overall: Contract 1 {risk_analysis['contract1_overall_score']}/100, Contract 2 {risk_analysis['contract2_overall_score']}/100
+
+Summarise the comparison as JSON enclosed in triple backticks with "json" language specifier:
+```json
+{{
+  "contract1_advantages": ["Specific advantage 1", "Specific advantage 2", "Specific advantage 3"],
+  "contract1_disadvantages": ["Specific disadvantage 1", "Specific disadvantage 2", "Specific disadvantage 3"],
+  "contract2_advantages": ["Specific advantage 1", "Specific advantage 2", "Specific advantage 3"],
+  "contract2_disadvantages": ["Specific disadvantage 1", "Specific disadvantage 2", "Specific disadvantage 3"],
+  "recommendation": "Clear, actionable recommendation based on analysis"
+}}
+```
+"""
+    try:
+        response = robust_claude_api_call(client, prompt, COMPARISON_SYSTEM_BLOCKS, call_stats=call_stats,
+                                          max_tokens=SYNTHESIS_MAX_TOKENS, use_cache=use_cache, cancel=cancel)
+        json_match = re.search(r'```json\s*(.*?)\s*```', response.content[0].text, re.DOTALL)
+        if not json_match:
+            return {}
+        synthesis = json.loads(json_match.group(1))
+        return {key: value for key, value in synthesis.items()
+                if key in ("contract1_advantages", "contract1_disadvantages", "contract2_advantages",
+                           "contract2_disadvantages", "recommendation") and value}
+    except Exception as e:
+        check_cancelled(cancel)
+        print(f"Error synthesising recommendation: {str(e)}")
+        return {}
+
+def merge_dimension_results(scoring_dimensions, sections, results, custom_weights):
+    """Merge per-dimension sections and scores into the same shape as a single-call analysis"""
+    risk_analysis = build_default_risk_analysis(scoring_dimensions)
+
+    for dimension, result in results.items():
+        risk_analysis["contract1_dimension_scores"][dimension] = result["contract1_score"]
+        risk_analysis["contract2_dimension_scores"][dimension] = result["contract2_score"]
+
+    # Overall scores are the (custom) weighted mean of the dimension scores
+    apply_custom_weights(risk_analysis, scoring_dimensions,
+                         custom_weights if custom_weights and isinstance(custom_weights, dict) else {})
+
+    # Local fallback for the summary fields: the first point Claude made for each area
+    for key in ("contract1_advantages", "contract1_disadvantages", "contract2_advantages", "contract2_disadvantages"):
+        points = [result[key][0] for result in results.values() if result[key]]
+        if points:
+            risk_analysis[key] = points[:5]
+    if results:
+        c1_score = risk_analysis["contract1_overall_score"]
+        c2_score = risk_analysis["contract2_overall_score"]
+        if c1_score != c2_score:
+            better, better_score, other_score = ("Contract 1", c1_score, c2_score) if c1_score > c2_score else ("Contract 2", c2_score, c1_score)
+            risk_analysis["recommendation"] = (f"{better} scores higher overall ({better_score}/100 vs {other_score}/100). "
+                                               "Review the per-area analysis before deciding.")
+
+    comparison_text = "\n\n".join(sections[dimension] for dimension in scoring_dimensions if dimension in sections)
+    return comparison_text, risk_analysis
+
+def sum_call_stats(call_stats, request_stats):
+    """Add up the figures of concurrent requests into `call_stats`.
+
+    `call_stats["api_time"]` must already hold the wall-clock time of the whole
+    batch; output speed is measured against it.
+    """
+    request_stats = list(request_stats)
+    call_stats["api_requests"] = sum(stats.get("api_requests", 0) for stats in request_stats)
+    call_stats["response_cache_hits"] = sum(stats.get("response_cache_hits", 0) for stats in request_stats)
+    for name in PROMPT_USAGE_FIELDS + ("queue_time", "api_retries", "prompt_build_time", "parse_time"):
+        call_stats[name] = sum(stats.get(name, 0) for stats in request_stats)
+    call_stats["model"] = next((stats["model"] for stats in request_stats if "model" in stats), None)
+    output_tokens = sum(stats.get("output_tokens", 0) for stats in request_stats
+                        if not stats.get("response_cache_hits"))
+    if output_tokens and call_stats["api_time"] > 0:
+        call_stats["output_tokens_per_second"] = output_tokens / call_stats["api_time"]
+
+def compare_contracts_fan_out(client, contract_blocks, scoring_dimensions, custom_prompt, custom_weights=None,
+                              on_text=None, call_stats=None, use_cache=True, cancel=None):
+    """Analyse each focus area in its own concurrent call, then merge the results.
+
+    Dimensions that fail are retried (FAN_OUT_RETRIES extra rounds) and fall back to
+    default scores after that. Sections are passed to `on_text` in the order they
+    finish; the returned analysis text is in focus area order. A short synthesis call
+    then writes the overall advantages and recommendation.
+    """
+    if call_stats is None:
+        call_stats = {}
+    start_time = time.time()
+    sections = {}
+    results = {}
+    dimension_stats = {}
+    streamed_text = ""
+
+    def analyse(dimension, attempt, round_use_cache):
+        dimension_stats[dimension] = {}
+        return compare_dimension_with_claude(client, contract_blocks, dimension, custom_prompt,
+                                             dimension_stats[dimension], round_use_cache, cancel)
+
+    def on_success(dimension, result):
+        nonlocal streamed_text
+        sections[dimension], results[dimension] = result
+        call_stats.setdefault("time_to_first_token", time.time() - start_time)
+        # Callbacks run here on the calling thread, never in the workers
+        if on_text is not None:
+            streamed_text += sections[dimension] + "\n\n"
+            on_text(streamed_text)
+
+    def on_error(dimension, e):
+        print(f"Error analysing {dimension}: {str(e)}")
+
+    pending, retries = run_retry_rounds(scoring_dimensions, analyse, on_success, on_error, use_cache, cancel)
+
+    for dimension in pending:
+        sections[dimension] = f"### {dimension}\n*This area could not be analysed. Default scores are shown.*"
+    call_stats["parse_warnings"] = [f"{dimension} could not be analysed. Using default values." for dimension in pending]
+
+    merge_start = time.time()
+    with trace_span("merge_dimension_results", dimensions=len(scoring_dimensions), failed=len(pending)):
+        comparison_text, risk_analysis = merge_dimension_results(scoring_dimensions, sections, results, custom_weights)
+    merge_time = time.time() - merge_start
+    if results:
+        synthesis_stats = {}
+        risk_analysis.update(synthesize_recommendation(client, comparison_text, risk_analysis, synthesis_stats, use_cache,
+                                                       cancel))
+        dimension_stats["synthesis"] = synthesis_stats
+
+    call_stats["api_time"] = time.time() - start_time
+    call_stats["streamed"] = on_text is not None
+    call_stats["fan_out"] = {
+        "dimensions": len(scoring_dimensions),
+        "concurrency": fan_out_concurrency(),
+        "retries": retries,
+        "failed": pending,
+        "call_times": {name: stats.get("api_time") for name, stats in dimension_stats.items()},
+    }
+    sum_call_stats(call_stats, dimension_stats.values())
+    call_stats["parse_time"] += merge_time
+    return comparison_text, risk_analysis
+
+def compare_contracts_with_claude(contract1_text, contract2_text, analysis_focus, custom_prompt, custom_weights=None,
+                                  optimized_contracts=None, on_text=None, call_stats=None, fan_out=False,
+                                  use_cache=True, raise_errors=False, cancel=None, combined=None):
+    """Use Claude AI to compare contracts and generate insights with risk assessment.
+
+    `optimized_contracts` is an optional pair of optimize_contract results, so callers
+    that already optimised the contracts (e.g. for metrics) do not repeat the work.
+    `on_text` streams the response (see robust_claude_api_call) and `call_stats`
+    collects the API timing figures. With `fan_out` each focus area is analysed in
+    its own concurrent call (see compare_contracts_fan_out). `use_cache=False`
+    skips the response cache lookup so Claude is always asked again. API errors are
+    shown in the app and answered with a default analysis, unless `raise_errors` is
+    set (headless runs record them instead). Warnings about default scores used
+    in place of unparseable results are left in call_stats["parse_warnings"]. `cancel` (see new_cancel_token) lets a
+    background analysis abort its requests. `combined` is an align_contracts or
+    template_diff result whose text is sent in place of the two optimised contracts.
+    """
+
+    client = get_anthropic_client()["client"]
+
+    # Optimize contracts to focus on relevant sections (API call optimization)
+    if combined is not None:
+        contract_blocks = build_combined_contract_blocks(combined)
+    else:
+        if optimized_contracts is None:
+            optimized_contracts = (optimize_contract(contract1_text, analysis_focus),
+                                   optimize_contract(contract2_text, analysis_focus))
+        contract_blocks = build_contract_blocks(optimized_contracts[0]["text"], optimized_contracts[1]["text"])
+
+    scoring_dimensions = get_scoring_dimensions(analysis_focus)
+    if call_stats is None:
+        call_stats = {}
+
+    try:
+        if fan_out:
+            return compare_contracts_fan_out(client, contract_blocks, scoring_dimensions, custom_prompt, custom_weights,
+                                             on_text, call_stats, use_cache, cancel)
+
+        build_start = time.time()
+        prompt = build_comparison_prompt(contract_blocks, scoring_dimensions, custom_prompt,
+                                         build_weights_instruction(custom_weights))
+        call_stats["prompt_build_time"] = time.time() - build_start
+
+        # Use robust API call with retries
+        response = robust_claude_api_call(client, prompt, COMPARISON_SYSTEM_BLOCKS, on_text, call_stats,
+                                          use_cache=use_cache, cancel=cancel)
+
+        # Keep the local token estimator in line with what the API actually counted
+        calibrate_token_estimator(blocks_text(COMPARISON_SYSTEM_BLOCKS) + blocks_text(prompt), total_input_tokens(response.usage))
+
+        # Extract the main comparison text and the JSON risk assessment
+        parse_start = time.time()
+        with trace_span("parse_comparison_response", response_size=len(response.content[0].text)):
+            comparison_text, risk_analysis, parse_info = parse_comparison_response(response.content[0].text,
+                                                                                   scoring_dimensions, custom_weights)
+        call_stats["parse_time"] = time.time() - parse_start
+        call_stats["parse_warnings"] = parse_info["warnings"]
+        call_stats["debug_json"] = parse_info["debug_json"]
+        return comparison_text, risk_analysis
+    except Exception as e:
+        if raise_errors:
+            raise
+        st.error(f"Error calling Claude API: {str(e)}")
+        # Return a basic response and default risk analysis
+        return "Error analyzing contracts. Please try again with different parameters or contact support.", build_default_risk_analysis(scoring_dimensions)
+
+
+# Tender mode: each response is assessed once on an absolute scale and ranked locally,
+# so N responses cost N requests instead of one per pair
+TENDER_ASSESSMENT_MAX_TOKENS = 2000
+TENDER_MIN_CONTRACTS = 2
+
+def build_tender_assessment_prompt(optimized_contract, scoring_dimensions, custom_prompt):
+    """Build the prompt assessing one tender response on its own.
+
+    The contract is a cacheable block, so re-running a tender with different
+    weights or instructions only pays for the instructions.
+    """
+    dimension_scores = ",\n    ".join(f'"{dimension}": 60' for dimension in scoring_dimensions)
+    dimension_notes = ",\n    ".join(f'"{dimension}": "One sentence citing the key clause"' for dimension in scoring_dimensions)
+    return [cached_text_block(f"CONTRACT:\n{optimized_contract}"), cached_text_block(f"""
+As an expert ERP contract analyst, assess the tender response above on its own merits.
+
+{custom_prompt if custom_prompt else ''}
+
+SCORING REQUIREMENTS:
+Score each focus area from 0 to 100 against typical market terms for ERP service contracts, where
+50 is market standard, above 50 is more favourable to the customer and below 50 is less favourable.
+Use the same scale for every response so the scores can be compared across vendors.
+
+FOCUS AREAS TO ASSESS: {', '.join(scoring_dimensions)}
+{dimension_guidance_instructions(scoring_dimensions)}
+
+JSON OUTPUT:
+Reply with only this JSON enclosed in triple backticks with "json" language specifier:
+```json
+{{
+  "dimension_scores": {{
+    {dimension_scores}
+  }},
+  "dimension_notes": {{
+    {dimension_notes}
+  }},
+  "strengths": ["Specific strength 1", "Specific strength 2", "Specific strength 3"],
+  "weaknesses": ["Specific weakness 1", "Specific weakness 2", "Specific weakness 3"],
+  "summary": "Two-sentence overall assessment"
+}}
+```
+""", cache=False)]
+
+def parse_tender_assessment(full_response, scoring_dimensions):
+    """Extract the scores and findings from a tender assessment response.
+
+    Scores are matched to the focus areas by normalised name and clamped to 0-100;
+    areas Claude did not score are left out. Raises ValueError if the JSON block is
+    missing or scores none of the focus areas, so the response is retried.
+    """
+    json_match = re.search(r'```json\s*(.*?)\s*```', full_response, re.DOTALL)
+    if not json_match:
+        raise ValueError("No JSON found in the assessment")
+
+    result = json.loads(json_match.group(1))
+    returned_scores = {normalize_dimension_name(name): score for name, score in (result.get("dimension_scores") or {}).items()}
+    returned_notes = {normalize_dimension_name(name): note for name, note in (result.get("dimension_notes") or {}).items()}
+
+    assessment = {"dimension_scores": {}, "dimension_notes": {}}
+    for dimension in scoring_dimensions:
+        key = normalize_dimension_name(dimension)
+        if isinstance(returned_scores.get(key), (int, float)):
+            assessment["dimension_scores"][dimension] = max(0, min(100, int(returned_scores[key])))
+        if returned_notes.get(key):
+            assessment["dimension_notes"][dimension] = str(returned_notes[key])
+    if not assessment["dimension_scores"]:
+        raise ValueError("The assessment scored none of the focus areas")
+
+    for key in ("strengths", "weaknesses"):
+        assessment[key] = [str(point) for point in result.get(key) or [] if point]
+    assessment["summary"] = str(result.get("summary") or "")
+    return assessment
+
+def assess_tender_contract(client, job, name, analysis_focus, scoring_dimensions, custom_prompt, token_budget,
+                           call_stats, use_cache=True, cancel=None):
+    """Extract, optimise and assess one tender response; runs on a worker thread.
+
+    Extraction joins the background job started at upload. Returns (assessment,
+    document figures for the metrics).
+    """
+    contract_text, document_stats = extraction_job_result(job, job["name"])
+    check_cancelled(cancel)
+    optimize_start = time.time()
+    optimized = optimize_contract(contract_text, analysis_focus, token_budget)
+    document = {
+        "stats": document_stats,
+        "optimize_time": time.time() - optimize_start,
+        "original_size": len(contract_text),
+        "optimized_size": optimized["optimized_size"],
+        "estimated_tokens": optimized["estimated_tokens"],
+        "coverage": optimized["coverage"],
+    }
+
+    build_start = time.time()
+    prompt = build_tender_assessment_prompt(optimized["text"], scoring_dimensions, custom_prompt)
+    call_stats["prompt_build_time"] = time.time() - build_start
+    response = robust_claude_api_call(client, prompt, COMPARISON_SYSTEM_BLOCKS, call_stats=call_stats,
+                                      max_tokens=TENDER_ASSESSMENT_MAX_TOKENS, use_cache=use_cache, cancel=cancel)
+    calibrate_token_estimator(blocks_text(COMPARISON_SYSTEM_BLOCKS) + blocks_text(prompt), total_input_tokens(response.usage))
+    parse_start = time.time()
+    try:
+        assessment = parse_tender_assessment(response.content[0].text, scoring_dimensions)
+    finally:
+        call_stats["parse_time"] = time.time() - parse_start
+    assessment["name"] = name
+    return assessment, document
+
+def rank_tender_assessments(assessments, scoring_dimensions, custom_weights):
+    """Weighted overall score and rank for each assessment, best first.
+
+    Weights follow apply_custom_weights; an area a response was not scored on is
+    left out of its mean. Failed assessments have no score and are ranked last.
+    """
+    weights = complete_weights(scoring_dimensions, custom_weights if isinstance(custom_weights, dict) else {})
+    ranked = []
+    for assessment in assessments:
+        scores = assessment.get("dimension_scores", {})
+        total_weight = sum(weights.get(dimension, 0) for dimension in scores)
+        overall = None
+        if total_weight > 0:
+            overall = int(sum(score * weights.get(dimension, 0) for dimension, score in scores.items()) / total_weight)
+        ranked.append(dict(assessment, overall_score=overall))
+
+    ranked.sort(key=lambda assessment: (assessment["overall_score"] is None, -(assessment["overall_score"] or 0)))
+    for rank, assessment in enumerate(ranked, 1):
+        assessment["rank"] = rank
+    return ranked
+
+def assess_tender(jobs, names, analysis_focus, custom_prompt, custom_weights=None, token_budget=None, call_stats=None,
+                  on_result=None, use_cache=True, cancel=None, raise_errors=False):
+    """Assess every tender response concurrently and rank them locally.
+
+    `jobs` are background extraction jobs (see start_extraction_job) and `names`
+    their display names. Each worker joins its extraction, optimises the text and
+    makes one assessment request, with at most FAN_OUT_CONCURRENCY in flight.
+    Responses that fail are retried (FAN_OUT_RETRIES extra rounds) and then ranked
+    last without scores, or raise with `raise_errors`. `on_result(done, total)` is called on the calling thread
+    as each one finishes. `cancel` (see new_cancel_token) aborts the remaining
+    requests. Returns (ranked assessments, per-document figures).
+    """
+    if call_stats is None:
+        call_stats = {}
+    client = get_anthropic_client()["client"]
+    scoring_dimensions = get_scoring_dimensions(analysis_focus)
+    start_time = time.time()
+    assessments = {}
+    documents = {}
+    errors = {}
+    request_stats = {}
+
+    def assess(index, attempt, round_use_cache):
+        request_stats[(index, attempt)] = {}
+        return assess_tender_contract(client, jobs[index], names[index], analysis_focus, scoring_dimensions,
+                                      custom_prompt, token_budget, request_stats[(index, attempt)], round_use_cache,
+                                      cancel)
+
+    def on_success(index, result):
+        assessments[index], documents[index] = result
+        errors.pop(index, None)
+        call_stats.setdefault("time_to_first_token", time.time() - start_time)
+        if on_result is not None:
+            on_result(len(assessments), len(jobs))
+
+    def on_error(index, e):
+        print(f"Error assessing {names[index]}: {str(e)}")
+        errors[index] = str(e)
+
+    pending, retries = run_retry_rounds(range(len(jobs)), assess, on_success, on_error, use_cache, cancel)
+
+    if pending and raise_errors:
+        raise Exception("Could not assess " + "; ".join(f"{names[index]}: {errors[index]}" for index in pending))
+    for index in pending:
+        assessments[index] = {"name": names[index], "dimension_scores": {}, "dimension_notes": {},
+                              "strengths": [], "weaknesses": [], "summary": "", "error": errors[index]}
+
+    parse_start = time.time()
+    ranking = rank_tender_assessments([assessments[index] for index in range(len(jobs))], scoring_dimensions,
+                                      custom_weights)
+    rank_time = time.time() - parse_start
+
+    call_stats["api_time"] = time.time() - start_time
+    call_stats["tender"] = {
+        "contracts": len(jobs),
+        "concurrency": fan_out_concurrency(),
+        "retries": retries,
+        "failed": [names[index] for index in pending],
+        "call_times": {names[index]: stats.get("api_time") for (index, _), stats in request_stats.items()},
+    }
+    sum_call_stats(call_stats, request_stats.values())
+    call_stats["parse_time"] += rank_time
+    return ranking, [documents[index] for index in sorted(documents)]
+
+def tender_ranking_table(ranking, scoring_dimensions):
+    """Ranked table of tender responses with their overall and per-area scores"""
+    rows = []
+    for assessment in ranking:
+        row = {"Rank": assessment["rank"], "Contract": assessment["name"], "Overall": assessment["overall_score"]}
+        for dimension in scoring_dimensions:
+            row[dimension] = assessment["dimension_scores"].get(dimension)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+def tender_dimension_matrix(ranking, scoring_dimensions):
+    """Focus area by contract score matrix, with the best response for each area"""
+    rows = []
+    for dimension in scoring_dimensions:
+        row = {"Focus Area": dimension}
+        scores = {assessment["name"]: assessment["dimension_scores"].get(dimension) for assessment in ranking}
+        row.update(scores)
+        scored = {name: score for name, score in scores.items() if score is not None}
+        row["Best"] = max(scored, key=scored.get) if scored else None
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+def tender_report_markdown(tender):
+    """Markdown report of a tender assessment for download"""
+    scoring_dimensions = get_scoring_dimensions(tender["focus_areas"])
+    lines = [f"# Tender Comparison: {len(tender['ranking'])} Responses", "",
+             f"Analysis Date: {tender['timestamp']}", "",
+             f"Focus Areas: {', '.join(scoring_dimensions)}", "", "## Ranking", ""]
+    for assessment in tender["ranking"]:
+        overall = f"{assessment['overall_score']}/100" if assessment["overall_score"] is not None else "not assessed"
+        lines.append(f"{assessment['rank']}. **{assessment['name']}** - {overall}")
+    for assessment in tender["ranking"]:
+        lines += ["", f"## {assessment['rank']}. {assessment['name']}", ""]
+        if assessment.get("summary"):
+            lines += [assessment["summary"], ""]
+        for dimension in scoring_dimensions:
+            if dimension in assessment["dimension_scores"]:
+                note = assessment["dimension_notes"].get(dimension, "")
+                lines.append(f"- **{dimension}:** {assessment['dimension_scores'][dimension]}/100 {note}".rstrip())
+        for key, label in (("strengths", "Strengths"), ("weaknesses", "Weaknesses")):
+            if assessment.get(key):
+                lines += ["", f"**{label}:**"] + [f"- {point}" for point in assessment[key]]
+    return "\n".join(lines) + "\n"
+
+
+# Display names of the timed pipeline stages
+STAGE_LABELS = {
+    "extract": "Extract",
+    "optimize": "Optimise",
+    "diff": "Template diff",
+    "align": "Align clauses",
+    "prompt_build": "Prompt build",
+    "api_queue": "API queue",
+    "api_first_token": "API first token",
+    "api_total": "API total",
+    "parse": "JSON parse",
+    "render": "Render",
+}
+
+def create_performance_metrics(metrics=None):
+    """Display performance metrics for the current analysis (or the given `metrics`) if available"""
+    
+    if metrics is None:
+        if 'performance_metrics' not in st.session_state:
+            return
+        metrics = st.session_state.performance_metrics
+    
+    st.subheader("Performance Metrics")
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        st.metric(
+            "Processing Time", 
+            f"{metrics.get('total_time', 0):.2f}s",
+            help="Total time to process and analyze contracts"
+        )
+    
+    with col2:
+        original_size = metrics.get('original_size', 0)
+        optimized_size = metrics.get('optimized_size', 0)
+        
+        if original_size > 0:
+            reduction = ((original_size - optimized_size) / original_size) * 100
+            st.metric(
+                "Token Reduction", 
+                f"{reduction:.1f}%",
+                help="Percentage reduction in text size after optimization"
+            )
+        else:
+            st.metric("Token Reduction", "N/A")
+    
+    with col3:
+        usage = metrics.get('usage', {})
+        st.metric(
+            "API Cost", 
+            f"${metrics.get('cost', {}).get('total', 0):.4f}",
+            help=f"{usage.get('input_tokens', 0) + usage.get('cache_creation_input_tokens', 0) + usage.get('cache_read_input_tokens', 0):,} input "
+                 f"and {usage.get('output_tokens', 0):,} output tokens on {metrics.get('model') or 'unknown model'}, "
+                 "priced from the API's reported usage"
+        )
+    
+    # Where the time went, in pipeline order
+    stage_times = metrics.get('stage_times')
+    if stage_times:
+        st.caption(" · ".join(f"{STAGE_LABELS[stage]}: {seconds:.2f}s"
+                              for stage, seconds in stage_times.items()
+                              if stage in STAGE_LABELS and seconds is not None))
+
+def create_cache_metrics():
+    """Display hit/miss counters for the persistent caches"""
+    
+    st.markdown("### Cache Statistics")
+    
+    stats = get_cache_stats()
+    with stats["lock"]:
+        counters = {name: dict(values) for name, values in stats["counters"].items()}
+    
+    caches = [
+        ("Document Extraction Store", "extraction", extraction_cache_dir(), "Stored Documents"),
+        ("Analysis Response Cache", "responses", response_cache_dir(), "Stored Responses"),
+    ]
+    for title, cache_name, cache_dir, entries_label in caches:
+        cache_counters = counters.get(cache_name, {})
+        hits = cache_counters.get("hits", 0)
+        misses = cache_counters.get("misses", 0)
+        lookups = hits + misses
+        entries, size_bytes = disk_cache_usage(cache_dir)
+        
+        st.markdown(f"**{title}**")
+        cache_cols = st.columns(4)
+        with cache_cols[0]:
+            st.metric("Hits", f"{hits:,}")
+        with cache_cols[1]:
+            st.metric("Misses", f"{misses:,}")
+        with cache_cols[2]:
+            st.metric("Hit Rate", f"{(hits / lookups) * 100:.1f}%" if lookups else "N/A")
+        with cache_cols[3]:
+            st.metric(entries_label, f"{entries:,}", help=f"{size_bytes / (1024 * 1024):.1f} MB on disk")
+    
+    st.caption("Counters cover this server process since it started; the stores themselves are shared by every process using the same cache directories.")
+    
+    if is_admin() and st.button("Delete Stored Documents and Responses",
+                                help="Remove all extracted contract text and cached analyses from the disk stores and this server's memory"):
+        removed = delete_stored_content()
+        st.success(f"Deleted {removed:,} stored entries")
+
+def create_connection_metrics():
+    """Display connection reuse and rate limiter state of the shared API client"""
+    
+    resource = get_anthropic_client()
+    with resource["lock"]:
+        stats = dict(resource["stats"])
+    
+    requests_sent = stats["requests"]
+    reused = max(requests_sent - stats["connections_opened"], 0)
+    
+    st.markdown("### API Connections")
+    connection_cols = st.columns(3)
+    with connection_cols[0]:
+        st.metric("Requests Sent", f"{requests_sent:,}")
+    with connection_cols[1]:
+        st.metric("Connections Opened", f"{stats['connections_opened']:,}",
+                  help="New TCP/TLS connections; every other request reused a pooled keep-alive connection")
+    with connection_cols[2]:
+        st.metric("Connection Reuse", f"{(reused / requests_sent) * 100:.1f}%" if requests_sent else "N/A")
+    
+    limiter = get_rate_limiter()
+    with limiter["lock"]:
+        now = time.time()
+        for bucket in limiter["buckets"].values():
+            refill_bucket(bucket, now)
+        bucket_rows = [{"Limit": name.replace("_", " ").title() + " / min",
+                        "Configured": f"{bucket['limit']:,.0f}",
+                        "Available": f"{max(bucket['available'], 0):,.0f}"}
+                       for name, bucket in limiter["buckets"].items()]
+        limiter_stats = dict(limiter["stats"])
+        paused_for = max(limiter["blocked_until"] - now, 0)
+    
+    st.markdown("**Shared Rate Limiter**")
+    st.dataframe(pd.DataFrame(bucket_rows), hide_index=True, use_container_width=True)
+    st.markdown(f"{limiter_stats['waits']:,} requests waited {limiter_stats['wait_time']:.1f}s in total; "
+                f"{limiter_stats['throttled']:,} rate limit responses"
+                + (f"; paused for another {paused_for:.1f}s" if paused_for else ""))
+    st.caption("One pooled client and rate limiter are shared by every session on this server process.")
+
+# Persistent analysis history: one SQLite database (WAL mode) shared by every session.
+# Sessions only keep summaries; full results are loaded when an analysis is opened.
+HISTORY_PREVIEW_CHARS = 500
+
+def history_db_path():
+    """SQLite file holding every user's analyses."""
+    default_path = os.path.join(os.path.expanduser("~"), ".cache", "contract_app", "history.sqlite3")
+    return get_config("HISTORY_DB_PATH", default_path)
+
+@st.cache_resource
+def get_history_db():
+    """Connection to the history database, shared by every session and serialised by its lock."""
+    path = history_db_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    connection = sqlite3.connect(path, check_same_thread=False)
+    # WAL lets other processes (replicas, batch runs) read while one writes
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS analyses (
+            id INTEGER PRIMARY KEY,
+            user TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            contract1_name TEXT,
+            contract2_name TEXT,
+            summary TEXT NOT NULL,
+            entry BLOB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS analyses_user_timestamp ON analyses (user, timestamp);
+        CREATE INDEX IF NOT EXISTS analyses_user_contract1 ON analyses (user, contract1_name);
+        CREATE INDEX IF NOT EXISTS analyses_user_contract2 ON analyses (user, contract2_name);
+        CREATE TABLE IF NOT EXISTS analysis_focus_areas (
+            analysis_id INTEGER NOT NULL REFERENCES analyses (id),
+            focus_area TEXT NOT NULL,
+            PRIMARY KEY (analysis_id, focus_area)
+        );
+        CREATE INDEX IF NOT EXISTS analysis_focus_areas_area ON analysis_focus_areas (focus_area, analysis_id);
+    """)
+    return {"lock": threading.Lock(), "connection": connection}
+
+def history_user():
+    """Owner of the analyses saved from this session."""
+    return st.session_state.get("authenticated_user") or ""
+
+def history_summary(entry):
+    """The few fields the History tab shows for an analysis, without its full result."""
+    summary = {
+        "mode": entry.get("mode", "comparison"),
+        "timestamp": entry["timestamp"],
+        "focus_areas": entry["focus_areas"] or [],
+    }
+    if summary["mode"] == "tender":
+        summary["contract_names"] = list(entry["contract_names"])
+        summary["ranking"] = [{"rank": assessment["rank"], "name": assessment["name"],
+                               "overall_score": assessment["overall_score"]} for assessment in entry["ranking"]]
+    else:
+        risk_analysis = entry.get("risk_analysis") or {}
+        summary.update(
+            contract1_name=entry["contract1_name"],
+            contract2_name=entry["contract2_name"],
+            contract1_score=risk_analysis.get("contract1_overall_score"),
+            contract2_score=risk_analysis.get("contract2_overall_score"),
+            preview=entry["result"][:HISTORY_PREVIEW_CHARS],
+            truncated=len(entry["result"]) > HISTORY_PREVIEW_CHARS,
+        )
+    return summary
+
+def save_history_entry(user, entry):
+    """Store a finished analysis for `user` and return its summary (with the row `id`).
+    
+    If the database cannot be written the summary carries the full entry instead,
+    so the analysis still shows up for the rest of the session.
+    """
+    summary = history_summary(entry)
+    try:
+        data = zlib.compress(json.dumps(entry, default=str).encode("utf-8"), 1)
+        db = get_history_db()
+        with db["lock"], db["connection"] as connection:
+            cursor = connection.execute(
+                "INSERT INTO analyses (user, mode, timestamp, contract1_name, contract2_name, summary, entry) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user, summary["mode"], summary["timestamp"], summary.get("contract1_name"),
+                 summary.get("contract2_name"), json.dumps(summary), data))
+            summary["id"] = cursor.lastrowid
+            connection.executemany("INSERT OR IGNORE INTO analysis_focus_areas (analysis_id, focus_area) VALUES (?, ?)",
+                                   [(summary["id"], area) for area in summary["focus_areas"]])
+    except (sqlite3.Error, OSError, TypeError, ValueError) as e:
+        print(f"Error saving analysis history: {str(e)}")
+        summary["id"] = None
+        summary["entry"] = entry
+    return summary
+
+def list_history(user):
+    """Summaries of a user's saved analyses, oldest first."""
+    try:
+        db = get_history_db()
+        with db["lock"]:
+            rows = db["connection"].execute(
+                "SELECT id, summary FROM analyses WHERE user = ? ORDER BY timestamp, id", (user,)).fetchall()
+    except (sqlite3.Error, OSError) as e:
+        print(f"Error reading analysis history: {str(e)}")
+        return []
+    return [dict(json.loads(summary), id=analysis_id) for analysis_id, summary in rows]
+
+def load_history_entry(user, summary):
+    """The full analysis behind a history summary, or None if it is no longer stored."""
+    if summary.get("id") is None:
+        return summary.get("entry")
+    try:
+        db = get_history_db()
+        with db["lock"]:
+            row = db["connection"].execute("SELECT entry FROM analyses WHERE id = ? AND user = ?",
+                                           (summary["id"], user)).fetchone()
+        return json.loads(zlib.decompress(row[0]).decode("utf-8")) if row else None
+    except (sqlite3.Error, OSError, zlib.error, UnicodeDecodeError, ValueError) as e:
+        print(f"Error loading analysis {summary['id']}: {str(e)}")
+        return None
+
+def open_history_entry(summary, state_key, tab):
+    """Load a past analysis in full into `state_key` and switch to `tab`."""
+    entry = load_history_entry(history_user(), summary)
+    if entry is None:
+        st.error("This analysis is no longer available.")
+        return
+    st.session_state[state_key] = entry
+    st.query_params["tab"] = tab
+    st.rerun()
+
+HISTORY_PAGE_SIZE = 20
+
+def history_table(history):
+    """One compact row per analysis, newest first; the index is the position in `history`."""
+    rows = []
+    for summary in history:
+        focus_areas = ", ".join(summary['focus_areas']) if summary['focus_areas'] else "Custom analysis"
+        if summary.get('mode') == 'tender':
+            contracts = ", ".join(summary['contract_names'])
+            leader = summary['ranking'][0] if summary['ranking'] else None
+            result = (f"{leader['name']} first ({leader['overall_score']}/100)"
+                      if leader and leader['overall_score'] is not None else "")
+            analysis_type = f"Tender ({len(summary['contract_names'])})"
+        else:
+            contracts = f"{summary['contract1_name']} vs {summary['contract2_name']}"
+            scores = [score if score is not None else 'N/A' for score in (summary['contract1_score'], summary['contract2_score'])]
+            result = f"{scores[0]} / {scores[1]}"
+            analysis_type = "Comparison"
+        rows.append({"Date": summary['timestamp'], "Type": analysis_type, "Contracts": contracts,
+                     "Focus Areas": focus_areas, "Result": result,
+                     "search": " ".join((summary['timestamp'], contracts, focus_areas)).lower()})
+    table = pd.DataFrame(rows, columns=["Date", "Type", "Contracts", "Focus Areas", "Result", "search"])
+    return table.iloc[::-1]
+
+def render_history_entry(index, summary):
+    """Details and actions for the history row the user selected."""
+    if summary.get('mode') == 'tender':
+        st.markdown(f"**Tender: {len(summary['contract_names'])} responses - {summary['timestamp']}**")
+        st.markdown("  \n".join(
+            f"{assessment['rank']}. {assessment['name']}: "
+            f"{assessment['overall_score'] if assessment['overall_score'] is not None else 'N/A'}/100"
+            for assessment in summary['ranking']))
+        if st.button("View Tender Ranking", key=f"tender_{index}"):
+            open_history_entry(summary, "current_tender", "tender")
+        return
+    
+    st.markdown(f"**{summary['contract1_name']} vs {summary['contract2_name']} - {summary['timestamp']}**")
+    # Show a preview of the analysis
+    st.markdown(summary['preview'] + "..." if summary['truncated'] else summary['preview'])
+    
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        if st.button("View Full Comparison", key=f"view_{index}"):
+            open_history_entry(summary, "current_analysis", "results")
+    with col2:
+        if st.button("View Key Findings", key=f"findings_{index}"):
+            open_history_entry(summary, "current_analysis", "key_findings")
+
+# Background analysis jobs
+# Finished jobs are kept this long (seconds) for their session to pick up the result
+ANALYSIS_JOB_RETENTION = 3600
+DEFAULT_ANALYSIS_WORKERS = 4
+# Running jobs that no session has polled for this long are cancelled (tab closed, session ended).
+# Generous because browsers throttle timers in background tabs to about once a minute.
+DEFAULT_ANALYSIS_HEARTBEAT_TIMEOUT = 120
+
+@st.cache_resource
+def get_analysis_jobs():
+    """Background analysis jobs, their thread pool and heartbeat watchdog, shared by every session and rerun."""
+    registry = {
+        "lock": threading.Lock(),
+        "jobs": {},
+        "executor": ThreadPoolExecutor(max_workers=int(get_config("ANALYSIS_WORKERS", DEFAULT_ANALYSIS_WORKERS)),
+                                       thread_name_prefix="analysis"),
+        "heartbeat_timeout": float(get_config("ANALYSIS_HEARTBEAT_TIMEOUT", DEFAULT_ANALYSIS_HEARTBEAT_TIMEOUT)),
+    }
+    threading.Thread(target=watch_analysis_jobs, args=(registry,), name="analysis-watchdog", daemon=True).start()
+    return registry
+
+def watch_analysis_jobs(registry):
+    """Cancel running jobs whose heartbeat has stopped and forget expired finished ones."""
+    while True:
+        time.sleep(5)
+        try:
+            now = time.time()
+            with registry["lock"]:
+                for job_id, job in list(registry["jobs"].items()):
+                    if job["finished_at"] and now - job["finished_at"] > ANALYSIS_JOB_RETENTION:
+                        del registry["jobs"][job_id]
+                stale = [job for job in registry["jobs"].values()
+                         if not job["finished_at"] and not job["cancel"]["event"].is_set()
+                         and now - job["heartbeat"] > registry["heartbeat_timeout"]]
+            for job in stale:
+                print(f"Cancelling analysis {job['id']}: no session has followed it for {now - job['heartbeat']:.0f}s")
+                cancel_analysis_job(job)
+        except Exception as e:
+            print(f"Error in the analysis watchdog: {str(e)}")
+
+def start_analysis_job(kind, run, params):
+    """Queue `run(job, params)` on the analysis pool and return the job id.
     
+    `run` returns the history entry for the analysis and reports progress with
+    update_analysis_job. `params` must be plain values gathered on the script
+    thread, since the job cannot read session state.
+    """
+    registry = get_analysis_jobs()
+    now = time.time()
+    job = {"id": uuid.uuid4().hex, "kind": kind, "owner": history_user(),
+           "status": "queued", "stage": "Waiting for a free worker...", "progress": 0.0, "text": "",
+           "result": None, "error": None, "warnings": [], "debug_json": None, "cancel": new_cancel_token(),
+           "created_at": now, "finished_at": None, "heartbeat": now}
+    with registry["lock"]:
+        registry["jobs"][job["id"]] = job
+        job["future"] = registry["executor"].submit(in_trace_context(run_analysis_job), job, run, params)
+    return job["id"]
+
+def run_analysis_job(job, run, params):
+    """Run a job on a pool thread, recording whether it finished, failed or was cancelled."""
+    job["status"] = "running"
     try:
-        # Use robust API call with retries
-        response = robust_claude_api_call(client, prompt, system_prompt)
+        check_cancelled(job["cancel"])
+        job["result"] = run(job, params)
+        # Saved here rather than on delivery, so a session that reloads mid-run still finds it in its history
+        job["summary"] = save_history_entry(job["owner"], job["result"])
+        job["status"] = "done"
+    except Exception as e:
+        if job["cancel"]["event"].is_set():
+            job["status"] = "cancelled"
+        else:
+            print(f"Error in analysis {job['id']}: {str(e)}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+    finally:
+        job["finished_at"] = time.time()
+
+def update_analysis_job(job, stage, progress):
+    """Publish a job's progress; also where a cancelled job stops between stages."""
+    check_cancelled(job["cancel"])
+    job["stage"] = stage
+    job["progress"] = max(job["progress"], min(progress, 1.0))
+
+def get_analysis_job(job_id):
+    return get_analysis_jobs()["jobs"].get(job_id)
+
+def cancel_analysis_job(job):
+    """Cancel a job: a queued job never starts, a running one has its requests aborted."""
+    cancel_requests(job["cancel"])
+    if job["future"].cancel():
+        job["status"] = "cancelled"
+        job["finished_at"] = time.time()
+
+def run_comparison_job(job, params):
+    """Background body of a two-contract comparison; returns its history entry."""
+    analysis_focus = params["analysis_focus"]
+    scoring_dimensions = get_scoring_dimensions(analysis_focus)
+    with profile_comparison(params["profile"], job), trace_span("comparison", focus_areas=len(analysis_focus or [])):
+        start_time = time.time()
+        contract_files = params["contract_files"]
         
-        # Extract the main comparison text and the JSON risk assessment
-        full_response = response.content[0].text
-        
-        # Find and extract the JSON part (assuming it's at the end)
-        json_match = re.search(r'```json\s*(.*?)\s*```', full_response, re.DOTALL)
-        
-        # Create default risk analysis with basic structure but varied scores
-        # Intentionally vary the default scores to avoid all 70s
-        default_risk_analysis = {
-            "contract1_overall_score": 55,
-            "contract2_overall_score": 45,
-            "contract1_dimension_scores": {},
-            "contract2_dimension_scores": {},
-            "categories": [],
-            "contract1_advantages": ["Good overall terms"],
-            "contract1_disadvantages": ["Could be improved in some areas"],
-            "contract2_advantages": ["Good overall terms"],
-            "contract2_disadvantages": ["Could be improved in some areas"],
-            "recommendation": "Both contracts have strengths and weaknesses. Further analysis recommended."
+        # Extract contract text (potentially in parallel)
+        update_analysis_job(job, "Extracting text...", 0.05)
+        if params["use_parallel"]:
+            contract1_text, contract2_text, document_stats = process_contracts_concurrently(
+                contract_files[0], contract_files[1], params["measure_memory"], params["pdf_workers"]
+            )
+        else:
+            contract1_text, contract1_stats = extract_text_with_stats(contract_files[0], params["measure_memory"], params["pdf_workers"])
+            contract2_text, contract2_stats = extract_text_with_stats(contract_files[1], params["measure_memory"], params["pdf_workers"])
+            document_stats = [contract1_stats, contract2_stats]
+        extract_time = time.time() - start_time
+        
+        # Track original text sizes for metrics
+        original_size = len(contract1_text) + len(contract2_text)
+        
+        # Optimise once; the result feeds both the API call and the metrics.
+        # Redlines of one template are sent as shared text plus differences, and aligned
+        # clause pairs otherwise replace the separately optimised contracts.
+        token_budget = params["token_budget"]
+        optimized_contracts = None
+        diffed = None
+        aligned = None
+        combined = None
+        optimize_time = None
+        if params["template_diff"]:
+            update_analysis_job(job, "Checking for a shared template...", 0.15)
+            diffed = template_diff(contract1_text, contract2_text, analysis_focus, token_budget)
+            if diffed["applied"]:
+                combined = diffed
+        if combined is None and params["align_clauses"]:
+            update_analysis_job(job, "Aligning clauses...", 0.15)
+            aligned = combined = align_contracts(contract1_text, contract2_text, analysis_focus, token_budget)
+        elif combined is None:
+            update_analysis_job(job, "Selecting the relevant contract sections...", 0.15)
+            optimize_start = time.time()
+            optimized_contracts = (optimize_contract(contract1_text, analysis_focus, token_budget),
+                                   optimize_contract(contract2_text, analysis_focus, token_budget))
+            optimize_time = time.time() - optimize_start
+        
+        # Publish sections as they are written; progress follows the sections completed
+        if params["stream_results"]:
+            def on_text(text):
+                job["text"] = text
+                # A section is complete once the next one (or the JSON) starts
+                visible, json_started, _ = text.partition("```json")
+                done = len(re.findall(r'^### ', visible, flags=re.MULTILINE)) - (not json_started)
+                update_analysis_job(job, "Claude is writing the comparison...",
+                                    0.3 + 0.65 * min(max(done, 0) / len(scoring_dimensions), 1.0))
+        else:
+            on_text = None
+        update_analysis_job(job, "Waiting for Claude...", 0.25)
+        
+        # Generate the enhanced comparison with risk assessment and custom scoring
+        call_stats = {}
+        analysis_result, risk_analysis = compare_contracts_with_claude(
+            contract1_text,
+            contract2_text,
+            analysis_focus,
+            params["custom_prompt"],
+            params["custom_weights"],
+            optimized_contracts=optimized_contracts,
+            on_text=on_text,
+            call_stats=call_stats,
+            fan_out=bool(analysis_focus) and params["fan_out"],
+            use_cache=params["use_cache"],
+            raise_errors=True,
+            cancel=job["cancel"],
+            combined=combined
+        )
+        update_analysis_job(job, "Finishing...", 1.0)
+        # Shown by the session once the job is delivered (see deliver_analysis_jobs)
+        job["warnings"] = call_stats.get("parse_warnings", [])
+        job["debug_json"] = call_stats.get("debug_json")
+        
+        # Calculate performance metrics
+        total_time = time.time() - start_time
+        if combined is not None:
+            optimized_size = combined["optimized_size"]
+            estimated_tokens = combined["estimated_tokens"]
+            coverage = combined["coverage"]
+        else:
+            optimized_size = sum(optimized["optimized_size"] for optimized in optimized_contracts)
+            estimated_tokens = sum(optimized["estimated_tokens"] for optimized in optimized_contracts)
+            coverage = [optimized["coverage"] for optimized in optimized_contracts]
+        
+        # Cost from the usage the API reported (responses served from the cache report none)
+        usage = {name: call_stats.get(name, 0) for name in PROMPT_USAGE_FIELDS}
+        cost = price_usage(call_stats.get("model"), usage)
+        
+        performance_metrics = {}
+        if params["enable_metrics"]:
+            template = None
+            if diffed is not None:
+                template = {name: diffed[name] for name in ("applied", "shared_ratio", "shared_paragraphs", "shared_sent",
+                                                            "changes", "changes_sent") if name in diffed}
+                if diffed["applied"]:
+                    # Savings against two separately optimised contracts, as sent without the diff
+                    template["tokens_without_diff"] = sum(optimize_contract(text, analysis_focus, token_budget)["estimated_tokens"]
+                                                          for text in (contract1_text, contract2_text))
+                    template["tokens_saved"] = template["tokens_without_diff"] - diffed["estimated_tokens"]
+            performance_metrics = {
+                "total_time": total_time,
+                "original_size": original_size,
+                "optimized_size": optimized_size,
+                "cost": cost,
+                "model": call_stats.get("model"),
+                "usage": usage,
+                "stage_times": {
+                    "extract": extract_time,
+                    "optimize": optimize_time,
+                    "diff": diffed["diff_time"] if diffed is not None else None,
+                    "align": aligned["align_time"] if aligned is not None else None,
+                    "prompt_build": call_stats.get("prompt_build_time", 0),
+                    "api_queue": call_stats.get("queue_time", 0),
+                    "api_first_token": call_stats.get("time_to_first_token"),
+                    "api_total": call_stats.get("api_time"),
+                    "parse": call_stats.get("parse_time", 0),
+                },
+                "documents": document_stats,
+                "estimated_tokens": estimated_tokens,
+                "token_budget": token_budget,
+                "api_time": call_stats.get("api_time"),
+                "time_to_first_token": call_stats.get("time_to_first_token"),
+                "output_tokens_per_second": call_stats.get("output_tokens_per_second"),
+                "fan_out": call_stats.get("fan_out"),
+                "api_requests": call_stats.get("api_requests", 0),
+                "response_cache_hits": call_stats.get("response_cache_hits", 0),
+                "queue_time": call_stats.get("queue_time", 0),
+                "api_retries": call_stats.get("api_retries", 0),
+                "coverage": coverage,
+                "alignment": {name: aligned[name] for name in ("clauses", "pairs", "pairs_sent", "unmatched_sent")}
+                             if aligned is not None else None,
+                "template_diff": template
+            }
+        
+        return {
+            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'contract1_name': params["contract_names"][0],
+            'contract2_name': params["contract_names"][1],
+            'focus_areas': analysis_focus,
+            'custom_prompt': params["custom_prompt"],
+            'custom_weights': params["custom_weights"],
+            'result': analysis_result,
+            'risk_analysis': risk_analysis,
+            # Parsed once here so reruns of the results tabs only look the sections up
+            'view': build_analysis_view(analysis_result, risk_analysis, *params["contract_names"]),
+            'performance_metrics': performance_metrics
+        }
+
+def run_tender_job(job, params):
+    """Background body of a tender ranking; returns its history entry."""
+    analysis_focus = params["analysis_focus"]
+    tender_jobs = params["extraction_jobs"]
+    with profile_comparison(params["profile"], job), trace_span("tender", contracts=len(tender_jobs),
+                                                                focus_areas=len(analysis_focus or [])):
+        start_time = time.time()
+        update_analysis_job(job, f"Assessing {len(tender_jobs)} responses...", 0.05)
+        
+        call_stats = {}
+        token_budget = params["token_budget"]
+        ranking, tender_documents = assess_tender(
+            tender_jobs, params["contract_names"], analysis_focus, params["custom_prompt"], params["custom_weights"],
+            token_budget=token_budget, call_stats=call_stats,
+            on_result=lambda done, total: update_analysis_job(job, f"Assessed {done} of {total} responses", done / total),
+            use_cache=params["use_cache"], cancel=job["cancel"]
+        )
+        total_time = time.time() - start_time
+        
+        usage = {name: call_stats.get(name, 0) for name in PROMPT_USAGE_FIELDS}
+        tender_metrics = {}
+        if params["enable_metrics"]:
+            tender_metrics = {
+                "total_time": total_time,
+                "original_size": sum(document["original_size"] for document in tender_documents),
+                "optimized_size": sum(document["optimized_size"] for document in tender_documents),
+                "cost": price_usage(call_stats.get("model"), usage),
+                "model": call_stats.get("model"),
+                "usage": usage,
+                # Responses are processed concurrently, so these are summed across them
+                "stage_times": {
+                    "extract": sum(document["stats"]["extract_time"] for document in tender_documents),
+                    "optimize": sum(document["optimize_time"] for document in tender_documents),
+                    "prompt_build": call_stats.get("prompt_build_time", 0),
+                    "api_queue": call_stats.get("queue_time", 0),
+                    "api_total": call_stats.get("api_time"),
+                    "parse": call_stats.get("parse_time", 0),
+                },
+                "documents": [document["stats"] for document in tender_documents],
+                "estimated_tokens": sum(document["estimated_tokens"] for document in tender_documents),
+                "token_budget": token_budget,
+                "api_time": call_stats.get("api_time"),
+                "tender": call_stats.get("tender"),
+                "api_requests": call_stats.get("api_requests", 0),
+                "response_cache_hits": call_stats.get("response_cache_hits", 0),
+                "queue_time": call_stats.get("queue_time", 0),
+                "api_retries": call_stats.get("api_retries", 0),
+            }
+        
+        return {
+            'mode': 'tender',
+            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'contract_names': params["contract_names"],
+            'focus_areas': analysis_focus,
+            'custom_prompt': params["custom_prompt"],
+            'custom_weights': params["custom_weights"],
+            'ranking': ranking,
+            'performance_metrics': tender_metrics
         }
+
+def analysis_job_params(analysis_focus, custom_prompt, custom_weights):
+    """Settings from the sidebar and Advanced Settings that a background analysis needs."""
+    return {
+        "analysis_focus": analysis_focus,
+        "custom_prompt": custom_prompt,
+        "custom_weights": custom_weights,
+        "token_budget": st.session_state.get("token_budget", default_token_budget()),
+        "use_parallel": st.session_state.get("use_parallel", True),
+        "measure_memory": st.session_state.get("measure_memory", False),
+        "pdf_workers": st.session_state.get("pdf_workers"),
+        "stream_results": st.session_state.get("stream_results", True),
+        "fan_out": st.session_state.get("fan_out", False),
+        "template_diff": st.session_state.get("template_diff", True),
+        "align_clauses": st.session_state.get("align_clauses", False),
+        "use_cache": not st.session_state.get("bypass_response_cache", False),
+        "enable_metrics": st.session_state.get("enable_metrics", True),
+        "profile": is_admin() and st.session_state.get("profile_comparison", False),
+    }
+
+def deliver_analysis_jobs():
+    """Add this session's finished background analyses to its history and open them; returns the jobs still running.
+    
+    Running jobs get a heartbeat here and from poll_analysis_job, so they are only
+    cancelled once no session is following them.
+    """
+    running = []
+    for job_id in list(st.session_state.analysis_jobs):
+        job = get_analysis_job(job_id)
+        if job is not None and not job["finished_at"]:
+            job["heartbeat"] = time.time()
+            running.append(job)
+            continue
         
-        # Add dimension scores with varied defaults - centered around 50 (equal)
-        base_scores = [55, 45, 60, 40, 52, 48, 65, 35, 58, 42]
-        for i, dimension in enumerate(scoring_dimensions):
-            score_idx = i % len(base_scores)
-            default_risk_analysis["contract1_dimension_scores"][dimension] = base_scores[score_idx]
-            # Contract 2 score is implied (100 - contract1_score)
-            default_risk_analysis["contract2_dimension_scores"][dimension] = 100 - base_scores[score_idx]
-        
-        if json_match:
-            json_text = json_match.group(1)
-            # Remove the JSON part from the main response
-            comparison_text = full_response[:json_match.start()].strip()
+        st.session_state.analysis_jobs.remove(job_id)
+        if job is None:
+            continue
+        if job["status"] == "done":
+            entry = job["result"]
+            st.session_state.analysis_history.append(job["summary"])
+            if entry.get("mode") == "tender":
+                st.session_state.current_tender = entry
+                st.toast("Tender ranking complete")
+            else:
+                st.session_state.current_analysis = entry
+                st.query_params["tab"] = "results"
+                st.toast("Comparison complete - see Comparison Results")
+            st.session_state.performance_metrics = entry["performance_metrics"]
+            st.session_state.debug_json = job["debug_json"]
+            for warning in job["warnings"]:
+                st.warning(warning)
+            if job.get("profile_stats"):
+                st.session_state.profile_stats = job["profile_stats"]
+        elif job["status"] == "failed":
+            st.error(f"Error calling Claude API: {job['error']}")
+        else:
+            st.info("Analysis cancelled.")
+    return running
+
+def render_analysis_job(job):
+    """Progress of a running analysis, the text streamed so far and a Cancel button."""
+    elapsed = time.time() - job["created_at"]
+    st.progress(job["progress"], text=f"{job['stage']} ({elapsed:.0f}s)")
+    cancelling = job["cancel"]["event"].is_set()
+    if st.button("Cancelling..." if cancelling else "Cancel", key=f"cancel_{job['id']}", disabled=cancelling):
+        cancel_analysis_job(job)
+    for warning in job["warnings"]:
+        st.warning(warning)
+    
+    # The trailing JSON risk assessment is never shown
+    visible = job["text"].split("```json")[0]
+    if visible:
+        with st.container(height=400):
+            st.markdown(visible)
+
+@st.fragment(run_every=1)
+def poll_analysis_job(job_id):
+    """Refresh a background analysis every second, rerunning the app to deliver it once finished."""
+    job = get_analysis_job(job_id)
+    if job is None or job["finished_at"]:
+        st.rerun()
+    job["heartbeat"] = time.time()
+    render_analysis_job(job)
+
+# Headless batch runs: python -m contract_app batch manifest.csv
+# Manifest columns: contract1, contract2 (required, paths relative to the manifest) and optionally
+# id, contract1_name, contract2_name, focus_areas and weights ("Area=40; Area=30", both ';'-separated)
+# and custom_prompt. Rows without focus areas or instructions use the command-line defaults.
+BATCH_MANIFEST_COLUMNS = ("contract1", "contract2")
+DEFAULT_BATCH_WORKERS = 4
+BATCH_POLL_SECONDS = 30
+BATCH_STATE_FILE = "message_batch.json"
+BATCH_SUMMARY_FILE = "summary.csv"
+BATCH_SUMMARY_COLUMNS = ("id", "status", "contract1_name", "contract2_name", "contract1_overall_score",
+                         "contract2_overall_score", "recommendation", "cost_usd", "api_time", "mode", "completed_at",
+                         "error", "warnings")
+
+def batch_pair_id(row_number, row):
+    """Id of a manifest row (its `id` column, else the row number and file names).
+
+    Limited to the characters and length Message Batches accepts as a custom_id, so
+    it doubles as the result file name.
+    """
+    pair_id = row.get("id") or "{:04d}-{}-vs-{}".format(
+        row_number, *(os.path.splitext(os.path.basename(row[column]))[0] for column in BATCH_MANIFEST_COLUMNS))
+    return re.sub(r"[^A-Za-z0-9_-]+", "-", pair_id).strip("-")[:64]
+
+def parse_weights(value):
+    """Parse "Pricing Structure=40; Data Security=30" into a weights dict"""
+    weights = {}
+    for item in value.split(";"):
+        if item.strip():
+            area, _, weight = item.partition("=")
+            weights[area.strip()] = float(weight)
+    return weights
+
+def read_batch_manifest(manifest_path, default_focus=None, default_prompt=""):
+    """Read the contract pairs from a manifest CSV; raises ValueError for an unusable manifest."""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    pairs = []
+    with open(manifest_path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        missing = [column for column in BATCH_MANIFEST_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"Manifest is missing column(s): {', '.join(missing)}")
+        
+        for row_number, row in enumerate(reader, 1):
+            row = {key.strip(): (value or "").strip() for key, value in row.items() if key}
+            if not any(row.values()):
+                continue
+            if not (row["contract1"] and row["contract2"]):
+                raise ValueError(f"Row {row_number}: both contract1 and contract2 are required")
             
-            # Parse the JSON
+            pair_id = batch_pair_id(row_number, row)
+            if any(pair["id"] == pair_id for pair in pairs):
+                raise ValueError(f"Row {row_number}: duplicate id '{pair_id}'")
             try:
-                risk_analysis = json.loads(json_text)
-                
-                # Debug the parsed JSON
-                st.session_state.debug_json = json_text
-                
-                # Ensure all required fields exist with defaults if not present
-                risk_analysis.setdefault("contract1_overall_score", 55)
-                risk_analysis.setdefault("contract2_overall_score", 45)
-                
-                # Ensure dimension scores exist for all focus areas
-                if "contract1_dimension_scores" not in risk_analysis:
-                    risk_analysis["contract1_dimension_scores"] = {}
-                if "contract2_dimension_scores" not in risk_analysis:
-                    risk_analysis["contract2_dimension_scores"] = {}
-                
-                # Fill in any missing dimension scores
-                for dimension in scoring_dimensions:
-                    dim_found = False
-                    # Check for variations of the dimension name (case insensitive, with underscores/spaces)
-                    for existing_dim in risk_analysis["contract1_dimension_scores"].keys():
-                        if normalize_dimension_name(dimension) == normalize_dimension_name(existing_dim):
-                            dim_found = True
-                            break
-                    
-                    if not dim_found:
-                        idx = scoring_dimensions.index(dimension) % len(base_scores)
-                        risk_analysis["contract1_dimension_scores"][dimension] = base_scores[idx]
-                        risk_analysis["contract2_dimension_scores"][dimension] = 100 - base_scores[idx]
-                
-                # Apply any custom weights to adjust overall scores if provided
-                if custom_weights and isinstance(custom_weights, dict):
-                    try:
-                        # Convert any selected focus areas not in weights to equal distribution
-                        remaining_weight = 100 - sum(custom_weights.values())
-                        remaining_areas = [area for area in scoring_dimensions if area not in custom_weights]
-                        
-                        if remaining_areas and remaining_weight > 0:
-                            weight_per_area = remaining_weight / len(remaining_areas)
-                            for area in remaining_areas:
-                                custom_weights[area] = weight_per_area
-                        
-                        # Calculate weighted scores
-                        c1_score = 0
-                        c2_score = 0
-                        total_weight = 0
-                        
-                        # Use exact dimension names from scoring_dimensions
-                        for dimension in scoring_dimensions:
-                            # Try to find this dimension with normalization
-                            dim_to_use = None
-                            for existing_dim in risk_analysis["contract1_dimension_scores"].keys():
-                                if normalize_dimension_name(dimension) == normalize_dimension_name(existing_dim):
-                                    dim_to_use = existing_dim
-                                    break
-                            
-                            if dim_to_use and dimension in custom_weights:
-                                weight = custom_weights[dimension]
-                                c1_score += risk_analysis["contract1_dimension_scores"][dim_to_use] * (weight / 100)
-                                c2_score += risk_analysis["contract2_dimension_scores"].get(dim_to_use, 100 - risk_analysis["contract1_dimension_scores"][dim_to_use]) * (weight / 100)
-                                total_weight += weight
-                        
-                        # Apply the weighted scores
-                        if total_weight > 0:
-                            risk_analysis["contract1_overall_score"] = int(c1_score * (100 / total_weight))
-                            risk_analysis["contract2_overall_score"] = int(c2_score * (100 / total_weight))
-                    except Exception as e:
-                        # If there's an error applying weights, log it but continue
-                        print(f"Error applying custom weights: {str(e)}")
-                
-                # Ensure other required fields exist
-                risk_analysis.setdefault("categories", [])
-                risk_analysis.setdefault("contract1_advantages", ["Good overall terms"])
-                risk_analysis.setdefault("contract1_disadvantages", ["Could be improved in some areas"])
-                risk_analysis.setdefault("contract2_advantages", ["Good overall terms"])
-                risk_analysis.setdefault("contract2_disadvantages", ["Could be improved in some areas"])
-                risk_analysis.setdefault("recommendation", "Both contracts have strengths and weaknesses. Further analysis recommended.")
-                
-            except json.JSONDecodeError as e:
-                # If JSON parsing fails, use default structure
-                st.warning(f"Error parsing risk assessment JSON. Using default values. Error: {str(e)}")
-                risk_analysis = default_risk_analysis
-                comparison_text = full_response
-        else:
-            # If no JSON found, use default structure
-            st.warning("No risk assessment JSON found in the response. Using default values.")
-            comparison_text = full_response
-            risk_analysis = default_risk_analysis
+                weights = parse_weights(row.get("weights", ""))
+            except ValueError:
+                raise ValueError(f"Row {row_number}: weights must look like 'Pricing Structure=40; Data Security=30'")
             
-        return comparison_text, risk_analysis
+            pair = {
+                "id": pair_id,
+                "focus_areas": [area.strip() for area in row.get("focus_areas", "").split(";") if area.strip()] or list(default_focus or []),
+                "custom_prompt": row.get("custom_prompt") or default_prompt,
+                "custom_weights": weights,
+            }
+            for column in BATCH_MANIFEST_COLUMNS:
+                pair[column] = os.path.join(base_dir, row[column])
+                pair[f"{column}_name"] = row.get(f"{column}_name") or os.path.basename(row[column])
+            pairs.append(pair)
+    return pairs
+
+def file_sha256(path):
+    with open_document(path) as (_, buffer, _path):
+        return hashlib.sha256(buffer).hexdigest()
+
+def batch_pair_fingerprint(pair, token_budget, fan_out):
+    """Hash of everything that determines a pair's result, so resumed runs skip only unchanged pairs"""
+    inputs = {
+        "documents": [file_sha256(pair[column]) for column in BATCH_MANIFEST_COLUMNS],
+        "focus_areas": pair["focus_areas"],
+        "custom_prompt": pair["custom_prompt"],
+        "custom_weights": pair["custom_weights"],
+        "token_budget": token_budget,
+        "fan_out": fan_out,
+        "model": get_config("ANTHROPIC_MODEL"),
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+def batch_result_path(output_dir, pair_id):
+    return os.path.join(output_dir, "results", f"{pair_id}.json")
+
+def load_batch_result(output_dir, pair_id):
+    try:
+        with open(batch_result_path(output_dir, pair_id), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_json_atomic(path, data):
+    """Write JSON through a temporary file, so an interrupted run never leaves a truncated file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temp_path, path)
+
+def new_batch_result(pair, fingerprint, mode):
+    """Result record for a pair, before the comparison fields are filled in"""
+    result = {key: pair[key] for key in ("id", "contract1", "contract1_name", "contract2", "contract2_name",
+                                         "focus_areas", "custom_prompt", "custom_weights")}
+    result.update({"fingerprint": fingerprint, "mode": mode, "status": "error", "error": None})
+    return result
+
+def finish_batch_result(result, analysis_text, risk_analysis, call_stats, batch=False):
+    """Fill in a successful comparison and its usage and cost"""
+    usage = {name: call_stats.get(name, 0) for name in PROMPT_USAGE_FIELDS}
+    result.update({
+        "status": "ok",
+        "model": call_stats.get("model"),
+        "analysis": analysis_text,
+        "risk_analysis": risk_analysis,
+        "usage": usage,
+        "cost": price_usage(call_stats.get("model"), usage, batch),
+        "api_time": call_stats.get("api_time"),
+        "api_requests": call_stats.get("api_requests", 0),
+        "response_cache_hits": call_stats.get("response_cache_hits", 0),
+        "warnings": call_stats.get("parse_warnings", []),
+    })
+    for warning in result["warnings"]:
+        print(f"{result['id']}: {warning}")
+    return result
+
+def optimize_batch_pair(pair, token_budget):
+    """Extract and optimise both contracts of a pair; returns (texts, optimized contracts, document stats)"""
+    texts, documents = zip(*(extract_text_with_stats(pair[column]) for column in BATCH_MANIFEST_COLUMNS))
+    optimized = tuple(optimize_contract(text, pair["focus_areas"], token_budget) for text in texts)
+    return texts, optimized, list(documents)
+
+def run_batch_pair(pair, fingerprint, token_budget, fan_out=False, use_cache=True):
+    """Compare one pair through the Messages API (rate limited and retried like the app); never raises."""
+    start_time = time.time()
+    result = new_batch_result(pair, fingerprint, "fan_out" if fan_out and pair["focus_areas"] else "single")
+    try:
+        with trace_span("batch_pair", pair=pair["id"]):
+            texts, optimized, result["documents"] = optimize_batch_pair(pair, token_budget)
+            call_stats = {}
+            analysis_text, risk_analysis = compare_contracts_with_claude(
+                texts[0], texts[1], pair["focus_areas"], pair["custom_prompt"], pair["custom_weights"],
+                optimized_contracts=optimized, call_stats=call_stats, fan_out=fan_out and bool(pair["focus_areas"]),
+                use_cache=use_cache, raise_errors=True
+            )
+        finish_batch_result(result, analysis_text, risk_analysis, call_stats)
     except Exception as e:
-        st.error(f"Error calling Claude API: {str(e)}")
-        # Return a basic response and default risk analysis
-        return "Error analyzing contracts. Please try again with different parameters or contact support.", default_risk_analysis
+        result["error"] = str(e)
+    result["elapsed"] = time.time() - start_time
+    result["completed_at"] = datetime.now().isoformat(timespec="seconds")
+    return result
+
+def run_batch_pairs(pairs, fingerprints, output_dir, token_budget, workers, fan_out, use_cache):
+    """Compare pairs on a bounded worker pool, writing each result as soon as it finishes"""
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+    run_pair = in_trace_context(run_batch_pair)
+    futures = {executor.submit(run_pair, pair, fingerprints[pair["id"]], token_budget, fan_out, use_cache): pair
+               for pair in pairs}
+    try:
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            write_json_atomic(batch_result_path(output_dir, result["id"]), result)
+            print(f"[{done}/{len(pairs)}] {result['id']}: {result['status']} ({result['elapsed']:.1f}s)"
+                  + (f" - {result['error']}" if result["error"] else ""))
+    finally:
+        # On an interrupt, finish the pairs in flight and drop the rest; a re-run resumes from the results written
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def collect_message_batch(client, state, pairs_by_id, output_dir):
+    """Write a result for every request of an ended message batch"""
+    for entry in client.messages.batches.results(state["batch_id"]):
+        request = state["requests"].get(entry.custom_id)
+        pair = pairs_by_id.get(entry.custom_id)
+        if request is None or pair is None or request["fingerprint"] != batch_pair_fingerprint(
+                pair, state["token_budget"], False):
+            # The manifest or the contracts changed since submission; the pair is run again
+            continue
+        
+        result = new_batch_result(pair, request["fingerprint"], "message_batch")
+        result["documents"] = request["documents"]
+        if entry.result.type == "succeeded":
+            message = entry.result.message
+            # Identical requests made later by the app or a synchronous run are answered from the cache
+            save_response(request["cache_key"], message)
+            call_stats = {"model": message.model, "api_requests": 1}
+            for name in PROMPT_USAGE_FIELDS:
+                call_stats[name] = getattr(message.usage, name, 0) or 0
+            analysis_text, risk_analysis, parse_info = parse_comparison_response(
+                message.content[0].text, get_scoring_dimensions(pair["focus_areas"]), pair["custom_weights"])
+            call_stats["parse_warnings"] = parse_info["warnings"]
+            finish_batch_result(result, analysis_text, risk_analysis, call_stats, batch=True)
+        else:
+            error = getattr(entry.result, "error", None)
+            result["error"] = f"Message batch request {entry.result.type}" + (f": {error}" if error else "")
+        result["batch_id"] = state["batch_id"]
+        result["completed_at"] = datetime.now().isoformat(timespec="seconds")
+        write_json_atomic(batch_result_path(output_dir, result["id"]), result)
+        print(f"{result['id']}: {result['status']}" + (f" - {result['error']}" if result["error"] else ""))
+
+def wait_for_message_batch(client, batch_id, poll_seconds):
+    """Poll a message batch until it has ended"""
+    while True:
+        batch = client.messages.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        print(f"Message batch {batch_id}: {batch.processing_status} ({counts.processing} processing, "
+              f"{counts.succeeded} succeeded, {counts.errored + counts.expired + counts.canceled} failed)")
+        if batch.processing_status == "ended":
+            return batch
+        time.sleep(poll_seconds)
 
-def create_performance_metrics():
-    """Display performance metrics for the current analysis if available"""
+def run_message_batch(pairs, fingerprints, output_dir, token_budget, use_cache, poll_seconds):
+    """Submit the pairs as one Message Batches job, wait for it and write the results.
+
+    The submitted batch is recorded in BATCH_STATE_FILE before waiting, so an
+    interrupted run picks the same batch up again instead of resubmitting.
+    Requests already in the response cache are answered locally.
+    """
+    client = get_anthropic_client()["client"]
+    state_path = os.path.join(output_dir, BATCH_STATE_FILE)
+    pairs_by_id = {pair["id"]: pair for pair in pairs}
     
-    if 'performance_metrics' not in st.session_state:
+    requests = []
+    state = {"token_budget": token_budget, "requests": {}}
+    for pair in pairs:
+        texts, optimized, documents = optimize_batch_pair(pair, token_budget)
+        prompt = build_comparison_prompt(build_contract_blocks(optimized[0]["text"], optimized[1]["text"]),
+                                         get_scoring_dimensions(pair["focus_areas"]), pair["custom_prompt"],
+                                         build_weights_instruction(pair["custom_weights"]))
+        request = build_message_request(prompt, COMPARISON_SYSTEM_BLOCKS)
+        cache_key = response_cache_key(request)
+        if use_cache and load_response(cache_key) is not None:
+            write_json_atomic(batch_result_path(output_dir, pair["id"]),
+                              run_batch_pair(pair, fingerprints[pair["id"]], token_budget))
+            print(f"{pair['id']}: answered from the response cache")
+            continue
+        requests.append({"custom_id": pair["id"], "params": request})
+        state["requests"][pair["id"]] = {"fingerprint": fingerprints[pair["id"]], "cache_key": cache_key,
+                                         "documents": documents}
+    
+    if not requests:
         return
-        
-    metrics = st.session_state.performance_metrics
+    batch = client.messages.batches.create(requests=requests)
+    state["batch_id"] = batch.id
+    state["submitted_at"] = datetime.now().isoformat(timespec="seconds")
+    write_json_atomic(state_path, state)
+    print(f"Submitted message batch {batch.id} with {len(requests)} requests")
     
-    st.subheader("Performance Metrics")
+    wait_for_message_batch(client, batch.id, poll_seconds)
+    collect_message_batch(client, state, pairs_by_id, output_dir)
+    os.remove(state_path)
+
+def resume_message_batch(pairs, output_dir, poll_seconds):
+    """Finish the message batch an earlier run submitted, if there is one"""
+    state_path = os.path.join(output_dir, BATCH_STATE_FILE)
+    try:
+        with open(state_path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return
     
-    col1, col2, col3 = st.columns(3)
+    print(f"Resuming message batch {state['batch_id']} submitted at {state['submitted_at']}")
+    client = get_anthropic_client()["client"]
+    wait_for_message_batch(client, state["batch_id"], poll_seconds)
+    collect_message_batch(client, state, {pair["id"]: pair for pair in pairs}, output_dir)
+    os.remove(state_path)
+
+def write_batch_summary(pairs, output_dir):
+    """One CSV row per manifest pair from its result file; returns the rows"""
+    rows = []
+    for pair in pairs:
+        result = load_batch_result(output_dir, pair["id"]) or {"id": pair["id"], "status": "pending"}
+        risk_analysis = result.get("risk_analysis") or {}
+        rows.append({
+            "id": pair["id"],
+            "status": result["status"],
+            "contract1_name": pair["contract1_name"],
+            "contract2_name": pair["contract2_name"],
+            "contract1_overall_score": risk_analysis.get("contract1_overall_score"),
+            "contract2_overall_score": risk_analysis.get("contract2_overall_score"),
+            "recommendation": risk_analysis.get("recommendation"),
+            "cost_usd": round(result["cost"]["total"], 6) if result.get("cost") else None,
+            "api_time": round(result["api_time"], 2) if result.get("api_time") is not None else None,
+            "mode": result.get("mode"),
+            "completed_at": result.get("completed_at"),
+            "error": result.get("error"),
+            "warnings": "; ".join(result.get("warnings") or []),
+        })
     
-    with col1:
-        st.metric(
-            "Processing Time", 
-            f"{metrics.get('total_time', 0):.2f}s",
-            help="Total time to process and analyze contracts"
-        )
+    with open(os.path.join(output_dir, BATCH_SUMMARY_FILE), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=BATCH_SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+def run_batch(manifest_path, output_dir=None, workers=DEFAULT_BATCH_WORKERS, focus_areas=None, custom_prompt="",
+              token_budget=None, fan_out=False, use_cache=True, message_batches=False, poll_seconds=BATCH_POLL_SECONDS,
+              rerun=False):
+    """Compare every pair in a manifest, skipping pairs with an up-to-date result.
+
+    Each pair's result is written to <output_dir>/results/<id>.json as it finishes,
+    which is also the checkpoint: a re-run (or a run after an interruption) only
+    compares pairs that have no successful result for the same inputs. `rerun`
+    ignores existing results. With `message_batches` the pairs are submitted through
+    the Message Batches API at the batch discount instead of the worker pool.
+    Writes <output_dir>/summary.csv and returns its rows.
+    """
+    if not get_config("ANTHROPIC_MODEL") or not get_config("ANTHROPIC_API_KEY"):
+        raise Exception("ANTHROPIC_MODEL and ANTHROPIC_API_KEY must be set (environment or secrets)")
+    if token_budget is None:
+        token_budget = default_token_budget()
+    if output_dir is None:
+        output_dir = f"{os.path.splitext(manifest_path)[0]}_results"
+    os.makedirs(output_dir, exist_ok=True)
     
-    with col2:
-        original_size = metrics.get('original_size', 0)
-        optimized_size = metrics.get('optimized_size', 0)
-        
-        if original_size > 0:
-            reduction = ((original_size - optimized_size) / original_size) * 100
-            st.metric(
-                "Token Reduction", 
-                f"{reduction:.1f}%",
-                help="Percentage reduction in text size after optimization"
-            )
+    pairs = read_batch_manifest(manifest_path, focus_areas, custom_prompt)
+    if message_batches:
+        resume_message_batch(pairs, output_dir, poll_seconds)
+    
+    fingerprints = {}
+    pending = []
+    unreadable = 0
+    for pair in pairs:
+        try:
+            fingerprints[pair["id"]] = batch_pair_fingerprint(pair, token_budget, fan_out and not message_batches)
+        except OSError as e:
+            write_json_atomic(batch_result_path(output_dir, pair["id"]),
+                              dict(new_batch_result(pair, None, "single"), error=f"Cannot read contract: {e}"))
+            unreadable += 1
+            continue
+        result = load_batch_result(output_dir, pair["id"])
+        if rerun or not result or result["status"] != "ok" or result["fingerprint"] != fingerprints[pair["id"]]:
+            pending.append(pair)
+    print(f"{len(pairs)} pairs in {manifest_path}: {len(pairs) - len(pending) - unreadable} up to date, "
+          f"{len(pending)} to compare, {unreadable} with unreadable contracts")
+    
+    if pending:
+        if message_batches:
+            run_message_batch(pending, fingerprints, output_dir, token_budget, use_cache, poll_seconds)
         else:
-            st.metric("Token Reduction", "N/A")
+            run_batch_pairs(pending, fingerprints, output_dir, token_budget, workers, fan_out, use_cache)
     
-    with col3:
-        st.metric(
-            "Estimated Cost", 
-            f"${metrics.get('estimated_cost', 0):.4f}",
-            help="Estimated cost of API calls"
-        )
+    rows = write_batch_summary(pairs, output_dir)
+    print(f"Summary written to {os.path.join(output_dir, BATCH_SUMMARY_FILE)}")
+    return rows
+
+def cli(argv=None):
+    """Command-line entry point for headless runs"""
+    parser = argparse.ArgumentParser(prog="python -m contract_app",
+                                     description="Headless ERP contract comparison (run the app with `streamlit run contract_app.py`)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    batch = commands.add_parser("batch", help="Compare every contract pair listed in a manifest CSV")
+    batch.add_argument("manifest", help="CSV with contract1 and contract2 columns (optional: id, contract1_name, "
+                                        "contract2_name, focus_areas, weights, custom_prompt)")
+    batch.add_argument("--output-dir", help="Where result JSON files and summary.csv are written "
+                                            "(default: <manifest>_results)")
+    batch.add_argument("--workers", type=int, default=DEFAULT_BATCH_WORKERS, help="Pairs compared at the same time")
+    batch.add_argument("--focus", action="append", default=[],
+                       help="Focus area for rows without focus_areas (repeatable)")
+    batch.add_argument("--custom-prompt", default="", help="Instructions for rows without custom_prompt")
+    batch.add_argument("--token-budget", type=int, help="Input token budget per contract")
+    batch.add_argument("--fan-out", action="store_true", help="Analyse each focus area in its own concurrent request")
+    batch.add_argument("--no-cache", action="store_true", help="Bypass the response cache")
+    batch.add_argument("--rerun", action="store_true", help="Compare every pair again, ignoring existing results")
+    batch.add_argument("--message-batches", action="store_true",
+                       help="Submit through the Message Batches API (cheaper, results within 24 hours)")
+    batch.add_argument("--poll-seconds", type=float, default=BATCH_POLL_SECONDS,
+                       help="How often to check a submitted message batch")
+    args = parser.parse_args(argv)
+    
+    try:
+        rows = run_batch(args.manifest, args.output_dir, max(1, args.workers), args.focus, args.custom_prompt,
+                         args.token_budget, args.fan_out, not args.no_cache, args.message_batches, args.poll_seconds,
+                         args.rerun)
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume")
+        return 130
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 2
+    return 0 if all(row["status"] == "ok" for row in rows) else 1
 
 def main():
     # App header
@@ -894,11 +4564,19 @@ def main():
     
     # Initialize session state
     if 'analysis_history' not in st.session_state:
-        st.session_state.analysis_history = []
+        # Summaries only; a past analysis is loaded in full when it is opened
+        st.session_state.analysis_history = list_history(history_user())
     if 'debug_json' not in st.session_state:
         st.session_state.debug_json = None
     if 'performance_metrics' not in st.session_state:
         st.session_state.performance_metrics = {}
+    if 'analysis_jobs' not in st.session_state:
+        st.session_state.analysis_jobs = []
+    
+    sweep_content_stores()
+    
+    # Pick up analyses that finished in the background since the last run
+    running_jobs = deliver_analysis_jobs()
     
     # Sidebar for settings
     with st.sidebar:
@@ -954,6 +4632,39 @@ def main():
             
             st.checkbox("Use parallel processing", key="use_parallel", value=True,
                        help="Process contracts concurrently to save time")
+            
+            st.checkbox("Measure extraction memory", key="measure_memory", value=False,
+                        help="Record the peak memory used while parsing each newly uploaded document. "
+                             "Measured documents are parsed one at a time in this process, so parsing is slower")
+            
+            st.checkbox("Stream results", key="stream_results", value=True,
+                        help="Show each comparison section below the Compare button as soon as Claude writes it")
+            
+            st.checkbox("Analyse focus areas in parallel", key="fan_out", value=False,
+                        help="Send one request per focus area concurrently and merge the results. "
+                             "Only used when focus areas are selected")
+            
+            st.checkbox("Diff contracts built on the same template", key="template_diff", value=True,
+                        help="When most of the text is identical (e.g. two redlines of one vendor template), send the "
+                             "shared text once and only the differing clauses side by side")
+            
+            st.checkbox("Align clauses before comparing", key="align_clauses", value=False,
+                        help="Pair each clause of Contract 1 with its closest counterpart in Contract 2 and send "
+                             "the pairs side by side, grouped by focus area, within both contracts' token budget")
+            
+            st.checkbox("Bypass response cache", key="bypass_response_cache", value=False,
+                        help="Ask Claude again even if this exact comparison was run before; the fresh result replaces the cached one")
+            
+            st.slider("Input token budget per contract", 1000, 50000, default_token_budget(), 500, key="token_budget",
+                      help="The most relevant sections of each contract are packed into this many input tokens")
+            
+            st.number_input("PDF extraction workers", min_value=1, max_value=pdf_pool_size(),
+                            value=default_pdf_workers(), key="pdf_workers",
+                            help=f"Worker processes used to extract pages of PDFs with {PDF_PARALLEL_PAGE_THRESHOLD}+ pages in parallel")
+            
+            if is_admin():
+                st.checkbox("Profile comparisons (admin)", key="profile_comparison", value=False,
+                            help="Run each comparison under cProfile and offer the .pstats file in Technical Details")
         
         st.markdown("## About")
         st.info("""
@@ -961,6 +4672,7 @@ def main():
         
         Features include:
         - Clear side-by-side contract comparison
+        - Tender mode ranking any number of vendor responses
         - Expanded view of differences between contracts
         - Custom scoring for each comparison area
         - Risk assessment with color-coding
@@ -970,23 +4682,36 @@ def main():
         
         # Data Privacy Note
         st.markdown("## Data Privacy")
-        st.info("""
+        extraction_hours, response_hours = (ttl_seconds / 3600 for _, _, ttl_seconds in content_stores())
+        stored = []
+        if extraction_hours > 0:
+            stored.append(f"The text extracted from uploaded documents is kept until it has gone unused for {extraction_hours:g} hours, so the same document is not parsed twice.")
+        if response_hours > 0:
+            stored.append(f"Analysis responses are kept until they have gone unused for {response_hours:g} hours, so identical analyses are not sent again.")
+        if stored:
+            stored.append("These stores are unencrypted files on the server's disk; administrators can delete them from the Technical Details tab.")
+        else:
+            stored.append("Uploaded documents and contract text are not stored after processing.")
+        st.info(f"""
         **Privacy Notice:**
         
-        This application processes contract documents locally and sends anonymized text to our secure API for comparison analysis. We do not store your documents or contract text after processing. All data is encrypted in transit.
+        This application processes contract documents locally and sends the relevant contract text to our secure API for comparison analysis. {" ".join(stored)} All data is encrypted in transit.
         
-        Your contract information is used solely to generate the comparison and is not used for any other purpose. Analysis results are stored only in your browser session and are automatically deleted when you close the application.
+        Your contract information is used solely to generate the comparison and is not used for any other purpose. Analysis results are saved to this application's history database under your user name, so your History tab is available in later sessions.
         
         For more information about our data handling practices, please contact your IT administrator.
         """)
     
     # Main interface with progressive disclosure
-    tabs = st.tabs(["Contract Upload", "Comparison Results", "Key Findings", "Technical Details", "History"])
+    tabs = st.tabs(["Contract Upload", "Tender Comparison", "Comparison Results", "Key Findings", "Technical Details", "History"])
     
     # Contract Upload Tab
     with tabs[0]:
         st.markdown('<div style="font-size: 1.8rem; font-weight: bold; margin: 1.5rem 0 1rem 0; padding-bottom: 0.5rem; border-bottom: 2px solid #e0e0e0;">Upload Contracts for Comparison</div>', unsafe_allow_html=True)
         
+        measure_memory = st.session_state.get("measure_memory", False)
+        pdf_workers = st.session_state.get("pdf_workers")
+        
         col1, col2 = st.columns(2)
         
         with col1:
@@ -996,9 +4721,9 @@ def main():
             
             if contract1_file:
                 st.success(f"Successfully uploaded: {contract1_file.name}")
-                contract1_text = extract_text(contract1_file)
-                st.markdown("#### Preview")
-                st.text_area("", contract1_text[:1000] + "...", height=200, disabled=True)
+                # Extraction runs in the background; the preview fills in from the first pages
+                contract1_job = start_extraction_job(contract1_file, measure_memory, pdf_workers)
+                show_extraction_preview(contract1_job, "Contract 1 preview")
         
         with col2:
             st.markdown("### Contract 2")
@@ -1007,110 +4732,151 @@ def main():
             
             if contract2_file:
                 st.success(f"Successfully uploaded: {contract2_file.name}")
-                contract2_text = extract_text(contract2_file)
-                st.markdown("#### Preview")
-                st.text_area("", contract2_text[:1000] + "...", height=200, disabled=True)
+                contract2_job = start_extraction_job(contract2_file, measure_memory, pdf_workers)
+                show_extraction_preview(contract2_job, "Contract 2 preview")
+        
+        extraction_ready = (contract1_file and contract2_file and
+                            extraction_job_ready(contract1_job) and extraction_job_ready(contract2_job))
         
         # Analyse button
         analyze_col1, analyze_col2, analyze_col3 = st.columns([1, 2, 1])
         with analyze_col2:
-            # Button is disabled if no files or no focus areas/custom instructions
+            # Button is disabled if no files, extraction is still running, or no focus areas/custom instructions
             analyze_button = st.button("Compare Contracts", type="primary", use_container_width=True, 
-                                      disabled=not (contract1_file and contract2_file and (analysis_focus or custom_prompt)))
+                                      disabled=not (extraction_ready and (analysis_focus or custom_prompt)) or
+                                      any(job["kind"] == "comparison" for job in running_jobs))
         
         if not (analysis_focus or custom_prompt):
             st.error("You must select at least one focus area or provide custom analysis instructions")
         
         if analyze_button and contract1_file and contract2_file and (analysis_focus or custom_prompt):
-            with st.spinner("Creating enhanced comparison with custom scoring... This may take a moment..."):
-                start_time = time.time()
-                
-                # Extract contract text (potentially in parallel)
-                if st.session_state.get("use_parallel", True):
-                    contract1_text, contract2_text = process_contracts_concurrently(contract1_file, contract2_file)
-                else:
-                    contract1_text = extract_text(contract1_file)
-                    contract2_text = extract_text(contract2_file)
-                
-                # Track original text sizes for metrics
-                original_size = len(contract1_text) + len(contract2_text)
-                
-                # Default names if not provided
-                if not contract1_name:
-                    contract1_name = contract1_file.name
-                if not contract2_name:
-                    contract2_name = contract2_file.name
-                
-                # Generate the enhanced comparison with risk assessment and custom scoring
-                analysis_result, risk_analysis = compare_contracts_with_claude(
-                    contract1_text, 
-                    contract2_text, 
-                    analysis_focus, 
-                    custom_prompt,
-                    custom_weights if 'custom_weights' in locals() else None
-                )
-                
-                # Calculate performance metrics
-                end_time = time.time()
-                total_time = end_time - start_time
-                
-                # Get optimized size by running the optimizer
-                if analysis_focus:
-                    optimized_contract1 = optimize_contract_for_claude(contract1_text, analysis_focus)
-                    optimized_contract2 = optimize_contract_for_claude(contract2_text, analysis_focus)
-                    optimized_size = len(optimized_contract1) + len(optimized_contract2)
-                else:
-                    optimized_size = min(len(contract1_text), 25000) + min(len(contract2_text), 25000)
-                
-                # Estimate cost (very rough approximation)
-                # Claude 3 Opus is roughly $15 per 1M tokens, assuming ~4 chars per token
-                estimated_tokens = optimized_size / 4
-                estimated_cost = (estimated_tokens / 1000000) * 15
-                
-                # Store metrics
-                if st.session_state.get("enable_metrics", True):
-                    st.session_state.performance_metrics = {
-                        "total_time": total_time,
-                        "original_size": original_size,
-                        "optimized_size": optimized_size,
-                        "estimated_cost": estimated_cost
-                    }
-                
-                # Add to history
-                analysis_entry = {
-                    'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    'contract1_name': contract1_name,
-                    'contract2_name': contract2_name,
-                    'focus_areas': analysis_focus,
-                    'custom_prompt': custom_prompt,
-                    'custom_weights': custom_weights if 'custom_weights' in locals() else {},
-                    'result': analysis_result,
-                    'risk_analysis': risk_analysis,
-                    'performance_metrics': st.session_state.performance_metrics
-                }
-                st.session_state.analysis_history.append(analysis_entry)
-                st.session_state.current_analysis = analysis_entry
-                
-                # Go to results tab
-                st.query_params["tab"] = "results"
-                st.rerun()
+            # The comparison runs in the background; this script run only queues it
+            params = analysis_job_params(analysis_focus, custom_prompt, custom_weights)
+            params.update(contract_files=(contract1_file, contract2_file),
+                          contract_names=(contract1_name or contract1_file.name, contract2_name or contract2_file.name))
+            st.session_state.analysis_jobs.append(start_analysis_job("comparison", run_comparison_job, params))
+            st.rerun()
+        
+        for job in running_jobs:
+            if job["kind"] == "comparison":
+                poll_analysis_job(job["id"])
                 
-    # Comparison Results Tab (Full detailed comparison)
+    # Tender Comparison Tab (one assessment per response, ranked locally)
     with tabs[1]:
+        st.markdown('<div style="font-size: 1.8rem; font-weight: bold; margin: 1.5rem 0 1rem 0; padding-bottom: 0.5rem; border-bottom: 2px solid #e0e0e0;">Compare Tender Responses</div>', unsafe_allow_html=True)
+        st.markdown("Upload every vendor response to rank them on the selected focus areas. "
+                    "Each response is assessed once, so the cost grows with the number of responses rather than the number of pairs.")
+        
+        measure_memory = st.session_state.get("measure_memory", False)
+        pdf_workers = st.session_state.get("pdf_workers")
+        
+        tender_files = st.file_uploader("Upload tender responses", type=["pdf", "docx", "txt"],
+                                        accept_multiple_files=True, key="tender_files")
+        
+        # Extraction of every response starts in the background as soon as it is uploaded
+        tender_jobs = [start_extraction_job(file, measure_memory, pdf_workers) for file in tender_files or []]
+        if tender_jobs:
+            if all(job["future"].done() for job in tender_jobs):
+                render_tender_extraction_status(tender_jobs)
+            else:
+                poll_tender_extraction([job["key"] for job in tender_jobs])
+        
+        tender_ready = len(tender_jobs) >= TENDER_MIN_CONTRACTS and all(extraction_job_ready(job) for job in tender_jobs)
+        if tender_files and len(tender_files) < TENDER_MIN_CONTRACTS:
+            st.info(f"Upload at least {TENDER_MIN_CONTRACTS} responses to compare")
+        
+        tender_col1, tender_col2, tender_col3 = st.columns([1, 2, 1])
+        with tender_col2:
+            tender_button = st.button("Rank Tender Responses", type="primary", use_container_width=True,
+                                      disabled=not (tender_ready and (analysis_focus or custom_prompt)) or
+                                      any(job["kind"] == "tender" for job in running_jobs))
+        
+        if tender_button and tender_ready and (analysis_focus or custom_prompt):
+            # Display names are the file names, numbered if two uploads share one
+            tender_names = [os.path.splitext(file.name)[0] for file in tender_files]
+            tender_names = [f"{name} ({i + 1})" if tender_names.count(name) > 1 else name
+                            for i, name in enumerate(tender_names)]
+            params = analysis_job_params(analysis_focus, custom_prompt, custom_weights)
+            params.update(extraction_jobs=tender_jobs, contract_names=tender_names)
+            st.session_state.analysis_jobs.append(start_analysis_job("tender", run_tender_job, params))
+            st.rerun()
+        
+        for job in running_jobs:
+            if job["kind"] == "tender":
+                poll_analysis_job(job["id"])
+        
+        if 'current_tender' in st.session_state:
+            tender = st.session_state.current_tender
+            scoring_dimensions = get_scoring_dimensions(tender['focus_areas'])
+            ranking = tender['ranking']
+            
+            st.markdown("### Ranking")
+            st.markdown(f"**Analysis performed:** {tender['timestamp']} · **Focus Areas:** {', '.join(scoring_dimensions)}")
+            leader = ranking[0] if ranking and ranking[0]['overall_score'] is not None else None
+            if leader:
+                st.success(f"**{leader['name']}** ranks first with {leader['overall_score']}/100 overall.")
+            st.dataframe(tender_ranking_table(ranking, scoring_dimensions), hide_index=True, use_container_width=True,
+                         column_config={"Overall": st.column_config.ProgressColumn("Overall", min_value=0, max_value=100, format="%d")})
+            st.caption("Overall scores are the weighted mean of the focus area scores, using the custom weights in the sidebar "
+                       "at the time of the analysis. 50 is market standard.")
+            
+            failed = [assessment['name'] for assessment in ranking if assessment.get('error')]
+            if failed:
+                st.warning(f"Could not assess: {', '.join(failed)}")
+            
+            st.markdown("### Scores by Focus Area")
+            st.dataframe(tender_dimension_matrix(ranking, scoring_dimensions), hide_index=True, use_container_width=True)
+            
+            st.markdown("### Response Assessments")
+            for assessment in ranking:
+                overall = f"{assessment['overall_score']}/100" if assessment['overall_score'] is not None else "not assessed"
+                with st.expander(f"{assessment['rank']}. {assessment['name']} - {overall}"):
+                    if assessment.get('error'):
+                        st.error(assessment['error'])
+                        continue
+                    if assessment.get('summary'):
+                        st.info(assessment['summary'])
+                    for dimension in scoring_dimensions:
+                        if dimension in assessment['dimension_scores']:
+                            st.markdown(f"**{dimension}:** {assessment['dimension_scores'][dimension]}/100 "
+                                        f"{assessment['dimension_notes'].get(dimension, '')}")
+                    strengths_col, weaknesses_col = st.columns(2)
+                    with strengths_col:
+                        st.markdown("**Strengths:**")
+                        for point in assessment.get('strengths', []):
+                            st.markdown(f"- {point}")
+                    with weaknesses_col:
+                        st.markdown("**Weaknesses:**")
+                        for point in assessment.get('weaknesses', []):
+                            st.markdown(f"- {point}")
+            
+            st.download_button(
+                label="Download Tender Report",
+                data=tender_report_markdown(tender),
+                file_name=f"tender_comparison_{datetime.now().strftime('%Y%m%d')}.md",
+                mime="text/markdown"
+            )
+            
+            if st.session_state.get("enable_metrics", True) and tender.get('performance_metrics'):
+                # The session's metrics are set when the tender job is delivered, not on every rerun
+                create_performance_metrics(tender['performance_metrics'])
+                tender_stats = tender['performance_metrics'].get('tender')
+                if tender_stats:
+                    st.caption(f"{tender_stats['contracts']} responses, {tender_stats['concurrency']} at a time, "
+                               f"{tender_stats['retries']} retried. Stage times are summed across responses.")
+    
+    # Comparison Results Tab (Full detailed comparison)
+    with tabs[2]:
         if 'current_analysis' in st.session_state:
             analysis = st.session_state.current_analysis
+            render_start = time.time()
+            view = analysis_view(analysis)
             
-            st.markdown(f'<div style="font-size: 1.8rem; font-weight: bold; margin: 1.5rem 0 1rem 0; padding-bottom: 0.5rem; border-bottom: 2px solid #e0e0e0;">Enhanced Contract Comparison</div>', unsafe_allow_html=True)
+            st.markdown('<div style="font-size: 1.8rem; font-weight: bold; margin: 1.5rem 0 1rem 0; padding-bottom: 0.5rem; border-bottom: 2px solid #e0e0e0;">Enhanced Contract Comparison</div>', unsafe_allow_html=True)
             
             # Show executive summary if risk analysis is available
-            if 'risk_analysis' in analysis and analysis['risk_analysis']:
-                exec_summary = create_executive_summary(
-                    analysis['result'], 
-                    analysis['risk_analysis'], 
-                    analysis['contract1_name'], 
-                    analysis['contract2_name']
-                )
-                st.markdown(exec_summary, unsafe_allow_html=True)
+            if view['summary_html']:
+                st.markdown(view['summary_html'], unsafe_allow_html=True)
             
             # Show performance metrics if enabled
             if st.session_state.get("enable_metrics", True) and 'performance_metrics' in analysis:
@@ -1130,82 +4896,59 @@ def main():
             # Display custom instructions if any
             if analysis.get('custom_prompt'):
                 st.markdown("---")
-                st.markdown(f"**Custom Analysis Instructions:**")
+                st.markdown("**Custom Analysis Instructions:**")
                 st.info(analysis['custom_prompt'])
             
-            # Process the comparison text into sections
-            sections = re.split(r'### (.*?)(?:\n|$)', analysis['result'])
-            
-            if len(sections) > 1:
+            if view['sections']:
                 st.markdown("### Comparison Results")
                 # For each section, create a section with expanded differences
-                for i in range(1, len(sections), 2):
-                    if i < len(sections):
-                        category = sections[i].strip()
-                        content = sections[i+1] if i+1 < len(sections) else ""
-                        
-                        st.markdown(f"#### {category}")
-                        
-                        # Split content into contract1 and contract2 parts
-                        parts = re.split(r'#### (Contract 1|Contract 2)(?:\n|$)', content)
-                        
-                        if len(parts) > 2:  # We have proper split between contracts
-                            # Side-by-side columns for contract comparison
-                            col1, col2 = st.columns(2)
-                            
-                            contract1_content = ""
-                            contract2_content = ""
-                            
-                            for j in range(1, len(parts), 2):
-                                if j < len(parts):
-                                    contract_type = parts[j].strip()
-                                    contract_content = parts[j+1] if j+1 < len(parts) else ""
-                                    
-                                    if contract_type == "Contract 1":
-                                        contract1_content = contract_content
-                                        with col1:
-                                            st.markdown(f"**{analysis['contract1_name']}**")
-                                            st.markdown(contract_content)
-                                    elif contract_type == "Contract 2":
-                                        contract2_content = contract_content
-                                        with col2:
-                                            st.markdown(f"**{analysis['contract2_name']}**")
-                                            st.markdown(contract_content)
-                            
-                            # Extract bullet points for difference analysis
-                            bullet_pattern = r'(?:^|\n)- (.*?)(?:$|\n)'
-                            bullets1 = re.findall(bullet_pattern, contract1_content)
-                            bullets2 = re.findall(bullet_pattern, contract2_content)
-                            
-                            # Display differences section
-                            st.markdown("##### Key Differences")
-                            
-                            # Create two columns for differences
-                            diff_col1, diff_col2 = st.columns(2)
-                            
-                            with diff_col1:
-                                st.markdown(f"**Unique to {analysis['contract1_name']}:**")
-                                unique_to_1 = [b for b in bullets1 if b not in bullets2]
-                                if unique_to_1:
-                                    for bullet in unique_to_1:
-                                        st.markdown(f"<div class='unique-point-1'>- {bullet}</div>", unsafe_allow_html=True)
-                                else:
-                                    st.markdown("*No unique points*")
-                                    
-                            with diff_col2:
-                                st.markdown(f"**Unique to {analysis['contract2_name']}:**")
-                                unique_to_2 = [b for b in bullets2 if b not in bullets1]
-                                if unique_to_2:
-                                    for bullet in unique_to_2:
-                                        st.markdown(f"<div class='unique-point-2'>- {bullet}</div>", unsafe_allow_html=True)
-                                else:
-                                    st.markdown("*No unique points*")
+                for section in view['sections']:
+                    st.markdown(f"#### {section['title']}")
+                    
+                    if 'content' in section:
+                        # If no clear split between contracts, just show the content as is
+                        st.markdown(section['content'])
+                        st.markdown("---")  # Add separator between sections
+                        continue
+                    
+                    # Side-by-side columns for contract comparison
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.markdown(f"**{analysis['contract1_name']}**")
+                        st.markdown(section['contract1'])
+                    with col2:
+                        st.markdown(f"**{analysis['contract2_name']}**")
+                        st.markdown(section['contract2'])
+                    
+                    # Display differences section
+                    st.markdown("##### Key Differences")
+                    
+                    # Points both contracts cover, however differently worded
+                    if section.get('matched'):
+                        with st.expander(f"Comparable points ({len(section['matched'])})"):
+                            st.markdown(matched_bullets_table(section['matched'], analysis['contract1_name'],
+                                                              analysis['contract2_name']))
+                    
+                    # Create two columns for differences
+                    diff_col1, diff_col2 = st.columns(2)
+                    
+                    with diff_col1:
+                        st.markdown(f"**Unique to {analysis['contract1_name']}:**")
+                        if section['unique_to_1']:
+                            for bullet in section['unique_to_1']:
+                                st.markdown(f"<div class='unique-point-1'>- {bullet}</div>", unsafe_allow_html=True)
+                        else:
+                            st.markdown("*No unique points*")
                             
-                            st.markdown("---")  # Add separator between sections
+                    with diff_col2:
+                        st.markdown(f"**Unique to {analysis['contract2_name']}:**")
+                        if section['unique_to_2']:
+                            for bullet in section['unique_to_2']:
+                                st.markdown(f"<div class='unique-point-2'>- {bullet}</div>", unsafe_allow_html=True)
                         else:
-                            # If no clear split between contracts, just show the content as is
-                            st.markdown(content)
-                            st.markdown("---")  # Add separator between sections
+                            st.markdown("*No unique points*")
+                    
+                    st.markdown("---")  # Add separator between sections
             else:
                 # If no section found, display the raw text
                 st.markdown(analysis['result'])
@@ -1231,15 +4974,21 @@ def main():
                         file_name=f"risk_assessment_{datetime.now().strftime('%Y%m%d')}.json",
                         mime="application/json"
                     )
+            
+            # Rendering the results is the last pipeline stage; Technical Details shows it below
+            render_time = time.time() - render_start
+            trace_event("render_results", render_start, render_time)
+            if analysis.get('performance_metrics', {}).get('stage_times') is not None:
+                analysis['performance_metrics']['stage_times']['render'] = render_time
         else:
             st.info("Upload contracts and select focus areas to generate an interactive side-by-side comparison")
     
     # Key Findings Tab (Simplified view with scores and key points)
-    with tabs[2]:
+    with tabs[3]:
         if 'current_analysis' in st.session_state:
             analysis = st.session_state.current_analysis
             
-            st.markdown(f'<div style="font-size: 1.8rem; font-weight: bold; margin: 1.5rem 0 1rem 0; padding-bottom: 0.5rem; border-bottom: 2px solid #e0e0e0;">Key Contract Findings</div>', unsafe_allow_html=True)
+            st.markdown('<div style="font-size: 1.8rem; font-weight: bold; margin: 1.5rem 0 1rem 0; padding-bottom: 0.5rem; border-bottom: 2px solid #e0e0e0;">Key Contract Findings</div>', unsafe_allow_html=True)
             
             if 'risk_analysis' in analysis and analysis['risk_analysis']:
                 # Display dimension scores
@@ -1331,11 +5080,11 @@ def main():
                 st.warning("No analysis data available. Please go to the Contract Upload tab and compare contracts.")
     
     # Technical Details Tab
-    with tabs[3]:
+    with tabs[4]:
         if 'current_analysis' in st.session_state:
             analysis = st.session_state.current_analysis
             
-            st.markdown(f'<div style="font-size: 1.8rem; font-weight: bold; margin: 1.5rem 0 1rem 0; padding-bottom: 0.5rem; border-bottom: 2px solid #e0e0e0;">Technical Details</div>', unsafe_allow_html=True)
+            st.markdown('<div style="font-size: 1.8rem; font-weight: bold; margin: 1.5rem 0 1rem 0; padding-bottom: 0.5rem; border-bottom: 2px solid #e0e0e0;">Technical Details</div>', unsafe_allow_html=True)
             
             # Performance metrics in more detail
             if st.session_state.get("enable_metrics", True) and 'performance_metrics' in analysis:
@@ -1362,8 +5111,152 @@ def main():
                     st.progress(reduction/100)
                     st.markdown(f"**Text Reduction:** {reduction:.1f}% ({original_chars:,} → {optimized_chars:,} chars)")
                 
-                if 'estimated_cost' in metrics:
-                    st.markdown(f"**Estimated API Cost:** ${metrics.get('estimated_cost', 0):.4f}")
+                # API latency
+                if metrics.get('api_time') is not None:
+                    latency_cols = st.columns(3)
+                    with latency_cols[0]:
+                        st.metric("API Time", f"{metrics['api_time']:.2f}s")
+                    with latency_cols[1]:
+                        ttft = metrics.get('time_to_first_token')
+                        st.metric("Time to First Token", f"{ttft:.2f}s" if ttft is not None else "N/A",
+                                  help="Only measured when results are streamed")
+                    with latency_cols[2]:
+                        tps = metrics.get('output_tokens_per_second')
+                        st.metric("Output Tokens/s", f"{tps:.1f}" if tps is not None else "N/A")
+                
+                if metrics.get('queue_time') or metrics.get('api_retries'):
+                    st.markdown(f"**Rate Limiting:** waited {metrics.get('queue_time', 0):.2f}s for capacity, "
+                                f"{metrics.get('api_retries', 0)} retried requests")
+                
+                if metrics.get('api_requests'):
+                    cache_hits = metrics.get('response_cache_hits', 0)
+                    if cache_hits == metrics['api_requests']:
+                        st.markdown("**Response Cache:** served entirely from cache (no API cost)")
+                    else:
+                        st.markdown(f"**Response Cache:** {cache_hits} of {metrics['api_requests']} requests served from cache")
+                
+                # Prompt caching of the system prompt and contract blocks
+                usage = metrics.get('usage', {})
+                cache_read = usage.get('cache_read_input_tokens', 0)
+                cache_write = usage.get('cache_creation_input_tokens', 0)
+                if cache_read or cache_write:
+                    total_input = usage.get('input_tokens', 0) + cache_read + cache_write
+                    prompt_cache_cols = st.columns(3)
+                    with prompt_cache_cols[0]:
+                        st.metric("Cache Read Tokens", f"{cache_read:,}",
+                                  help="Input tokens read from the prompt cache at a fraction of the normal price")
+                    with prompt_cache_cols[1]:
+                        st.metric("Cache Write Tokens", f"{cache_write:,}",
+                                  help="Input tokens written to the prompt cache for re-runs against the same contracts")
+                    with prompt_cache_cols[2]:
+                        st.metric("Input From Cache", f"{(cache_read / total_input) * 100:.1f}%" if total_input else "N/A")
+                
+                # Per-focus-area fan-out
+                fan_out_stats = metrics.get('fan_out')
+                if fan_out_stats:
+                    st.markdown(f"**Parallel Focus Areas:** {fan_out_stats['dimensions']} areas, "
+                                f"{fan_out_stats['concurrency']} at a time, {fan_out_stats['retries']} retried")
+                    if fan_out_stats['failed']:
+                        st.warning(f"Could not analyse: {', '.join(fan_out_stats['failed'])}")
+                    call_times = {name: f"{seconds:.2f}s" for name, seconds in fan_out_stats['call_times'].items() if seconds is not None}
+                    if call_times:
+                        st.dataframe(pd.DataFrame([{"Request": name, "API Time": seconds} for name, seconds in call_times.items()]),
+                                     hide_index=True, use_container_width=True)
+                
+                # Template diff
+                template = metrics.get('template_diff')
+                if template and template['applied']:
+                    st.markdown(f"**Template Diff:** {template['shared_ratio']:.0%} of the text is shared; sent "
+                                f"{template['changes_sent']} of {template['changes']} differences and "
+                                f"{template['shared_sent']} of {template['shared_paragraphs']} shared paragraphs once, "
+                                f"saving {template['tokens_saved']:,} of {template['tokens_without_diff']:,} estimated tokens")
+                elif template:
+                    st.markdown(f"**Template Diff:** not used, only {template['shared_ratio']:.0%} of the text is shared")
+                
+                # Clause alignment
+                alignment = metrics.get('alignment')
+                if alignment:
+                    st.markdown(f"**Aligned Clauses:** {alignment['pairs']} pairs from {alignment['clauses'][0]} and "
+                                f"{alignment['clauses'][1]} clauses; sent {alignment['pairs_sent']} pairs and "
+                                f"{alignment['unmatched_sent']} unmatched clauses")
+                
+                if 'estimated_tokens' in metrics:
+                    st.markdown(f"**Estimated Input Tokens:** {metrics['estimated_tokens']:,} "
+                                f"(budget {metrics.get('token_budget', 0):,} per contract)")
+                
+                # Billed tokens and their cost, from the usage the API reported
+                if usage:
+                    st.markdown(f"### Token Usage and Cost ({metrics.get('model') or 'unknown model'})")
+                    cost = metrics.get('cost', {})
+                    token_labels = {
+                        "input_tokens": "Input",
+                        "cache_creation_input_tokens": "Cache write",
+                        "cache_read_input_tokens": "Cache read",
+                        "output_tokens": "Output",
+                    }
+                    st.dataframe(pd.DataFrame([
+                        {"Tokens": label, "Count": usage.get(name, 0), "Cost (USD)": round(cost.get(name, 0), 4)}
+                        for name, label in token_labels.items()
+                    ] + [{"Tokens": "Total", "Count": sum(usage.values()), "Cost (USD)": round(cost.get('total', 0), 4)}]),
+                                 hide_index=True, use_container_width=True)
+                    st.caption("Prices come from the per-model table (override with the MODEL_PRICES setting).")
+                
+                # Per-stage latency breakdown
+                stage_times = metrics.get('stage_times')
+                if stage_times:
+                    st.markdown("### Latency Breakdown")
+                    stage_rows = [{"Stage": STAGE_LABELS[stage], "Time (s)": round(seconds, 3)}
+                                  for stage, seconds in stage_times.items()
+                                  if stage in STAGE_LABELS and seconds is not None]
+                    st.dataframe(pd.DataFrame(stage_rows), hide_index=True, use_container_width=True)
+                    st.caption("API first token falls inside API total; the API queue is time spent waiting for the rate limiter.")
+                
+                # Share of each focus area's keyword hits that survived optimisation
+                coverage = metrics.get('coverage')
+                if coverage and any(coverage):
+                    st.markdown("### Focus Area Coverage")
+                    coverage_rows = []
+                    for area in analysis.get('focus_areas') or []:
+                        row = {"Focus Area": area}
+                        for label, contract_coverage in zip(("Contract 1", "Contract 2"), coverage):
+                            area_coverage = contract_coverage.get(area, {})
+                            row[label] = f"{area_coverage.get('kept_hits', 0)}/{area_coverage.get('total_hits', 0)} keyword hits kept"
+                        coverage_rows.append(row)
+                    st.dataframe(pd.DataFrame(coverage_rows), hide_index=True, use_container_width=True)
+                
+                # Per-document ingestion figures
+                if metrics.get('documents'):
+                    st.markdown("### Document Ingestion")
+                    st.dataframe(pd.DataFrame([
+                        {
+                            "Document": doc.get("name", ""),
+                            "File Size (KB)": round(doc.get("file_size", 0) / 1024, 1),
+                            "Extract Wait (s)": round(doc["extract_time"], 2) if doc.get("extract_time") is not None else None,
+                            "Parse Time (s)": round(doc.get("parse_time", 0), 2),
+                            "Peak Memory (MB)": round(doc["peak_memory_bytes"] / (1024 * 1024), 2) if doc.get("peak_memory_bytes") is not None else None,
+                            "Pages": len(doc.get("page_times", [])) or None,
+                            "PDF Workers": doc.get("pdf_workers"),
+                            "Source": doc.get("source", "")
+                        }
+                        for doc in metrics['documents']
+                    ]), hide_index=True, use_container_width=True)
+                    st.caption("Parse time and peak memory are measured when a document is first parsed and reused for cached copies.")
+                    
+                    # Surface pathological pages that dominate PDF extraction time
+                    for doc in metrics['documents']:
+                        page_times = doc.get("page_times")
+                        if not page_times:
+                            continue
+                        with st.expander(f"Page timings: {doc.get('name', '')}"):
+                            slowest = sorted(range(len(page_times)), key=lambda i: page_times[i], reverse=True)[:10]
+                            st.markdown(f"**Mean:** {sum(page_times) / len(page_times) * 1000:.1f} ms/page, "
+                                        f"**Slowest:** {page_times[slowest[0]] * 1000:.1f} ms (page {slowest[0] + 1})")
+                            st.dataframe(pd.DataFrame([
+                                {"Page": i + 1, "Extraction Time (ms)": round(page_times[i] * 1000, 1)}
+                                for i in slowest
+                            ]), hide_index=True, use_container_width=True)
+                            st.bar_chart(pd.DataFrame({"Extraction Time (ms)": [t * 1000 for t in page_times]},
+                                                      index=range(1, len(page_times) + 1)))
             
             # Display the raw JSON from Claude
             st.markdown("### Raw Analysis Data (JSON)")
@@ -1386,48 +5279,59 @@ def main():
             st.json(system_info)
         else:
             st.warning("No analysis data available. Please go to the Contract Upload tab and compare contracts.")
+        
+        # Profile of the last comparison, for admins who enabled profiling
+        if is_admin() and st.session_state.get("profile_stats"):
+            profile = st.session_state.profile_stats
+            st.markdown("### Profile")
+            st.download_button("Download Profile (.pstats)", data=profile["data"],
+                               file_name=f"comparison_{profile['timestamp']}.pstats",
+                               mime="application/octet-stream",
+                               help="Open with `python -m pstats` or snakeviz")
+            with st.expander("Top functions by cumulative time"):
+                st.code(profile["summary"])
+        
+        # Cache and connection statistics are process-wide, so show them even before an analysis has run
+        create_cache_metrics()
+        create_connection_metrics()
             
     # History Tab
-    with tabs[4]:
+    with tabs[5]:
         st.markdown('<div style="font-size: 1.8rem; font-weight: bold; margin: 1.5rem 0 1rem 0; padding-bottom: 0.5rem; border-bottom: 2px solid #e0e0e0;">Comparison History</div>', unsafe_allow_html=True)
         
-        if st.session_state.analysis_history:
-            for i, analysis in enumerate(reversed(st.session_state.analysis_history)):
-                with st.expander(f"{analysis['contract1_name']} vs {analysis['contract2_name']} - {analysis['timestamp']}"):
-                    # Show focus areas
-                    focus_areas = "Areas: " + ", ".join(analysis['focus_areas']) if analysis['focus_areas'] else "Custom analysis"
-                    st.markdown(f"**{focus_areas}**")
-                    
-                    # Show scores if available
-                    if 'risk_analysis' in analysis and analysis['risk_analysis']:
-                        c1_score = analysis['risk_analysis'].get('contract1_overall_score', 'N/A')
-                        c2_score = analysis['risk_analysis'].get('contract2_overall_score', 'N/A')
-                        st.markdown(f"**Scores:** {analysis['contract1_name']}: {c1_score}/100, {analysis['contract2_name']}: {c2_score}/100")
-                    
-                    # Show a preview of the analysis
-                    preview_length = min(500, len(analysis['result']))
-                    st.markdown(analysis['result'][:preview_length] + "..." if len(analysis['result']) > preview_length else analysis['result'])
-                    
-                    # Row of buttons
-                    col1, col2, col3 = st.columns([1, 1, 2])
-                    
-                    with col1:
-                        # Button to view this comparison
-                        if st.button(f"View Full Comparison", key=f"view_{i}"):
-                            st.session_state.current_analysis = analysis
-                            st.query_params["tab"] = "results"
-                            st.rerun()
-                    
-                    with col2:
-                        # Button to view key findings
-                        if st.button(f"View Key Findings", key=f"findings_{i}"):
-                            st.session_state.current_analysis = analysis
-                            st.query_params["tab"] = "key_findings"
-                            st.rerun()
-                    
-                    # Add more action buttons if needed
+        history = st.session_state.analysis_history
+        if history:
+            # Rebuilt only when an analysis is added, not on every rerun
+            if st.session_state.get("history_table_size") != (id(history), len(history)):
+                st.session_state.history_table = history_table(history)
+                st.session_state.history_table_size = (id(history), len(history))
+            table = st.session_state.history_table
+            
+            search = st.text_input("Search history", placeholder="Contract name, focus area or date", key="history_search")
+            if search:
+                table = table[table["search"].str.contains(search.strip().lower(), regex=False)]
+            
+            page_count = max(1, -(-len(table) // HISTORY_PAGE_SIZE))
+            page = 1
+            if page_count > 1:
+                page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1,
+                                       key=f"history_page_{search}")
+            page_table = table.iloc[(page - 1) * HISTORY_PAGE_SIZE:page * HISTORY_PAGE_SIZE]
+            st.caption(f"{len(table)} of {len(history)} analyses. Select a row to open it.")
+            
+            selection = st.dataframe(page_table, hide_index=True, use_container_width=True, on_select="rerun",
+                                     # A new page or search starts without a selection
+                                     selection_mode="single-row", key=f"history_selection_{page}_{search}",
+                                     column_order=["Date", "Type", "Contracts", "Focus Areas", "Result"])
+            # Only the selected analysis has its details built
+            if selection.selection.rows:
+                index = int(page_table.index[selection.selection.rows[0]])
+                render_history_entry(index, history[index])
         else:
             st.info("Your comparison history will appear here")
 
 if __name__ == "__main__":
-    main()
+    if running_in_streamlit():
+        main()
+    else:
+        sys.exit(cli())
@@ -0,0 +1,56 @@
+"""Page extraction run inside the PDF process pool of contract_app.
+
+Pool workers are started with forkserver or spawn, so they import the module
+their tasks live in. This one imports only the PDF parser, keeping worker
+start-up free of Streamlit and of contract_app's page-level `st.*` calls.
+"""
+import io
+import os
+import time
+from multiprocessing import shared_memory
+
+from PyPDF2 import PdfReader
+
+# (source key, PdfReader) of the last document this worker opened
+_worker_pdf = None
+
+
+def source_key(pdf_source):
+    """Identify a document: a path with its modification time, or a (shared memory name, size) pair."""
+    if isinstance(pdf_source, str):
+        return pdf_source, os.stat(pdf_source).st_mtime_ns
+    return pdf_source
+
+
+def read_shared_pdf(name, size):
+    """Copy a document out of a shared memory block, detaching before the creator unlinks it."""
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return io.BytesIO(bytes(block.buf[:size]))
+    finally:
+        block.close()
+
+
+def open_worker_pdf(pdf_source):
+    """Open the PDF in a pool worker, reusing the reader while ranges of the same document arrive."""
+    global _worker_pdf
+    key = source_key(pdf_source)
+    if _worker_pdf is None or _worker_pdf[0] != key:
+        stream = pdf_source if isinstance(pdf_source, str) else read_shared_pdf(*pdf_source)
+        _worker_pdf = (key, PdfReader(stream))
+    return _worker_pdf[1]
+
+
+def extract_pdf_page_range(pdf_source, start, end):
+    """Extract (text, seconds) for each page in a [start, end) range.
+
+    `pdf_source` is a file path or the (name, size) of a shared memory block
+    holding the document.
+    """
+    pdf_reader = open_worker_pdf(pdf_source)
+    pages = []
+    for page_number in range(start, end):
+        page_start = time.perf_counter()
+        text = pdf_reader.pages[page_number].extract_text()
+        pages.append((text, time.perf_counter() - page_start))
+    return pages
@@ -0,0 +1,42 @@
+"""linear_sum_assignment against brute force on small matrices."""
+import itertools
+
+import numpy as np
+import pytest
+
+from contract_app import linear_sum_assignment
+
+
+def brute_force_cost(cost):
+    """Lowest total cost over every one-to-one assignment of the shorter side."""
+    n, m = cost.shape
+    if n <= m:
+        return min(cost[range(n), columns].sum() for columns in itertools.permutations(range(m), n))
+    return min(cost[rows, range(m)].sum() for rows in itertools.permutations(range(n), m))
+
+
+@pytest.mark.parametrize("shape", [(1, 1), (3, 3), (5, 5), (6, 6), (2, 5), (4, 6), (5, 2), (6, 4)])
+def test_matches_brute_force(shape):
+    rng = np.random.default_rng(sum(shape))
+    for _ in range(20):
+        cost = rng.random(shape)
+        rows, columns = linear_sum_assignment(cost)
+        assert len(rows) == len(columns) == min(shape)
+        assert len(set(rows)) == len(rows) and len(set(columns)) == len(columns)
+        assert cost[rows, columns].sum() == pytest.approx(brute_force_cost(cost))
+
+
+def test_ties_and_integer_costs():
+    rng = np.random.default_rng(7)
+    for _ in range(20):
+        cost = rng.integers(0, 3, size=(5, 5))
+        rows, columns = linear_sum_assignment(cost)
+        assert sorted(rows) == list(range(5))
+        assert cost[rows, columns].sum() == brute_force_cost(cost)
+
+
+def test_rows_are_sorted_like_scipy():
+    cost = np.array([[4.0, 1.0, 3.0], [2.0, 0.0, 5.0], [3.0, 2.0, 2.0]])
+    rows, columns = linear_sum_assignment(cost)
+    assert list(rows) == [0, 1, 2]
+    assert list(columns) == [1, 0, 2]
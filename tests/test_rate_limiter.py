@@ -0,0 +1,100 @@
+"""The shared token buckets: refill, early wake-up and the pause after a 429."""
+import threading
+import time
+from datetime import datetime, timezone
+
+import anthropic
+import httpx
+import pytest
+
+import contract_app
+from contract_app import (acquire_rate_limit, classify_api_error, get_rate_limiter, pause_rate_limiter,
+                          refill_bucket, settle_rate_limit, update_rate_limits_from_headers)
+
+
+@pytest.fixture(autouse=True)
+def limiter(monkeypatch):
+    """A fresh limiter with 600 requests (one per 0.1 s) and 60 tokens (one per second) a minute."""
+    monkeypatch.setenv("ANTHROPIC_RPM", "600")
+    monkeypatch.setenv("ANTHROPIC_INPUT_TPM", "60")
+    monkeypatch.setenv("ANTHROPIC_OUTPUT_TPM", "60")
+    get_rate_limiter.clear()
+    yield get_rate_limiter()
+    get_rate_limiter.clear()
+
+
+def drain(limiter, name):
+    with limiter["lock"]:
+        limiter["buckets"][name].update(available=0.0, updated=time.time())
+
+
+def test_refill_is_per_minute_and_capped():
+    bucket = {"limit": 60.0, "available": 0.0, "updated": 100.0}
+    refill_bucket(bucket, 110.0)
+    assert bucket["available"] == pytest.approx(10.0)
+    refill_bucket(bucket, 1000.0)
+    assert bucket["available"] == 60.0
+    # A clock going backwards never takes tokens away
+    refill_bucket(bucket, 900.0)
+    assert bucket["available"] == 60.0
+
+
+def test_acquire_waits_for_refill(limiter):
+    assert acquire_rate_limit(10, 10) == pytest.approx(0.0, abs=0.01)
+    assert limiter["buckets"]["input_tokens"]["available"] == pytest.approx(50.0, abs=0.1)
+    
+    drain(limiter, "requests")
+    waited = acquire_rate_limit(0, 0)
+    assert 0.08 <= waited < contract_app.RATE_LIMIT_POLL_SECONDS
+    assert limiter["stats"]["waits"] == 1
+
+
+def test_oversized_request_waits_only_for_a_full_bucket(limiter):
+    # 120 input tokens can never fit a 60-token bucket; it is charged the whole bucket instead
+    assert acquire_rate_limit(120, 0) == pytest.approx(0.0, abs=0.01)
+    assert limiter["buckets"]["input_tokens"]["available"] == pytest.approx(0.0, abs=0.1)
+
+
+def test_settle_wakes_waiters(limiter):
+    drain(limiter, "input_tokens")
+    waited = []
+    waiter = threading.Thread(target=lambda: waited.append(acquire_rate_limit(30, 0)))
+    waiter.start()
+    time.sleep(0.1)
+    # Without the tokens given back this request would wait 30 seconds
+    settle_rate_limit({"input_tokens": 40}, {"input_tokens": 0})
+    waiter.join(timeout=2)
+    assert not waiter.is_alive()
+    assert waited[0] < 0.3
+
+
+def test_pause_holds_back_requests(limiter):
+    pause_rate_limiter(0.3)
+    assert limiter["stats"]["throttled"] == 1
+    waited = acquire_rate_limit(0, 0)
+    assert 0.25 <= waited < 1.0
+
+
+def test_429_pauses_for_retry_after(limiter):
+    request = httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+    error = anthropic.RateLimitError("rate limited", body=None,
+                                     response=httpx.Response(429, headers={"retry-after": "2"}, request=request))
+    before = time.time()
+    delay, message = classify_api_error(error, 0)
+    # The retry-after plus up to a second of jitter, shared by every session
+    assert 2.0 <= delay <= 3.0
+    assert "Rate limit" in message
+    assert limiter["blocked_until"] == pytest.approx(before + delay, abs=0.1)
+    assert limiter["stats"]["throttled"] == 1
+
+
+def test_headers_lower_buckets_and_pause_until_reset(limiter):
+    update_rate_limits_from_headers({"anthropic-ratelimit-input-tokens-remaining": "5"})
+    assert limiter["buckets"]["input_tokens"]["available"] == pytest.approx(5.0, abs=0.1)
+    assert limiter["blocked_until"] == 0.0
+    
+    reset = datetime.fromtimestamp(time.time() + 0.4, timezone.utc).isoformat().replace("+00:00", "Z")
+    update_rate_limits_from_headers({"anthropic-ratelimit-requests-remaining": "0",
+                                     "anthropic-ratelimit-requests-reset": reset})
+    waited = acquire_rate_limit(0, 0)
+    assert 0.3 <= waited < 1.0
@@ -0,0 +1,71 @@
+"""template_diff on a hand-made redline of one base agreement."""
+import pytest
+
+from contract_app import template_diff
+
+BASE = [
+    "1. DEFINITIONS",
+    "In this Agreement the Services means the services described in Schedule 1.",
+    "2. PAYMENT TERMS",
+    "The Customer shall pay each invoice within 30 days of receipt.",
+    "Late payments accrue interest at 2% per month.",
+    "3. CONFIDENTIALITY",
+    "Each party shall keep the other party's Confidential Information secret.",
+    "4. TERMINATION",
+    "Either party may terminate this Agreement on 90 days written notice.",
+]
+
+
+def join(paragraphs):
+    return "\n\n".join(paragraphs)
+
+
+def test_reworded_paragraph():
+    redline = list(BASE)
+    redline[3] = "The Customer shall pay each invoice within 45 days of receipt."
+    result = template_diff(join(BASE), join(redline), ["Payment Terms"], 4000)
+    
+    assert result["applied"]
+    assert result["changes"] == result["changes_sent"] == 1
+    assert result["shared_paragraphs"] == result["shared_sent"] == len(BASE) - 1
+    text = result["text"]
+    shared, differences = text.split("== DIFFERENCES ==")
+    assert "== SHARED TEXT (identical in both contracts) ==" in shared
+    # Shared paragraphs are sent once, the changed one only as a difference
+    for paragraph in BASE[:3] + BASE[4:]:
+        assert text.count(paragraph) == 1
+        assert paragraph in shared
+    assert "[Change 1" in differences
+    assert ("Contract 1: The Customer shall pay each invoice within 30 days of receipt.\n"
+            "Contract 2: The Customer shall pay each invoice within 45 days of receipt.") in differences
+
+
+def test_inserted_and_deleted_paragraphs():
+    redline = BASE[:5] + ["The Supplier shall maintain insurance of at least 1 million."] + BASE[5:8]
+    result = template_diff(join(BASE), join(redline), [], 4000)
+    
+    assert result["applied"]
+    assert result["changes"] == 2
+    differences = result["text"].split("== DIFFERENCES ==")[1]
+    assert ("Contract 1: (not present)\n"
+            "Contract 2: The Supplier shall maintain insurance of at least 1 million.") in differences
+    assert ("Contract 1: Either party may terminate this Agreement on 90 days written notice.\n"
+            "Contract 2: (not present)") in differences
+
+
+def test_rewrapped_paragraphs_are_shared():
+    rewrapped = [paragraph.replace(" ", "\n", 1) for paragraph in BASE]
+    result = template_diff(join(BASE), join(rewrapped), [], 4000)
+    
+    assert result["applied"]
+    assert result["changes"] == 0
+    assert result["shared_ratio"] == pytest.approx(1.0)
+
+
+def test_unrelated_contracts_are_not_diffed():
+    other = [f"Clause {number}: the lessee keeps the premises in good repair, item {number}." for number in range(9)]
+    result = template_diff(join(BASE), join(other), [], 4000)
+    
+    assert not result["applied"]
+    assert "text" not in result
+    assert result["shared_ratio"] < 0.6